@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+'''
+Bandwidths of transfers between memory hierarchy levels, based on benchmark kernels measured on
+the machine and shared by all models
+
+Measurements in the machine file (see likwid_bench_auto) are taken with the cores of a single
+socket. Data is placed in the memory of the same socket ('results') and, for main memory, also in
+the memory of another socket ('remote results').
+
+Bandwidths are interpolated linearly between measured core counts and stay constant beyond the
+largest one. Cores of multi-socket runs are spread evenly over the fewest sockets needed, and the
+bandwidths of all used sockets add up.
+
+Transfers are matched to benchmark kernels by their share of written streams. Between two
+kernels, the time per byte is interpolated.
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import math
+from bisect import bisect_left
+
+# numpy is imported where it is used, so loading the module (e.g., to build the command line
+# interface) stays cheap
+
+
+# Placements of data in the memory of the sockets (NUMA domains):
+#  first-touch: data is in the memory of the socket whose cores work on it
+#  interleaved: pages are distributed round-robin over the memory of all sockets
+PLACEMENTS = ['first-touch', 'interleaved']
+
+
+def socket_cores(machine, cores):
+    '''Returns list of cores used per socket, with *cores* spread over the fewest sockets.'''
+    sockets = int(math.ceil(cores/machine['cores per socket']))
+    assert sockets <= machine['sockets'], \
+        'machine file only describes {} sockets with {} cores each'.format(
+            machine['sockets'], machine['cores per socket'])
+    return [cores//sockets + (1 if socket < cores % sockets else 0)
+            for socket in range(sockets)]
+
+
+def write_allocate_factor(machine, kernel_name):
+    '''
+    Returns factor to correct bandwidth measured with benchmark kernel *kernel_name* for the
+    miss-measurement of write allocation (1 for kernels with 'write allocate' set to false).
+    '''
+    kernel_info = machine['benchmarks']['kernels'][kernel_name]
+    if not kernel_info.get('write allocate', True):
+        return 1.0
+    return (float(kernel_info['read streams']['bytes']) +
+            2.0*float(kernel_info['write streams']['bytes']) -
+            float(kernel_info['read+write streams']['bytes'])) / \
+           (float(kernel_info['read streams']['bytes']) +
+            float(kernel_info['write streams']['bytes']))
+
+
+def _kernel_streams(kernel_info):
+    '''Returns read (including loads of written cachelines) and write streams of a kernel.'''
+    return (kernel_info['read streams']['streams'] + kernel_info['write streams']['streams'] -
+            kernel_info['read+write streams']['streams'],
+            kernel_info['write streams']['streams'])
+
+
+def kernel_blend(machine, read_streams, write_streams, write_allocate=True):
+    '''
+    Returns list of (benchmark kernel name, weight) of one or two kernels, whose bandwidths are
+    blended for transfers with *read_streams* and *write_streams*.
+
+    Kernels are placed by their share of written streams. For every share, the kernel with the
+    closest number of streams is used (or the first by name). Transfers between two kernels are
+    weighted linearly by their share.
+
+    If *write_allocate* is False, *read_streams* do not include loads of written cachelines and
+    benchmark kernels with 'write allocate' set to false (i.e., non-temporal stores) are preferred.
+    '''
+    # write allocate has to be handled in kernel information (all writes are also reads), so
+    # streams without write allocation are compared as if they were allocated
+    if not write_allocate:
+        read_streams += write_streams
+    kernels = machine['benchmarks']['kernels']
+    candidates = [name for name, info in kernels.items()
+                  if info.get('write allocate', True) == write_allocate] or list(kernels)
+
+    representatives = {}
+    for name in sorted(candidates):
+        reads, writes = _kernel_streams(kernels[name])
+        share = writes/(reads + writes)
+        distance = abs(reads + writes - read_streams - write_streams)
+        if share not in representatives or distance < representatives[share][0]:
+            representatives[share] = (distance, name)
+
+    shares = sorted(representatives)
+    share = write_streams/(read_streams + write_streams) if read_streams + write_streams else 0.0
+    i = bisect_left(shares, share)
+    if i < len(shares) and shares[i] == share:
+        return [(representatives[share][1], 1.0)]
+    elif i == 0:
+        return [(representatives[shares[0]][1], 1.0)]
+    elif i == len(shares):
+        return [(representatives[shares[-1]][1], 1.0)]
+    weight = (share - shares[i-1])/(shares[i] - shares[i-1])
+    return [(representatives[shares[i-1]][1], 1.0 - weight),
+            (representatives[shares[i]][1], weight)]
+
+
+def kernel_bandwidth(machine, level, kernel_name, cores=None, threads_per_core=1,
+                     placement='first-touch'):
+    '''
+    Returns bandwidth (in B/s, corrected for write allocation) from *level* with benchmark kernel
+    *kernel_name* on *cores* cores of all sockets together (int or NumPy array), running
+    *threads_per_core* threads each. If *cores* is None, the largest bandwidth measured on one
+    socket (i.e., the saturated bandwidth) is returned.
+
+    With interleaved *placement*, every socket accesses data in the memory of all sockets in
+    equal parts. Its local and remote transfers share the cores' outstanding requests, so
+    bandwidths are combined by their harmonic mean. This needs 'remote results' for main memory
+    and only changes bandwidths of levels which have them.
+    '''
+    import numpy
+
+    assert placement in PLACEMENTS, 'unknown placement {}, supported are: {}'.format(
+        placement, ', '.join(PLACEMENTS))
+    measurements = machine['benchmarks']['measurements'][level][threads_per_core]
+    assert threads_per_core == measurements['threads per core'], \
+        'malformed measurement dictionary in machine file.'
+
+    factor = write_allocate_factor(machine, kernel_name)
+    measured_cores = numpy.array(measurements['cores'], dtype=numpy.float64)
+    local = numpy.array([float(bw) for bw in measurements['results'][kernel_name]])*factor
+    if cores is None:
+        return float(local.max())
+
+    remote = None
+    if placement == 'interleaved' and machine['sockets'] > 1:
+        if 'remote results' in measurements:
+            remote = numpy.array(
+                [float(bw) for bw in measurements['remote results'][kernel_name]])*factor
+        else:
+            assert level != machine['memory hierarchy'][-1]['level'], \
+                'interleaved placement requires remote results of {} in machine file'.format(
+                    level)
+    local_share = 1.0/machine['sockets']
+
+    def socket_bandwidth(cores_on_socket):
+        bw = numpy.interp(cores_on_socket, measured_cores, local)
+        if remote is not None:
+            bw = 1.0/(local_share/bw + (1.0 - local_share) /
+                      numpy.interp(cores_on_socket, measured_cores, remote))
+        return bw
+
+    cores = numpy.asarray(cores)
+    assert numpy.all(cores >= 1), 'at least one core is required'
+    sockets = numpy.ceil(cores/machine['cores per socket']).astype(int)
+    assert numpy.all(sockets <= machine['sockets']), \
+        'machine file only describes {} sockets with {} cores each'.format(
+            machine['sockets'], machine['cores per socket'])
+    # Sockets run the same number of cores, some one more
+    base, extra = cores//sockets, cores % sockets
+    bw = (sockets - extra)*socket_bandwidth(base) + extra*socket_bandwidth(base + 1)
+    return float(bw) if bw.ndim == 0 else bw
+
+
+def bandwidth(machine, level, cores=None, threads_per_core=1, read_streams=1, write_streams=0,
+              write_allocate=True, placement='first-touch'):
+    '''
+    Returns bandwidth (in B/s) of transfers with *read_streams* and *write_streams* from *level*
+    on *cores* cores (int or NumPy array, None for the saturated bandwidth of one socket) running
+    *threads_per_core* threads each.
+
+    Bandwidths of benchmark kernels are blended by kernel_blend() and measured by
+    kernel_bandwidth(), see there for *write_allocate* and *placement*.
+    '''
+    return 1.0/sum([
+        weight/kernel_bandwidth(machine, level, kernel_name, cores, threads_per_core, placement)
+        for kernel_name, weight in kernel_blend(
+            machine, read_streams, write_streams, write_allocate)])
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+'''
+Cache access simulation shared by the data transfer models (ECMData and Roofline)
+
+The layer condition towards every cache level is checked by tracing the accesses of a kernel
+backwards in time, until the traced data fills the cache. Accesses found in the trace are hits,
+all others are misses and all writes are evicted eventually.
+
+Writes allocate their cachelines (i.e., are also loaded), unless the level has 'write allocate'
+set to false in the machine file or the array is written with non-temporal stores. Non-temporal
+stores bypass all caches and are only evicted from the last cache level to main memory.
+
+Results only depend on the kernel with its constants, the machine, the number of cores and the
+simulation options. They are kept with the kernel until its state is cleared (i.e., for the current
+define), so all models analyzing the same define share one simulation.
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+from itertools import chain
+from collections import OrderedDict
+
+from kerncraft.intervals import Intervals
+
+
+# Default number of results kept by a Memo
+DEFAULT_MEMO_SIZE = 2**16
+
+# Pseudo-level in front of the first cache, everything accessed by the CPU passes through it
+CPU_LEVEL = {
+    'cores per group': 1,
+    'cycles per cacheline transfer': None,
+    'groups': 16,
+    'level': 'CPU',
+    'bandwidth': None,
+    'size per group': 0,
+    'threads per group': 2,
+}
+
+
+def blocking(indices, block_size, initial_boundary=0):
+    '''
+    splits list (or NumPy array) of integers into blocks of block_size. returns sorted list of
+    block indices.
+
+    first block element is located at initial_boundary (default 0).
+
+    >>> blocking([0, -1, -2, -3, -4, -5, -6, -7, -8, -9], 8)
+    [-2, -1, 0]
+    >>> blocking([0], 8)
+    [0]
+    '''
+    import numpy
+
+    return numpy.unique(numpy.floor_divide(
+        numpy.asarray(indices) - initial_boundary, block_size)).tolist()
+
+
+def _unique_in_order(offsets):
+    '''Returns NumPy array of *offsets* without repetitions, in order of first occurrence.'''
+    import numpy
+
+    unique_offsets, first_indices = numpy.unique(offsets, return_index=True)
+    return offsets[numpy.sort(first_indices)]
+
+
+def _count(offsets):
+    '''Returns total number of offsets in *offsets* (dict of variable name to dict of arrays).'''
+    return sum([len(o) for var_offsets in offsets.values() for o in var_offsets.values()])
+
+
+def _count_lines(offsets, elements_per_cacheline):
+    '''Returns total number of cachelines in *offsets* (dict of variable name to dict of arrays).'''
+    return sum([len(blocking(o, elements_per_cacheline))
+                for var_offsets in offsets.values() for o in var_offsets.values()])
+
+
+def as_lists(offsets):
+    '''Returns *offsets* (dict of variable name to dict of arrays) with arrays converted to lists.'''
+    return {var_name: {idx_order: o.tolist() for idx_order, o in var_offsets.items()}
+            for var_name, var_offsets in offsets.items()}
+
+
+def elements_per_cacheline(kernel, machine):
+    '''Returns number of elements of the kernel's datatype in one cacheline of *machine*.'''
+    element_size = kernel.datatypes_size[kernel.datatype]
+    return int(float(machine['cacheline size'])) // element_size
+
+
+class Memo(object):
+    '''
+    Memoizes results of *function* by its positional arguments, keeping at most *max_size*
+    results in least-recently-used order. Hits and misses are counted.
+    '''
+
+    def __init__(self, function, max_size=DEFAULT_MEMO_SIZE):
+        self.function = function
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self.__doc__ = function.__doc__
+
+    def __call__(self, *args):
+        try:
+            result = self._results.pop(args)
+            self.hits += 1
+        except KeyError:
+            result = self.function(*args)
+            self.misses += 1
+            if len(self._results) >= self.max_size:
+                self._results.popitem(last=False)
+        # (Re-)insert as most recently used
+        self._results[args] = result
+        return result
+
+    def __len__(self):
+        return len(self._results)
+
+    def clear(self):
+        '''Removes all results and resets statistics.'''
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        '''Returns dictionary with number of hits, misses and kept results.'''
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._results),
+                'max size': self.max_size}
+
+
+def _expand_to_cacheline_blocks(elements_per_cacheline, first, last):
+    '''
+    Returns first and last values wich align with cacheline blocks, by increasing range.
+    '''
+    return (first - first % elements_per_cacheline,
+            last - last % elements_per_cacheline + elements_per_cacheline - 1)
+
+
+# Results depend on the cacheline length in elements, so it is part of the key and results stay
+# correct for different datatypes and machines within one process
+expand_to_cacheline_blocks = Memo(_expand_to_cacheline_blocks)
+
+
+def nontemporal_arrays(kernel, arrays):
+    '''
+    Returns sorted tuple of arrays written by *kernel* with non-temporal stores. *arrays* is a list
+    of array names (names of arrays not written by the kernel are ignored), True for all written
+    arrays or None for none.
+    '''
+    if not arrays:
+        return ()
+    written = set(kernel._destinations)
+    if arrays is True:
+        return tuple(sorted(written))
+    return tuple(sorted(written.intersection(arrays)))
+
+
+def cache_access(kernel, machine, cores=1, unroll=True, cpu_level=False, nontemporal_stores=()):
+    '''
+    Returns list of per level results of the cache access simulation of *kernel* (with its current
+    constants) on *machine*, for all levels of the memory hierarchy except main memory.
+
+    Each level is a dictionary with 'level', 'trace length', 'misses', 'hits' and 'evicts' (dicts
+    of variable name to dict of index order to NumPy array of offsets), as well as their total
+    counts in elements ('total misses', ...) and in cachelines ('total lines misses', ...).
+    'write allocate' is False if cachelines of some evicts have not been loaded into the level.
+
+    *cores* reduces the size of shared caches, if *unroll* is True one iteration covers one
+    cacheline worth of work and if *cpu_level* is True the CPU pseudo-level (see CPU_LEVEL) is
+    simulated in front of the first cache. Arrays in *nontemporal_stores* are written with
+    non-temporal stores (see nontemporal_arrays()).
+
+    Results are shared by all callers until the kernel's state is cleared and must not be modified.
+    '''
+    key = (machine, cores, unroll, cpu_level, tuple(sorted(nontemporal_stores)),
+           tuple(sorted([(str(k), v) for k, v in kernel._constants.items()])))
+    if key not in kernel._cache_accesses:
+        kernel._cache_accesses[key] = simulate(
+            kernel, machine, cores, unroll, cpu_level, nontemporal_stores)
+    return kernel._cache_accesses[key]
+
+
+def simulate(kernel, machine, cores=1, unroll=True, cpu_level=False, nontemporal_stores=()):
+    '''Simulates cache access, see cache_access() for arguments and results.'''
+    import numpy
+
+    read_offsets = {var_name: dict() for var_name in list(kernel._variables.keys())}
+    write_offsets = {var_name: dict() for var_name in list(kernel._variables.keys())}
+
+    # handle multiple datatypes
+    element_size = kernel.datatypes_size[kernel.datatype]
+    cacheline_elements = elements_per_cacheline(kernel, machine)
+
+    # Access pattern is compiled once per kernel and only evaluated with current constants
+    kernel_read_offsets, kernel_write_offsets, iteration_offsets = kernel.access_offsets()
+    array_sizes = kernel.array_sizes()
+
+    # Offsets are kept in NumPy integer arrays
+    no_offsets = numpy.zeros(0, dtype=numpy.int64)
+    for offsets, kernel_offsets in [(read_offsets, kernel_read_offsets),
+                                    (write_offsets, kernel_write_offsets)]:
+        for var_name, var_offsets in kernel_offsets.items():
+            for idx_order, idx_offsets in var_offsets.items():
+                offsets[var_name][idx_order] = numpy.array(idx_offsets, dtype=numpy.int64)
+
+                # Do unrolling so that one iteration equals one cacheline worth of workload:
+                # unrolling is done on inner-most loop only!
+                if unroll and cacheline_elements > 1:
+                    iter_offset = iteration_offsets[var_name][idx_order]
+                    # Remove multiple access to same offsets
+                    offsets[var_name][idx_order] = numpy.unique(numpy.add.outer(
+                        numpy.arange(cacheline_elements)*iter_offset,
+                        offsets[var_name][idx_order]))[::-1]
+
+    # Offsets only written (not read) need to be loaded if the cache allocates on writes
+    write_only_offsets = {
+        var_name: {idx_order: numpy.setdiff1d(
+            idx_offsets, read_offsets[var_name].get(idx_order, no_offsets))
+            for idx_order, idx_offsets in var_offsets.items()}
+        for var_name, var_offsets in write_offsets.items()}
+
+    memory_hierarchy = list(machine['memory hierarchy'])
+    if cpu_level:
+        memory_hierarchy.insert(0, CPU_LEVEL)
+    last_cache_level = len(memory_hierarchy) - 2
+
+    # Check for layer condition towards all cache levels (except main memory/last level)
+    levels = []
+    for cache_level, cache_info in list(enumerate(memory_hierarchy))[:-1]:
+        # Arrays written without allocating their cachelines in this level (everything passes the
+        # CPU pseudo-level)
+        if cache_info is CPU_LEVEL:
+            no_allocate = set()
+        elif not cache_info.get('write allocate', True):
+            no_allocate = set(write_offsets)
+        else:
+            no_allocate = set(nontemporal_stores)
+
+        cache_size = int(float(cache_info['size per group']))
+        # reduce cache size in parallel execution
+        if cores > 1 and cache_info['cores per group'] is not None and \
+                cache_info['cores per group'] > 1:
+            if cores < cache_info['cores per group']:
+                cache_size /= cores
+            else:
+                cache_size /= cache_info['cores per group']
+
+        trace_length = 0
+        updated_length = True
+        while updated_length:
+            updated_length = False
+
+            # Initialize cache, misses, hits and evicts for current level
+            cache = {}
+            misses = {}
+            hits = {}
+
+            # We consider everythin a miss in the beginning, unless it is completly cached
+            for name in chain(read_offsets.keys(), write_offsets.keys()):
+                cache[name] = {}
+                misses[name] = {}
+                hits[name] = {}
+
+                for idx_order in chain(read_offsets[name].keys(), write_offsets[name].keys()):
+                    cache[name][idx_order] = Intervals()
+
+                    # Check for complete caching/in-cache
+                    # TODO change from pessimistic to more realistic approach (different
+                    #      indexes are treasted as individual arrays)
+                    if not levels:
+                        accessed = numpy.sort(numpy.concatenate([
+                            read_offsets.get(name, {}).get(idx_order, no_offsets),
+                            write_offsets.get(name, {}).get(idx_order, no_offsets)]))[::-1]
+                    else:
+                        accessed = levels[-1]['misses'][name][idx_order]
+                    if name in no_allocate and idx_order in write_only_offsets[name]:
+                        accessed = accessed[~numpy.isin(
+                            accessed, write_only_offsets[name][idx_order])]
+
+                    if array_sizes[name] < trace_length:
+                        # all hits no misses
+                        misses[name][idx_order] = no_offsets
+                        hits[name][idx_order] = accessed
+
+                    # partial caching (default case)
+                    else:
+                        misses[name][idx_order] = accessed
+                        hits[name][idx_order] = no_offsets
+
+            # Caches are still empty (thus only misses)
+            trace_count = 0
+            cache_used_size = 0
+
+            # Now we trace the cache access backwards (in time/iterations) and check for hits
+            for var_name in list(misses.keys()):
+                for idx_order in list(misses[var_name].keys()):
+                    iter_offset = iteration_offsets[var_name][idx_order]
+
+                    # Add cache trace
+                    accessed = misses[var_name][idx_order]
+                    cached = numpy.zeros(len(accessed), dtype=bool)
+                    for i, offset in enumerate(accessed.tolist()):
+                        # If already present in cache add to hits
+                        cached[i] = offset in cache[var_name][idx_order]
+
+                        # Add cache, we can do this since misses are sorted in reverse order of
+                        # access and we assume LRU cache replacement policy
+                        if iter_offset <= cacheline_elements:
+                            # iterations overlap, thus we can savely add the whole range
+                            cached_first, cached_last = expand_to_cacheline_blocks(
+                                cacheline_elements, offset-iter_offset*trace_length, offset+1)
+                            cache[var_name][idx_order].add(cached_first, cached_last+1)
+                        else:
+                            # There is no overlap, we can append the ranges onto one another
+                            # TODO optimize this code section (and maybe merge with above)
+                            new_cache = [
+                                expand_to_cacheline_blocks(cacheline_elements, o, o)
+                                for o in range(
+                                    offset-iter_offset*trace_length, offset+1, iter_offset)]
+                            cache[var_name][idx_order].update(new_cache)
+
+                    # We might have multiple hits on the same offset (e.g in DAXPY)
+                    misses[var_name][idx_order] = accessed[~cached]
+                    hits[var_name][idx_order] = _unique_in_order(
+                        numpy.concatenate([hits[var_name][idx_order], accessed[cached]]))
+
+                    trace_count += len(cache[var_name][idx_order].data)
+                    cache_used_size += len(cache[var_name][idx_order])*element_size
+
+            # Calculate new possible trace_length according to free space in cache
+            # TODO take CL blocked access into account
+            # TODO make /2 customizable
+            #new_trace_length = trace_length + \
+            #    ((cache_size/2 - cache_used_size)/trace_count)/element_size
+            if trace_count > 0:  # to catch complete caching
+                new_trace_length = trace_length + \
+                    ((cache_size - cache_used_size)/trace_count)/element_size
+
+            if new_trace_length > trace_length:
+                trace_length = new_trace_length
+                updated_length = True
+
+        # All writes to require the data to be evicted eventually, non-temporal stores only from
+        # the CPU (pseudo-level) and the last cache level
+        evicts = {var_name: dict() for var_name in kernel._variables.keys()}
+        for name in write_offsets.keys():
+            for idx_order in write_offsets[name].keys():
+                if name in nontemporal_stores and cache_info is not CPU_LEVEL and \
+                        cache_level != last_cache_level:
+                    evicts[name][idx_order] = no_offsets
+                else:
+                    evicts[name][idx_order] = write_offsets[name][idx_order]
+
+        # Compiling stats
+        levels.append({
+            'level': cache_info['level'],
+            'trace length': trace_length,
+            'misses': misses,
+            'hits': hits,
+            'evicts': evicts,
+            'total misses': _count(misses),
+            'total hits': _count(hits),
+            'total evicts': _count(evicts),
+            'total lines misses': _count_lines(misses, cacheline_elements),
+            'total lines hits': _count_lines(hits, cacheline_elements),
+            'total lines evicts': _count_lines(evicts, cacheline_elements),
+            'write allocate': not any([len(evicts[name][idx_order]) for name in no_allocate
+                                       for idx_order in evicts[name]])})
+
+    return levels
@@ -2,49 +2,119 @@
 '''
 A simple interval implementation
 '''
+from __future__ import division
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Bounds are stored as 64 bit integers, so large offsets stay exact ('q' is not available with
+# Python 2, where 'l' is 64 bit wide on common platforms)
+try:
+    _TYPECODE = array('q').typecode
+except ValueError:
+    _TYPECODE = 'l'
+
 
 class Intervals(object):
-    '''Very simple interval implementation for integers (might also work on floats)'''
+    '''
+    Set of half-open ranges [lower, upper) of integers
+
+    Ranges are kept sorted, non-overlapping and non-touching in two compact arrays of lower and
+    upper bounds, so membership is checked by bisection and single ranges are merged in place.
+    '''
 
     def __init__(self, *args, **kwargs):
-        '''If keywords *sane* is True (default: False), checks will not be done on given data.'''
-        self.data = list(args)
-        if not kwargs.get('sane', False):
-            self.data = [d for d in self.data if d[1] > d[0]]
-            self._enforce_order()
-            self._enforce_no_overlap()
-
-    def _enforce_order(self):
-        '''Enforces the order of all entries in internal storage'''
-        self.data.sort(key=lambda d: d[0])
-
-    def _enforce_no_overlap(self, start_at=0):
-        '''Enforces that no ranges overlap in internal storage'''
-        i = start_at
-        while i+1 < len(self.data):
-            if self.data[i][1] >= self.data[i+1][0]:
-                # beginning of i+1-th range is contained in i-th range
-                if self.data[i][1] < self.data[i+1][1]:
-                    # i+1-th range is longer, thus enlarge i-th range
-                    self.data[i][1] = self.data[i+1][1]
-
-                # removed contained range
-                del self.data[i+1]
-            i += 1
+        '''
+        If keywords *sane* is True (default: False), given ranges are assumed to be sorted and not
+        to overlap, thus checks will not be done on given data.
+        '''
+        if kwargs.get('sane', False):
+            self._lower = array(_TYPECODE, [int(d[0]) for d in args])
+            self._upper = array(_TYPECODE, [int(d[1]) for d in args])
+        else:
+            self._lower = array(_TYPECODE)
+            self._upper = array(_TYPECODE)
+            for lower, upper in args:
+                self.add(lower, upper)
+
+    @property
+    def data(self):
+        '''List of [lower, upper] ranges'''
+        return [[lower, upper] for lower, upper in zip(self._lower, self._upper)]
+
+    def add(self, lower, upper):
+        '''Adds range [*lower*, *upper*) in place, merging it with overlapping or touching ranges'''
+        lower, upper = int(lower), int(upper)
+        if upper <= lower:
+            return
+        # ranges i to j-1 overlap or touch the new range
+        i = bisect_left(self._upper, lower)
+        j = bisect_right(self._lower, upper)
+        if i == j:
+            self._lower.insert(i, lower)
+            self._upper.insert(i, upper)
+        else:
+            self._lower[i:j] = array(_TYPECODE, [min(lower, self._lower[i])])
+            self._upper[i:j] = array(_TYPECODE, [max(upper, self._upper[j-1])])
+
+    def update(self, lower, upper=None):
+        '''
+        Adds many ranges in place, either given as sequence of [lower, upper] ranges in *lower*
+        or as two sequences (or NumPy arrays) of bounds in *lower* and *upper*.
+        '''
+        import numpy
+
+        if upper is None:
+            bounds = numpy.array(lower, dtype=numpy.int64).reshape(-1, 2)
+            lower, upper = bounds[:, 0], bounds[:, 1]
+        lower = numpy.concatenate([numpy.frombuffer(self._lower, dtype=numpy.int64),
+                                   numpy.asarray(lower, dtype=numpy.int64)])
+        upper = numpy.concatenate([numpy.frombuffer(self._upper, dtype=numpy.int64),
+                                   numpy.asarray(upper, dtype=numpy.int64)])
+
+        # drop empty ranges and sort by lower bound
+        nonempty = upper > lower
+        lower, upper = lower[nonempty], upper[nonempty]
+        order = numpy.argsort(lower, kind='mergesort')
+        lower, upper = lower[order], upper[order]
+
+        if len(lower):
+            # a new range begins where the lower bound lies beyond all preceding upper bounds
+            reach = numpy.maximum.accumulate(upper)
+            starts = numpy.flatnonzero(numpy.concatenate([[True], lower[1:] > reach[:-1]]))
+            lower, upper = lower[starts], numpy.maximum.reduceat(upper, starts)
+
+        self._lower = array(_TYPECODE, lower.tolist())
+        self._upper = array(_TYPECODE, upper.tolist())
 
     def __and__(self, other):
         '''Combines two intervals, under the assumption that they are sane'''
-        return Intervals(*(self.data+other.data))
+        combined = Intervals()
+        combined._lower, combined._upper = array(_TYPECODE, self._lower), array(_TYPECODE, self._upper)
+        combined &= other
+        return combined
+
+    def __iand__(self, other):
+        '''Combines *other* intervals into this one in place'''
+        if len(other._lower) == 1:
+            self.add(other._lower[0], other._upper[0])
+        elif len(other._lower) > 1:
+            self.update(other._lower, other._upper)
+        return self
 
     def __len__(self):
         '''Returns sum of range lengths'''
-        return int(sum(upper-lower for (lower, upper) in self.data))
+        return int(sum(upper-lower for lower, upper in zip(self._lower, self._upper)))
 
     def __contains__(self, needle):
-        return any(lower <= needle < upper for (lower, upper) in self.data)
+        i = bisect_right(self._lower, needle) - 1
+        return i >= 0 and needle < self._upper[i]
 
     def __repr__(self):
         return str(self.__class__) + '(' + ', '.join([list.__repr__(d) for d in self.data]) + ')'
 
     def __eq__(self, other):
-        return self.data == other.data
+        return self._lower == other._lower and self._upper == other._upper
+
+    def __ne__(self, other):
+        return not self == other
@@ -8,21 +8,32 @@ from __future__ import division
 import argparse
 import sys
 import os.path
-import pickle
+import glob
+import ast
 import shutil
 import math
 import re
 import itertools
-import operator
+import functools
+import copy
+import tempfile
+import subprocess
+import multiprocessing
+from multiprocessing.util import Finalize
+from collections import OrderedDict
+from io import StringIO
 
-from .pycparser import clean_code
-import sympy
 import six
 from six.moves import range
 
 from . import models
-from .kernel import Kernel
+from . import bandwidth
 from .machinemodel import MachineModel
+from .resultcache import ResultCache
+from .resultstore import ResultStore, is_result_store
+from .records import RecordWriter, result_record
+# sympy and the C parser (i.e., kernel and pycparser modules) are slow to import, they are only
+# imported once an analysis is actually run (not for --help or malformed arguments)
 
 
 def space(start, stop, num, endpoint=True, log=False, base=10):
@@ -91,10 +102,10 @@ class AppendStringRange(argparse.Action):
         if message:
             raise argparse.ArgumentError(self, message)
 
-        if hasattr(namespace, self.dest):
-            getattr(namespace, self.dest).append(values)
-        else:
-            setattr(namespace, self.dest, [values])
+        # Copy list, so the default list of the parser is not modified
+        items = list(getattr(namespace, self.dest, None) or [])
+        items.append(values)
+        setattr(namespace, self.dest, items)
 
 
 def create_parser():
@@ -110,8 +121,17 @@ def create_parser():
                              'permutation s will be tested. Overwrites constants from testcase '                                 'file.')
     parser.add_argument('--verbose', '-v', action='count', default=0,
                         help='Increases verbosity level.')
-    parser.add_argument('code_file', metavar='FILE', type=argparse.FileType(),
-                        help='File with loop kernel C code')
+    parser.add_argument('code_files', metavar='FILE', nargs='*', default=[],
+                        help='Files with loop kernel C code. Directories are searched for *.c '
+                             'files and glob patterns are expanded.')
+    parser.add_argument('--manifest', metavar='MANIFEST', type=argparse.FileType('r'),
+                        help='Analyze all kernels listed in MANIFEST, one "KERNEL [TESTCASES]" '
+                             'per line (paths relative to MANIFEST). Constants are taken from '
+                             'the testcases file, unless overwritten by --define.')
+    parser.add_argument('--testcases', metavar='TESTCASES',
+                        help='Take constants from TESTCASES file (see '
+                             'examples/kernels/*.testcases) for all kernels given as FILE, '
+                             'unless overwritten by --define.')
     parser.add_argument('--asm-block', metavar='BLOCK', default='auto',
                         help='Number of ASM block to mark for IACA, "auto" for automatic '
                              'selection or "manual" for interactiv selection.')
@@ -119,15 +139,67 @@ def create_parser():
                         help='Increment of stor pointer within one ASM block in bytes. If 0, '
                              'automatic detetection will be used and can lead to user input being '
                              'required.')
-    parser.add_argument('--store', metavar='PICKLE', type=argparse.FileType('a+b'),
-                        help='Addes results to PICKLE file for later processing.')
+    parser.add_argument('--store', metavar='DATABASE',
+                        help='Adds results to DATABASE (SQLite) file for later processing.')
+    parser.add_argument('--skip-stored', action='store_true',
+                        help='Skip defines with results of all selected models already in --store '
+                             '(regardless of the machine they were analyzed on).')
     parser.add_argument('--unit', '-u', choices=['cy/CL', 'It/s', 'FLOP/s'],
                         help='Select the output unit, defaults to model specific if not given.')
     parser.add_argument('--cores', '-c', metavar='CORES', type=int, default=1,
                         help='Number of cores to be used in parallel. (default: 1)')
+    parser.add_argument('--numa-placement', choices=bandwidth.PLACEMENTS, default='first-touch',
+                        help='Placement of data in the memory of the sockets, used for bandwidths '
+                             'of runs with more cores than one socket has or with interleaved '
+                             'memory. (default: first-touch)')
+    parser.add_argument('--nontemporal-stores', metavar='ARRAYS', nargs='?', const=True,
+                        type=lambda s: s.split(','),
+                        help='Arrays (comma separated, all written arrays if none are given) '
+                             'are written with non-temporal stores, which bypass caches and do '
+                             'not allocate cachelines. Used by ECMData, ECM and Roofline models.')
     parser.add_argument('--latency', action='store_true',
                         help='Use pessimistic IACA latency instead of throughput prediction.')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int, default=1,
+                        help='Number of processes used to analyze define permutations in '
+                             'parallel, 0 uses all available CPUs. (default: 1)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not use or update the result cache.')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='Directory of the result cache. (default: '
+                             '$XDG_CACHE_HOME/kerncraft or ~/.cache/kerncraft)')
+    output_group = parser.add_mutually_exclusive_group()
+    output_group.add_argument('--json', action='store_true',
+                              help='Instead of reports, output one JSON record per kernel, define '
+                                   'and model and line, as soon as it was analyzed.')
+    output_group.add_argument('--csv', action='store_true',
+                              help='Instead of reports, output CSV rows of kernel, machine, '
+                                   'define, model, result name and value.')
     
+    ag = parser.add_argument_group(
+        'automatic define selection', 'Used if neither --define nor --testcases are given.')
+    ag.add_argument('--sweep-points', metavar='POINTS', type=int, default=20,
+                    help='Number of sizes per level of the memory hierarchy. (default: 20)')
+    ag.add_argument('--sweep-levels', metavar='LEVELS', type=lambda s: s.split(','),
+                    help='Comma separated levels to place sizes in, e.g. L1,L2,L3,MEM. '
+                         '(default: all levels of the machine)')
+    ag.add_argument('--sweep-mode', choices=['inner', 'total'], default='inner',
+                    help='"inner" sweeps the inner-most dimension and keeps the data set at '
+                         'SIZE, "total" grows all dimensions together up to SIZE. '
+                         '(default: inner)')
+    ag.add_argument('--sweep-size', metavar='SIZE', type=int, default=1024**3,
+                    help='Data set size in bytes. (default: 1073741824)')
+
+    ag = parser.add_argument_group(
+        'adaptive refinement', 'Bisects intervals between defines which differ in a single '
+        'constant (e.g., -D N 100-100000:10log10 -D M 50), if any result changed in between.')
+    ag.add_argument('--refine', action='store_true',
+                    help='Refine sweep around changes in results.')
+    ag.add_argument('--refine-threshold', metavar='CHANGE', type=float, default=0.05,
+                    help='Relative change of any result value considered a transition. '
+                         '(default: 0.05)')
+    ag.add_argument('--refine-resolution', metavar='DISTANCE', type=int, default=1,
+                    help='Stop bisecting intervals shorter than DISTANCE. (default: 1)')
+
     for m in models.__all__:
         ag = parser.add_argument_group('arguments for '+m+' model', getattr(models, m).name)
         getattr(models, m).configure_arggroup(ag)
@@ -141,118 +213,453 @@ def check_arguments(args, parser):
         except ValueError:
             parser.error('--asm-block can only be "auto", "manual" or an integer')
 
-def run(parser, args, output_file=sys.stdout):
-    # Try loading results file (if requested)
-    result_storage = {}
-    if args.store:
-        args.store.seek(0)
-        try:
-            result_storage = pickle.load(args.store)
-        except EOFError:
-            pass
-        args.store.close()
-    
-    # machine information
-    # Read machine description
-    machine = MachineModel(args.machine.name)
-
-    # process kernel
-    code = six.text_type(args.code_file.read())
-    code = clean_code(code)
-    kernel = Kernel(code, filename=args.code_file.name)
-
-    # if no defines were given, guess suitable defines in-mem
-    # TODO support in-cache
-    # TODO broaden cases to n-dimensions
-    # TODO make configurable (no hardcoded 512MB/1GB/min. 3 iteration ...)
-    # works only for up to 3 dimensions
-    if not args.define:
-        required_consts = [v[1] for v in kernel._variables.itervalues() if v[1] is not None]
-        assert all([1 <= len(rc) <= 3 for rc in required_consts]), "Automatic selection of " + \
-            "defines only works with up to 3 dimensions."
-        inner_loop_syms = kernel._loop_stack[-1][2].free_symbols
-        assert len(inner_loop_syms) == 1, "Automatic selection can only work, if " + \
-            "inner-most loop's max statement contains exactly one constant/define (e.g. N)."
-        inner_loop_const = inner_loop_syms.pop()
-        define_product = []
-
-        # From 100 elements to 512MB of data with 150 data points on log10 scale
-        for inner_dim_size in space(
-                100, int(0.5*1025**3/kernel.datatypes_size[kernel.datatype]), 150, log=True):
-            current_define = [(inner_loop_const, inner_dim_size)]
-
-            # we choose all other constants, such that the largest array consumes 1-3GB of memory:
-            array_dims = sorted(required_consts, key=len)[-1]
-            array_size = reduce(operator.mul, array_dims).subs(inner_loop_const, inner_dim_size)
-            assert 0 <= len(array_size.free_symbols) <= 1, "Automatic selection can only  " + \
-                "work, if arrays depend only on the inner-loop constant and one more " + \
-                "constant (at most)."
-            
-            if len(array_size.free_symbols) == 1:
-                define_product.append([
-                    (inner_loop_const, inner_dim_size),
-                    (array_size.free_symbols.pop(),
-                     max(int(sympy.solve(sympy.Eq(array_size, 1024**3))[0]), 3))]) # min 3 it.
-            else:
-                define_product.append([(inner_loop_const, inner_dim_size)])
-    else:
-        # build defines permutations
-        define_dict = {}
-        for name, values in args.define:
-            if name not in define_dict:
-                define_dict[name] = [[name, v] for v in values]
+    if args.jobs < 0:
+        parser.error('--jobs must be a positive integer or 0')
+    elif args.jobs == 0:
+        args.jobs = multiprocessing.cpu_count()
+    if args.jobs > 1 and args.asm_block == 'manual':
+        parser.error('--asm-block manual requires user interaction and can not be used with --jobs')
+
+    # Expand kernel arguments to list of (kernel path, testcases path or None)
+    args.kernels = []
+    for path in args.code_files:
+        if os.path.isdir(path):
+            paths = sorted(glob.glob(os.path.join(path, '*.c')))
+        elif not os.path.exists(path) and glob.has_magic(path):
+            paths = sorted(glob.glob(path))
+        else:
+            paths = [path]
+        if not paths:
+            parser.error('no kernel files found for {}'.format(path))
+        args.kernels += [(p, args.testcases) for p in paths]
+    if args.manifest:
+        base_dir = os.path.dirname(args.manifest.name)
+        for line in args.manifest:
+            line = line.split('#', 1)[0].split()
+            if not line:
                 continue
-            for v in values:
-                if v not in define_dict[name]:
-                    define_dict[name].append([name, v])
-        define_product = list(itertools.product(*list(define_dict.values())))
-    
-    for define in define_product:
-        # Reset state of kernel
-        kernel.clear_state()
-
-        # Add constants from define arguments
-        for k, v in define:
-            kernel.set_constant(k, v)
-
-        for model_name in set(args.pmodel):
-            # print header
-            print('{:=^80}'.format(' kerncraft '), file=output_file)
-            print('{:<40}{:>40}'.format(args.code_file.name, '-m '+args.machine.name),
-                  file=output_file)
-            print(' '.join(['-D {} {}'.format(k,v) for k,v in define]), file=output_file)
-            print('{:-^80}'.format(' '+model_name+' '), file=output_file)
-            
-            if args.verbose > 1:
-                kernel.print_kernel_code(output_file=output_file)
-                print('', file=output_file)
-                kernel.print_variables_info(output_file=output_file)
-                kernel.print_kernel_info(output_file=output_file)
-            if args.verbose > 0:
-                kernel.print_constants_info(output_file=output_file)
-            
+            if len(line) > 2:
+                parser.error('malformed line in manifest {}: {}'.format(
+                    args.manifest.name, ' '.join(line)))
+            args.kernels.append(tuple(os.path.join(base_dir, p) for p in line) +
+                                (None,)*(2-len(line)))
+        args.manifest.close()
+    args.kernels = list(OrderedDict.fromkeys(args.kernels))
+    if not args.kernels:
+        parser.error('at least one kernel FILE or a --manifest is required')
+    if args.sweep_points < 1:
+        parser.error('--sweep-points must be a positive integer')
+    if args.refine_resolution < 1:
+        parser.error('--refine-resolution must be a positive integer')
+    if args.skip_stored and not args.store:
+        parser.error('--skip-stored requires --store')
+    if args.store and not is_result_store(args.store):
+        parser.error('--store {} is not a result store database'.format(args.store))
+    for path in set(p for k in args.kernels for p in k if p is not None):
+        if not os.path.isfile(path):
+            parser.error("can't open '{}'".format(path))
+
+    # Results are stored by file name of the kernel
+    kernel_names = {}
+    for path, testcases in args.kernels:
+        kernel_names.setdefault(os.path.basename(path), set()).add(os.path.abspath(path))
+    for name, paths in kernel_names.items():
+        if len(paths) > 1:
+            parser.error('kernel file name {} is not unique: {}'.format(
+                name, ', '.join(sorted(paths))))
+
+
+def _cache_options(args):
+    '''Returns dictionary of all arguments a model analysis and its report may depend on.'''
+    ignored = ['machine', 'code_files', 'manifest', 'testcases', 'kernels', 'define', 'pmodel',
+               'store', 'skip_stored', 'sweep_points', 'sweep_levels', 'sweep_mode', 'sweep_size',
+               'refine', 'refine_threshold', 'refine_resolution', 'jobs', 'no_cache', 'cache_dir',
+               'json', 'csv']
+    return dict([(k, six.text_type(v)) for k, v in vars(args).items() if k not in ignored])
+
+
+def _cacheable(model_name, args):
+    '''Returns True if analysis of *model_name* may be taken from the result cache.'''
+    # Manual block selection depends on user input and plots are written while reporting
+    return (getattr(getattr(models, model_name), 'cacheable', True) and
+            args.asm_block != 'manual' and not getattr(args, 'ecm_plot', None))
+
+
+# --version output of external tools, per process
+_tool_versions = {}
+
+
+def _tool_version(command):
+    '''Returns --version output of *command*, or why it is not available.'''
+    if command not in _tool_versions:
+        try:
+            output = subprocess.Popen(
+                [command, '--version'], stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT).communicate()[0].decode('utf-8', 'replace')
+        except OSError as e:
+            output = 'not available: {}'.format(e)
+        _tool_versions[command] = output
+    return _tool_versions[command]
+
+
+def _cache_key(cache, kernel, machine, define, model_name, args):
+    '''
+    Returns key of analysis of *model_name* in *cache*, including versions of the external tools
+    the model uses (so that results are not reused after an upgrade of the toolchain).
+    '''
+    options = _cache_options(args)
+    for tool in getattr(getattr(models, model_name), 'tools', []):
+        command = machine['compiler'] if tool == 'compiler' else tool
+        options['version of {}'.format(tool)] = _tool_version(command)
+    return cache.key(kernel.kernel_code, machine, define, model_name, options)
+
+
+def analyze_define(kernel, machine, args, define, code_name, parser=None,
+                   output_file=sys.stdout, cache=None):
+    '''
+    Analyzes *kernel* on *machine* with all models selected in *args*, using constants from
+    *define*. Reports are written to *output_file*, *code_name* is used in the report header.
+
+    If a ResultCache is passed as *cache*, analyses are taken from and added to it.
+
+    Returns list of (model name, model results) tuples in order of selection.
+    '''
+    # Reset state of kernel
+    kernel.clear_state()
+
+    # Add constants from define arguments
+    for k, v in define:
+        kernel.set_constant(k, v)
+
+    analyses = []
+    for model_name in OrderedDict.fromkeys(args.pmodel):
+        # print header
+        print('{:=^80}'.format(' kerncraft '), file=output_file)
+        print('{:<40}{:>40}'.format(code_name, '-m '+machine._path), file=output_file)
+        print(' '.join(['-D {} {}'.format(k, v) for k, v in define]), file=output_file)
+        print('{:-^80}'.format(' '+model_name+' '), file=output_file)
+
+        if args.verbose > 1:
+            kernel.print_kernel_code(output_file=output_file)
+            print('', file=output_file)
+            kernel.print_variables_info(output_file=output_file)
+            kernel.print_kernel_info(output_file=output_file)
+        if args.verbose > 0:
+            kernel.print_constants_info(output_file=output_file)
+
+        cache_key = None
+        cached = None
+        if cache is not None and _cacheable(model_name, args):
+            cache_key = _cache_key(cache, kernel, machine, define, model_name, args)
+            cached = cache.get(cache_key)
+
+        if cached is not None:
+            results, report = cached
+        else:
             model = getattr(models, model_name)(kernel, machine, args, parser)
 
             model.analyze()
-            model.report(output_file=output_file)
-            
-            # Add results to storage
-            kernel_name = os.path.split(args.code_file.name)[1]
-            if kernel_name not in result_storage:
-                result_storage[kernel_name] = {}
-            if tuple(kernel._constants.items()) not in result_storage[kernel_name]:
-                result_storage[kernel_name][tuple(kernel._constants.items())] = {}
-            result_storage[kernel_name][tuple(kernel._constants.items())][model_name] = \
-                model.results
-            
-            print('', file=output_file)
-        
-        # Save storage to file (if requested)
-        if args.store:
-            tempname = args.store.name + '.tmp'
-            with open(tempname, 'wb+') as f:
-                pickle.dump(result_storage, f)
-            shutil.move(tempname, args.store.name)
+            report = StringIO()
+            model.report(output_file=report)
+            results, report = model.results, report.getvalue()
+
+            if cache_key is not None:
+                cache.put(cache_key, (results, report))
+
+        print(report, end='', file=output_file)
+        analyses.append((model_name, results))
+
+        print('', file=output_file)
+
+    return analyses
+
+
+class WorkerExit(Exception):
+    '''Raised in place of SystemExit within worker processes, to be re-raised by the parent.'''
+    pass
+
+
+# State of a worker process, initialized by _init_worker()
+_worker_state = {}
+
+
+def _init_worker(machine_path, args, cache):
+    '''Initializes worker process with its own MachineModel and a private scratch directory.'''
+    _worker_state['machine'] = MachineModel(machine_path)
+    _worker_state['args'] = args
+    _worker_state['cache'] = cache
+    _worker_state['kernels'] = {}
+    # Compiled and IACA marked files are placed next to the kernel file, so every worker needs its
+    # own copy to not interfere with others
+    _worker_state['scratch_dir'] = tempfile.mkdtemp(prefix='kerncraft-')
+    Finalize(
+        None, shutil.rmtree, args=(_worker_state['scratch_dir'],), kwargs={'ignore_errors': True},
+        exitpriority=10)
+
+
+def _analyze_define_worker(task):
+    '''
+    Runs analyze_define() on (code, code_name, define) *task* within a worker process.
+
+    Returns (code_name, define, analyses, report).
+    '''
+    from .kernel import Kernel
+    code, code_name, define = task
+    if code_name not in _worker_state['kernels']:
+        _worker_state['kernels'][code_name] = Kernel(code, filename=os.path.join(
+            _worker_state['scratch_dir'], os.path.basename(code_name)))
+    kernel = _worker_state['kernels'][code_name]
+
+    output = StringIO()
+    try:
+        analyses = analyze_define(
+            kernel, _worker_state['machine'], _worker_state['args'], define, code_name,
+            output_file=output, cache=_worker_state['cache'])
+    except SystemExit as e:
+        raise WorkerExit(e.code)
+    return code_name, define, analyses, output.getvalue()
+
+
+def iter_analyses(machine, args, parser, tasks, output_file, cache=None):
+    '''
+    Yields (code_name, define, analyses) for every (kernel, code_name, define) in *tasks*, in order
+    of *tasks*. *tasks* may be any iterable, it is consumed as the analyses progress.
+
+    If more than one job was requested in *args*, the tasks are analyzed by a pool of worker
+    processes, each owning its own Kernels and MachineModel. Reports are written to *output_file*
+    in the same order as they would be in serial execution.
+    '''
+    tasks = iter(tasks)
+    # Worker processes are only worth starting with more than one task
+    first_tasks = list(itertools.islice(tasks, max(args.jobs, 1)))
+    if len(first_tasks) <= 1:
+        for kernel, code_name, define in itertools.chain(first_tasks, tasks):
+            yield code_name, define, analyze_define(
+                kernel, machine, args, define, code_name, parser=parser, output_file=output_file,
+                cache=cache)
+        return
+
+    # File objects can not be passed to worker processes
+    worker_args = copy.copy(args)
+    worker_args.machine = worker_args.manifest = worker_args.store = None
+
+    pool = multiprocessing.Pool(
+        len(first_tasks), initializer=_init_worker, initargs=(machine._path, worker_args, cache))
+    try:
+        worker_tasks = ((kernel.kernel_code, code_name, define)
+                        for kernel, code_name, define in itertools.chain(first_tasks, tasks))
+        for code_name, define, analyses, report in pool.imap(_analyze_define_worker, worker_tasks):
+            print(report, end='', file=output_file)
+            yield code_name, define, analyses
+        pool.close()
+    except WorkerExit as e:
+        pool.terminate()
+        sys.exit(e.args[0])
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def load_testcases(path):
+    '''
+    Returns list of constants (list of (name, value) tuples) from testcases file *path*.
+
+    Testcases files (see examples/kernels/*.testcases) contain a Python list of dictionaries, with
+    the constants found under 'constants'. Only literals are accepted, the file is not executed.
+    '''
+    with open(path) as f:
+        try:
+            testcases = ast.literal_eval(f.read())
+        except (ValueError, SyntaxError) as e:
+            raise ValueError('malformed testcases file {}: {}'.format(path, e))
+    return [[(six.text_type(name), value) for name, value in testcase['constants']]
+            for testcase in testcases]
+
+
+def define_permutations(defines, base=()):
+    '''
+    Returns list of all permutations of *defines*, a list of (name, values) as passed with -D.
+
+    Constants in *base* (list of (name, value)) are used as well, unless overwritten in *defines*.
+    '''
+    define_dict = OrderedDict([(name, [[name, value]]) for name, value in base])
+    overwritten = set()
+    for name, values in defines:
+        if name not in overwritten:
+            define_dict[name] = []
+            overwritten.add(name)
+        for v in values:
+            if [name, v] not in define_dict[name]:
+                define_dict[name].append([name, v])
+    return list(itertools.product(*list(define_dict.values())))
+
+
+def _storage_key(define):
+    '''Returns key of *define* in result storage (the same way as Kernel._constants).'''
+    import sympy
+    return tuple([(k if isinstance(k, sympy.Symbol) else sympy.Symbol(k), v) for k, v in define])
+
+
+def _new_defines(kernel_name, defines, args, seen, result_store=None, stored=None):
+    '''
+    Yields defines of *defines* which were not yet seen (keys in *seen*, which is updated) and, if
+    *result_store* (ResultStore) is given, have no results of all selected models in it. Stored
+    defines are passed to *stored* (if given), so their results can be used instead.
+    '''
+    for define in defines:
+        key = _storage_key(define)
+        if key in seen:
+            continue
+        seen.add(key)
+        if result_store is not None and set(args.pmodel) <= \
+                result_store.stored_models(kernel_name, define):
+            if stored is not None:
+                stored(define)
+            continue
+        yield define
+
+
+def iter_tasks(args, machine, result_store=None, seen=None, stored=None):
+    '''
+    Yields (kernel, code_name, define) for all kernels and defines selected by *args*, analyzed on
+    *machine*.
+
+    Kernels are parsed and their defines generated only once they are reached, so analyses can
+    start right away. Defines occurring more than once for a kernel are only yielded once. If
+    *result_store* (ResultStore) is given, defines with results of all selected models in it are
+    skipped and passed to *stored* (if given) with their kernel and code name.
+
+    *seen* (dictionary of code name to set of define keys) collects all defines yielded or skipped,
+    so later tasks (e.g., of adaptive refinement) can be filtered the same way.
+    '''
+    from .pycparser import clean_code
+    from .kernel import Kernel
+    from .sweep import auto_define_product
+
+    if seen is None:
+        seen = {}
+    for code_file, testcases_file in args.kernels:
+        with open(code_file) as f:
+            code = six.text_type(f.read())
+        code = clean_code(code)
+        kernel = Kernel(code, filename=code_file)
+
+        if testcases_file:
+            define_product = (define
+                              for constants in load_testcases(testcases_file)
+                              for define in define_permutations(args.define, base=constants))
+        elif args.define:
+            # build defines permutations
+            define_product = define_permutations(args.define)
+        else:
+            # if no defines were given, guess suitable defines in-mem
+            define_product = auto_define_product(
+                kernel, machine, points=args.sweep_points, levels=args.sweep_levels,
+                mode=args.sweep_mode, max_size=args.sweep_size)
+
+        kernel_stored = None
+        if stored is not None:
+            kernel_stored = functools.partial(stored, kernel, code_file)
+        for define in _new_defines(os.path.split(code_file)[1], define_product, args,
+                                   seen.setdefault(code_file, set()), result_store,
+                                   kernel_stored):
+            yield kernel, code_file, define
+
+
+def _remember_kernels(tasks, kernels):
+    '''Passes *tasks* through, while remembering the kernel of every code name in *kernels*.'''
+    for kernel, code_name, define in tasks:
+        kernels[code_name] = kernel
+        yield kernel, code_name, define
+
+
+def run(parser, args, output_file=sys.stdout):
+    # Results are appended to store (if requested)
+    result_store = None
+    if args.store:
+        result_store = ResultStore(args.store)
+
+    report_file = output_file
+    try:
+        # machine information
+        # Read machine description
+        machine = MachineModel(args.machine.name)
+
+        # Analyses of previous runs are reused, unless disabled
+        cache = None
+        if not args.no_cache:
+            cache = ResultCache(args.cache_dir)
+            # Without a usable cache directory, analyses continue without cache
+            if not cache.prepare():
+                cache = None
+
+        # Machine-readable records replace the reports (if requested)
+        record_writer = None
+        if args.json or args.csv:
+            record_writer = RecordWriter(output_file, 'json' if args.json else 'csv')
+            report_file = open(os.devnull, 'w')
+
+        # Defines whose results were stored by earlier runs are skipped (if requested), but still
+        # take part in adaptive refinement
+        skip_store = result_store if args.skip_stored else None
+        kernels = OrderedDict()
+        analyzed = {}
+        seen = {}
+
+        def transition_values(analyses):
+            # only compare values which indicate a transition (if the model names them)
+            return [getattr(getattr(models, model_name), 'transition_values', lambda r: r)(results)
+                    for model_name, results in analyses]
+
+        def stored(kernel, code_name, define):
+            kernels[code_name] = kernel
+            if args.refine:
+                analyzed.setdefault(code_name, []).append((define, transition_values([
+                    (model_name, result_store.get(os.path.split(code_name)[1], define, model_name))
+                    for model_name in OrderedDict.fromkeys(args.pmodel)])))
+
+        # process kernels, machine model, parser and worker processes are shared by all of them
+        tasks = iter_tasks(args, machine, skip_store, seen, stored)
+
+        while tasks:
+            for code_name, define, analyses in iter_analyses(
+                    machine, args, parser, _remember_kernels(tasks, kernels), report_file,
+                    cache=cache):
+                if result_store is not None:
+                    result_store.append(os.path.split(code_name)[1], define, analyses)
+
+                if record_writer is not None:
+                    for model_name, results in analyses:
+                        record_writer.write(result_record(
+                            code_name, machine._path, define, model_name, results,
+                            omit=getattr(getattr(models, model_name), 'raw_results', [])))
+
+                if args.refine:
+                    analyzed.setdefault(code_name, []).append((define, transition_values(analyses)))
+
+            # Adaptive refinement: next round bisects all intervals in which results changed. Stored
+            # middles are not analyzed again, but may reveal further intervals to bisect.
+            tasks = []
+            while args.refine and not tasks:
+                analyzed_count = sum([len(a) for a in analyzed.values()])
+                from .sweep import refine_defines
+                for code_name, kernel in list(kernels.items()):
+                    tasks += [(kernel, code_name, define) for define in _new_defines(
+                        os.path.split(code_name)[1],
+                        refine_defines(analyzed.get(code_name, []), args.refine_threshold,
+                                       args.refine_resolution),
+                        args, seen.setdefault(code_name, set()), skip_store,
+                        functools.partial(stored, kernel, code_name))]
+                if sum([len(a) for a in analyzed.values()]) == analyzed_count:
+                    break
+    finally:
+        # store and report file are also closed if analyses fail
+        if result_store is not None:
+            result_store.close()
+        if report_file is not output_file:
+            report_file.close()
 
 def main():
     # Create and populate parser
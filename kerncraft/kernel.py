@@ -13,6 +13,7 @@ import subprocess
 import os
 import os.path
 import sys
+import re
 import numbers
 
 import sympy
@@ -21,11 +22,38 @@ from six.moves import map
 from functools import reduce
 import six
 
+from . import pycparser
 from .pycparser import CParser, c_ast
 from .pycparser.c_generator import CGenerator
 
 from . import iaca_marker as iaca
 
+# C parser shared by all kernels, constructed on first use by get_parser()
+_parser = None
+
+
+def get_parser():
+    '''
+    Returns C parser shared by all kernels.
+
+    Lexer and parser tables are loaded from kerncraft.pycparser (generated at build time by
+    pycparser/_build_tables.py). If they are missing, they are generated once and written to
+    the package directory.
+    '''
+    global _parser
+    if _parser is None:
+        table_dir = os.path.dirname(os.path.abspath(pycparser.__file__))
+        try:
+            _parser = CParser(
+                lextab='kerncraft.pycparser.lextab', yacctab='kerncraft.pycparser.yacctab',
+                taboutputdir=table_dir)
+        except IOError:
+            # Tables are missing and package directory is not writable
+            _parser = CParser(
+                lex_optimize=False, yacc_optimize=False, yacctab='kerncraft.pycparser.yacctab',
+                taboutputdir=table_dir)
+    return _parser
+
 
 def prefix_indent(prefix, textblock, later_prefix=' '):
     textblock = textblock.split('\n')
@@ -128,8 +156,7 @@ class Kernel(object):
         self.kernel_code = kernel_code
         self._filename = filename
 
-        parser = CParser()
-        self.kernel_ast = parser.parse(self.as_function()).ext[0].body
+        self.kernel_ast = get_parser().parse(self.as_function()).ext[0].body
 
         self._loop_stack = []
         self._variables = {}
@@ -137,6 +164,13 @@ class Kernel(object):
         self._destinations = {}
         self._flops = {}
         self.datatype = None
+
+        # Compiled (lambdified) expressions do not depend on constant values and are kept for
+        # the lifetime of the kernel
+        self._compiled_expressions = {}
+        self._symbolic_access_offsets = None
+        # IACA analyses only depend on the generated code and are reused for all constant values
+        self._iaca_analyses = {}
         
         self.clear_state()
         self._process_code()
@@ -164,8 +198,10 @@ class Kernel(object):
     
     def clear_state(self):
         '''Clears changable internal states
-        (_constants, asm_blocks and asm_block_idx)'''
+        (_constants, asm_blocks, asm_block_idx and _cache_accesses)'''
         self._constants = {}
+        # Cache access simulations (see kerncraft.cacheaccess) depend on the constants
+        self._cache_accesses = {}
         self.asm_blocks = {}
         self.asm_block_idx = None
     
@@ -415,6 +451,130 @@ class Kernel(object):
         else:
             return expr.subs(self._constants)
 
+    def _evaluate_compiled(self, key, build_expressions, constants=None):
+        '''
+        Evaluates list of sympy expressions returned by *build_expressions()* with *constants*
+        (defaults to constants set in kernel).
+
+        Expressions are built and compiled with sympy.lambdify only once per *key*, following
+        evaluations work on plain numbers and without any symbolic manipulation. Values in
+        *constants* may also be NumPy arrays, to evaluate many points at once.
+        '''
+        if key not in self._compiled_expressions:
+            expressions = [sympy.sympify(e) for e in build_expressions()]
+            symbols = sorted(set().union(*[e.free_symbols for e in expressions]), key=str)
+            self._compiled_expressions[key] = (symbols, sympy.lambdify(symbols, expressions))
+        symbols, function = self._compiled_expressions[key]
+
+        if constants is None:
+            constants = self._constants
+        assert all([s in constants for s in symbols]), \
+            'constants {} need to be defined'.format(', '.join(map(str, symbols)))
+
+        return function(*[constants[s] for s in symbols])
+
+    def symbolic_access_offsets(self):
+        '''
+        Returns offsets of all array accesses depending on the inner-most loop index as sympy
+        expressions of the constants.
+
+        Returns a three-tuple (read_offsets, write_offsets, iteration_offsets):
+        *read_offsets* and *write_offsets* are {var_name: {index_order: [offset, ...]}}, with the
+        offset from the iteration center in number of elements and index_order being the order of
+        indices used in the access (e.g. 'ijk' for [i][j][k]).
+        *iteration_offsets* is {var_name: {index_order: offset}} with the offset from one to the
+        next inner-most loop iteration.
+        '''
+        inner_index = self._loop_stack[-1][0]
+        read_offsets = {}
+        write_offsets = {}
+        iteration_offsets = {}
+
+        for var_name, (var_type, var_dims) in self._variables.items():
+            # Skip scalar values (they are hopefully kept in registers)
+            if var_dims is None:
+                continue
+
+            for accesses, offsets in [(self._sources, read_offsets),
+                                      (self._destinations, write_offsets)]:
+                for access_dimensions in accesses.get(var_name, []):
+                    # Skip access that does not change with inner-most loop index (they are
+                    # hopefully kept in registers)
+                    if inner_index not in [a[1] for a in access_dimensions]:
+                        continue
+
+                    index_order = ''.join([d[1] for d in access_dimensions])
+                    offset = sympy.Integer(0)
+                    iteration_offset = sympy.Integer(0)
+                    for dim, offset_info in enumerate(access_dimensions):
+                        offset_type, index_name, dim_offset = offset_info
+                        assert offset_type == 'rel', \
+                            'Only relative access to arrays is supported at the moment'
+                        stride = reduce(operator.mul, var_dims[dim+1:], sympy.Integer(1))
+                        offset += dim_offset*stride
+                        if index_name == inner_index:
+                            iteration_offset += stride
+
+                    offsets.setdefault(var_name, {}).setdefault(index_order, []).append(offset)
+                    iteration_offsets.setdefault(var_name, {})[index_order] = iteration_offset
+
+        return read_offsets, write_offsets, iteration_offsets
+
+    def access_offsets(self, constants=None):
+        '''
+        Returns offsets from symbolic_access_offsets() evaluated with *constants* (defaults to
+        constants set in kernel).
+
+        The symbolic offsets are only built and compiled once per kernel, so this is cheap to
+        call for every point of a parameter sweep. See _evaluate_compiled() for *constants*.
+        '''
+        if self._symbolic_access_offsets is None:
+            self._symbolic_access_offsets = self.symbolic_access_offsets()
+        symbolic_offsets = self._symbolic_access_offsets
+
+        def iter_entries():
+            for i, offsets in enumerate(symbolic_offsets):
+                for var_name in sorted(offsets):
+                    for index_order in sorted(offsets[var_name]):
+                        yield i, offsets, var_name, index_order
+
+        def build_expressions():
+            expressions = []
+            for i, offsets, var_name, index_order in iter_entries():
+                if isinstance(offsets[var_name][index_order], list):
+                    expressions += offsets[var_name][index_order]
+                else:
+                    expressions.append(offsets[var_name][index_order])
+            return expressions
+
+        values = iter(self._evaluate_compiled('access offsets', build_expressions, constants))
+
+        # Rebuild dictionaries from flat list of evaluated expressions
+        evaluated_offsets = ({}, {}, {})
+        for i, offsets, var_name, index_order in iter_entries():
+            evaluated = evaluated_offsets[i]
+            evaluated.setdefault(var_name, {})
+            if isinstance(offsets[var_name][index_order], list):
+                evaluated[var_name][index_order] = [
+                    next(values) for o in offsets[var_name][index_order]]
+            else:
+                evaluated[var_name][index_order] = next(values)
+
+        return evaluated_offsets
+
+    def array_sizes(self, constants=None):
+        '''
+        Returns {var_name: size in bytes} of all arrays, evaluated with *constants* (defaults to
+        constants set in kernel). See _evaluate_compiled() for *constants*.
+        '''
+        names = sorted([n for n, v in self._variables.items() if v[1] is not None])
+        sizes = self._evaluate_compiled(
+            'array sizes',
+            lambda: [self.datatypes_size[self._variables[n][0]]*reduce(
+                operator.mul, self._variables[n][1]) for n in names],
+            constants)
+        return dict(zip(names, sizes))
+
     def as_code(self, type_='iaca'):
         '''
         generates compilable source code from AST
@@ -701,7 +861,8 @@ class Kernel(object):
 
         if compiler_args is None:
             compiler_args = []
-        compiler_args += ['-std=c99']
+        # Do not modify list passed by caller (e.g. from machine description)
+        compiler_args = list(compiler_args) + ['-std=c99']
 
         try:
             subprocess.check_output(
@@ -723,6 +884,89 @@ class Kernel(object):
         # Let's return the out_file name
         return os.path.splitext(in_file.name)[0]+'.s'
 
+    def iaca_analysis(self, micro_architecture, compiler, compiler_args=None, asm_block='auto',
+                      asm_increment=0):
+        '''
+        Compiles and assembles kernel, marks the selected block (see assemble()) and runs IACA
+        throughput and latency analysis on it.
+
+        Returns dictionary with throughput and latency of the block (in cycles), port cycles,
+        uops, pointer increment of the block and the raw IACA outputs.
+
+        Constants are read from argv in the generated code, thus the analysis is only done once
+        per configuration and reused for all values of the constants.
+        '''
+        key = (micro_architecture, compiler, tuple(compiler_args or []), asm_block, asm_increment,
+               tuple([six.text_type(k) for k in self._constants]))
+        if key in self._iaca_analyses:
+            return self._iaca_analyses[key]
+
+        asm_name = self.compile(compiler, compiler_args=compiler_args)
+        bin_name = self.assemble(
+            compiler, asm_name, iaca_markers=True, asm_block=asm_block,
+            asm_increment=asm_increment)
+
+        try:
+            cmd = ['iaca.sh', '-64', '-arch', micro_architecture, bin_name]
+            iaca_output = subprocess.check_output(cmd).decode('utf-8')
+        except OSError as e:
+            print("IACA execution failed:", ' '.join(cmd), file=sys.stderr)
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        except subprocess.CalledProcessError as e:
+            print("IACA throughput analysis failed:", e, file=sys.stderr)
+            sys.exit(1)
+
+        # Get total cycles per loop iteration
+        match = re.search(
+            r'^Block Throughput: ([0-9\.]+) Cycles', iaca_output, re.MULTILINE)
+        assert match, "Could not find Block Throughput in IACA output."
+        block_throughput = float(match.groups()[0])
+
+        # Find ports and cyles per port
+        ports = [l for l in iaca_output.split('\n') if l.startswith('|  Port  |')]
+        cycles = [l for l in iaca_output.split('\n') if l.startswith('| Cycles |')]
+        assert ports and cycles, "Could not find ports/cylces lines in IACA output."
+        ports = [p.strip() for p in ports[0].split('|')][2:]
+        cycles = [c.strip() for c in cycles[0].split('|')][2:]
+        port_cycles = []
+        for i in range(len(ports)):
+            if '-' in ports[i] and ' ' in cycles[i]:
+                subports = [p.strip() for p in ports[i].split('-')]
+                subcycles = [c for c in cycles[i].split(' ') if bool(c)]
+                port_cycles.append((subports[0], float(subcycles[0])))
+                port_cycles.append((subports[0]+subports[1], float(subcycles[1])))
+            elif ports[i] and cycles[i]:
+                port_cycles.append((ports[i], float(cycles[i])))
+        port_cycles = dict(port_cycles)
+
+        match = re.search(r'^Total Num Of Uops: ([0-9]+)', iaca_output, re.MULTILINE)
+        assert match, "Could not find Uops in IACA output."
+        uops = float(match.groups()[0])
+
+        # Get latency prediction from IACA
+        try:
+            iaca_latency_output = subprocess.check_output(
+                ['iaca.sh', '-64', '-analysis', 'LATENCY', '-arch', micro_architecture,
+                 bin_name]).decode('utf-8')
+        except subprocess.CalledProcessError as e:
+            print("IACA latency analysis failed:", e, file=sys.stderr)
+            sys.exit(1)
+        match = re.search(
+            r'^Latency: ([0-9\.]+) Cycles', iaca_latency_output, re.MULTILINE)
+        assert match, "Could not find Latency in IACA latency analysis output."
+        block_latency = float(match.groups()[0])
+
+        self._iaca_analyses[key] = {
+            'throughput': block_throughput,
+            'latency': block_latency,
+            'port cycles': port_cycles,
+            'uops': uops,
+            'pointer increment': self.asm_block['pointer_increment'],
+            'IACA output': iaca_output,
+            'IACA latency output': iaca_latency_output}
+        return self._iaca_analyses[key]
+
     def build(self, compiler, cflags=None, lflags=None, verbose=False):
         '''
         compiles source to executable with likwid capabilities
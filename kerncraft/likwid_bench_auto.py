@@ -5,12 +5,17 @@ from __future__ import absolute_import
 import subprocess
 import re
 import sys
-from copy import copy
+import os
+import argparse
+import threading
+from copy import copy, deepcopy
 
+import six
 import yaml
 
 from .prefixedunit import PrefixedUnit
 from six.moves import range
+from six.moves import queue
 
 
 def get_match_or_break(regex, haystack, flags=re.MULTILINE):
@@ -20,7 +25,8 @@ def get_match_or_break(regex, haystack, flags=re.MULTILINE):
 
 
 def get_machine_topology():
-    topo = subprocess.Popen(['likwid-topology'], stdout=subprocess.PIPE).communicate()[0]
+    topo = subprocess.Popen(
+        ['likwid-topology'], stdout=subprocess.PIPE, universal_newlines=True).communicate()[0]
     cpuinfo = open('/proc/cpuinfo', 'r').read()
     machine = {
         'model type': get_match_or_break(r'^CPU type:\s+(.+?)\s*$', topo)[0],
@@ -34,7 +40,7 @@ def get_machine_topology():
         'compiler': 'INFORMATION_REQUIRED',
         'compiler flags': 'INFORMATION_REQUIRED',
         'cacheline size': 'INFORMATION_REQUIRED',
-        'overlapping ports': 'INFORAMTION_REQUIRED',
+        'overlapping ports': 'INFORMATION_REQUIRED',
         'non-overlapping ports': 'INFORMATION_REQUIRED',
     }
 
@@ -80,78 +86,106 @@ def get_machine_topology():
 
 
 def measure_bw(type_, total_size, threads_per_core, max_threads_per_core, cores_per_socket,
-               sockets):
-    """*size* is given in kilo bytes"""
+               sockets, streams=1, memory_domain=None, socket=0, dry_run=False):
+    """
+    *size* is given in kilo bytes
+
+    if *memory_domain* is given (e.g., M1), all *streams* are placed in that memory domain
+
+    cores of *sockets* sockets are used, starting with *socket*
+
+    if *dry_run* is True, dry_run_bench() is used instead of likwid-bench
+    """
     groups = []
-    for s in range(sockets):
-        groups += [
-            '-w',
-            'S' + str(s) + ':' + str(total_size) + 'kB:' +
-            str(threads_per_core * cores_per_socket) +
-            ':1:'+str(int(max_threads_per_core/threads_per_core))]
+    for s in range(socket, socket+sockets):
+        group = 'S' + str(s) + ':' + str(total_size) + 'kB:' + \
+            str(threads_per_core * cores_per_socket) + \
+            ':1:'+str(int(max_threads_per_core/threads_per_core))
+        if memory_domain is not None:
+            group += '-' + ','.join(['{}:{}'.format(i, memory_domain) for i in range(streams)])
+        groups += ['-w', group]
     # for older likwid versions add ['-g', str(sockets), '-i', str(iterations)] to cmd
     cmd = ['likwid-bench', '-t', type_]+groups
-    output = subprocess.Popen(cmd, stdout=subprocess.PIPE).communicate()[0]
+    if dry_run:
+        output = dry_run_bench(cmd)
+    else:
+        output = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, universal_newlines=True).communicate()[0]
     bw = float(get_match_or_break(r'^MByte/s:\s+([0-9]+(?:\.[0-9]+)?)\s*$', output)[0])
     return PrefixedUnit(bw, 'MB/s')
 
 
-def cli():
-    # TODO support everything described here
-    if '-h' in sys.argv[1:] or '--help' in sys.argv[1:]:
-        print('''Usage:', sys.argv[0], '[-h] {collect|measure} [machinefile] | upgrade machinefile
-        
-        collect will retriev as much hardware information as possible, without benchmarking
-        measure will do the same as collect, but also include memory benchmarks
-        
-        If machinefile already exists the CPU name will be compared. If they matche, measurements 
-        will proceed and the file is updated accordingly. All other information in the file 
-        (typically manually inserted) will be left alone.
-        
-        If no machinefile is given, the information will be printed to stdout.
-        
-        updgrade will transform machinefile to the most up-to-date machine file version.
-        ''')
-
-
-def main():
-    machine = get_machine_topology()
-
-    benchmarks = {'kernels': {}, 'measurements': {}}
-    machine['benchmarks'] = benchmarks
-    benchmarks['kernels'] = {
-        'load': {
-            'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
-            'write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
-            'FLOPs per iteration': 0},
-        'copy': {
-            'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
-            'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'FLOPs per iteration': 0},
-        'update': {
-            'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'read+write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'FLOPs per iteration': 0},
-        'triad': {
-            'read streams': {'streams': 3, 'bytes': PrefixedUnit(24, 'B')},
-            'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
-            'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'FLOPs per iteration': 2},
-        'daxpy': {
-            'read streams': {'streams': 2, 'bytes': PrefixedUnit(16, 'B')},
-            'read+write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'FLOPs per iteration': 2}, }
-
-    USAGE_FACTOR = 0.5
+def dry_run_bench(cmd):
+    """
+    Returns output of a local stand-in for likwid-bench command *cmd*, with synthetic bandwidths
+
+    Bandwidths saturate with the number of threads and decrease with the working set size, so that
+    measurement campaigns can be run without likwid or hardware counters.
+    """
+    bw = 0.0
+    for group in cmd[cmd.index('-w')+1::2]:
+        size, threads = re.match(r'^S[0-9]+:([0-9]+)kB:([0-9]+):', group).groups()
+        bw += 20000.0*int(threads)/(1.0 + int(threads)/4.0) / (1.0 + int(size)/100000.0)
+    return 'Test: {}\nMByte/s:\t\t{:.2f}\n'.format(cmd[cmd.index('-t')+1], bw)
+
+
+# Kernels measured by likwid-bench (named as its tests)
+BENCHMARK_KERNELS = {
+    'load': {
+        'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'FLOPs per iteration': 0},
+    'copy': {
+        'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 0},
+    'update': {
+        'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'read+write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 0},
+    'triad': {
+        'read streams': {'streams': 3, 'bytes': PrefixedUnit(24, 'B')},
+        'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 2},
+    'daxpy': {
+        'read streams': {'streams': 2, 'bytes': PrefixedUnit(16, 'B')},
+        'read+write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 2},
+    # Kernels with non-temporal stores, which do not allocate written cachelines
+    'copy_mem': {
+        'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 0,
+        'write allocate': False},
+    'stream_mem': {
+        'read streams': {'streams': 2, 'bytes': PrefixedUnit(16, 'B')},
+        'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 2,
+        'write allocate': False}, }
+
+USAGE_FACTOR = 0.5
+
 
+def build_measurements(machine):
+    """
+    Returns measurements of all memory levels and threads per core of *machine* (as in
+    'benchmarks: measurements' of machine files), with all results missing (None)
+
+    Main memory is also measured with data in the memory of another socket ('remote results'), if
+    the machine has more than one socket.
+    """
+    measurements = {}
     cores = list(range(1, machine['cores per socket']+1))
     for mem in machine['memory hierarchy']:
         measurement = {}
-        machine['benchmarks']['measurements'][mem['level']] = measurement
+        measurements[mem['level']] = measurement
 
         for threads_per_core in range(1, machine['threads per core']+1):
             threads = [c*threads_per_core for c in cores]
@@ -173,29 +207,370 @@ def main():
                 'size per core': sizes_per_core,
                 'size per thread': sizes_per_thread,
                 'total size': total_sizes,
-                'results': {}, }
+                'results': {kernel: [None]*len(cores)
+                            for kernel in machine['benchmarks']['kernels']}, }
+
+            # Cores of the first socket working on data in the memory of the second socket
+            if mem['level'] == machine['memory hierarchy'][-1]['level'] and \
+                    machine['sockets'] > 1:
+                measurement[threads_per_core]['remote results'] = {
+                    kernel: [None]*len(cores) for kernel in machine['benchmarks']['kernels']}
+    return measurements
+
+
+# Information detected by get_machine_topology(), which replaces that of existing machine files
+DETECTED_KEYS = ['model type', 'model name', 'sockets', 'cores per socket', 'threads per core']
+DETECTED_LEVEL_KEYS = ['size per group', 'groups', 'cores per group', 'threads per group']
+
+
+def _same(a, b):
+    """Returns True if *a* and *b* are equal (PrefixedUnits only equal PrefixedUnits)."""
+    if isinstance(a, PrefixedUnit) != isinstance(b, PrefixedUnit):
+        return False
+    return a == b
+
+
+def merge_topology(machine, topology):
+    """
+    Updates *machine* with detected *topology* (see get_machine_topology()) and returns set of
+    memory levels whose detected description changed
+
+    Detected information replaces that of *machine*, all other information is only added if it is
+    missing or still required (i.e., manually inserted information is left alone). Memory levels
+    are matched by name, those which were not detected are removed.
+    """
+    for key, value in topology.items():
+        if key == 'memory hierarchy':
+            continue
+        if key in DETECTED_KEYS or _same(machine.get(key, 'INFORMATION_REQUIRED'),
+                                         'INFORMATION_REQUIRED'):
+            machine[key] = value
+
+    levels = {mem['level']: mem for mem in machine.get('memory hierarchy', [])}
+    changed = set()
+    memory_hierarchy = []
+    for detected in topology['memory hierarchy']:
+        mem = levels.pop(detected['level'], {})
+        if any([not _same(mem.get(key), detected.get(key)) for key in DETECTED_LEVEL_KEYS]):
+            changed.add(detected['level'])
+        for key, value in detected.items():
+            if key in DETECTED_LEVEL_KEYS or _same(mem.get(key, 'INFORMATION_REQUIRED'),
+                                                   'INFORMATION_REQUIRED'):
+                mem[key] = value
+        memory_hierarchy.append(mem)
+    for level in levels:
+        print('Memory level {} was not detected and is removed.'.format(level), file=sys.stderr)
+    machine['memory hierarchy'] = memory_hierarchy
+    return changed
+
+
+def upgrade_machine(machine):
+    """
+    Upgrades *machine* in place to the current machine file version and returns list of changes
+
+    Only the format is changed, nothing is measured: misspelled placeholders are corrected, known
+    benchmark kernels get keys which were added since and measurements get derived thread counts
+    and sizes which are missing.
+    """
+    changes = []
+    for key, value in machine.items():
+        if _same(value, 'INFORAMTION_REQUIRED'):
+            machine[key] = 'INFORMATION_REQUIRED'
+            changes.append('corrected placeholder of {}'.format(key))
+
+    benchmarks = machine.get('benchmarks', {})
+    for name, kernel_info in benchmarks.get('kernels', {}).items():
+        for key, value in BENCHMARK_KERNELS.get(name, {}).items():
+            if key not in kernel_info:
+                kernel_info[key] = deepcopy(value)
+                changes.append('added {} of kernel {}'.format(key, name))
+
+    for mem_level, measurement in benchmarks.get('measurements', {}).items():
+        for threads_per_core, m in measurement.items():
+            derived = [
+                ('threads per core', lambda: threads_per_core),
+                ('threads', lambda: [c*threads_per_core for c in m['cores']]),
+                ('size per core', lambda: [t/c for t, c in zip(m['total size'], m['cores'])]),
+                ('size per thread', lambda: [t/c for t, c in zip(m['total size'], m['threads'])])]
+            for key, value in derived:
+                if key not in m:
+                    m[key] = value()
+                    changes.append('added {} of {} measurements with {} threads per core'.format(
+                        key, mem_level, threads_per_core))
+    return changes
+
+
+def update_measurements(machine, stale_levels=()):
+    """
+    Updates benchmark kernels and measurements of *machine* to those taken by likwid_bench_auto
+    and returns number of stale results removed
+
+    Results of every memory level, threads per core, kernel and core count are kept (with the
+    sizes they were measured with), unless the level is in *stale_levels* or the definition of the
+    kernel changed. Missing and removed results are None (see measurement_tasks()).
+    """
+    benchmarks = machine.setdefault('benchmarks', {})
+    kernels = benchmarks.setdefault('kernels', {})
+    changed_kernels = set()
+    for name, kernel_info in BENCHMARK_KERNELS.items():
+        if name in kernels and kernels[name] != kernel_info:
+            changed_kernels.add(name)
+        kernels[name] = deepcopy(kernel_info)
+
+    old_measurements = benchmarks.get('measurements', {})
+    measurements = build_measurements(machine)
+    stale = 0
+    for mem_level, measurement in measurements.items():
+        for threads_per_core, new in measurement.items():
+            old = old_measurements.get(mem_level, {}).get(threads_per_core)
+            if not old:
+                continue
+            for i, cores in enumerate(new['cores']):
+                if cores not in old['cores']:
+                    continue
+                j = old['cores'].index(cores)
+                old_results = [(key, kernel, results[j])
+                               for key in ['results', 'remote results'] if key in new
+                               for kernel, results in old.get(key, {}).items()
+                               if kernel in new[key] and results[j] is not None]
+                if mem_level in stale_levels:
+                    stale += len(old_results)
+                    continue
+
+                # Keep layout of measured core counts
+                for key in ['threads', 'size per core', 'size per thread', 'total size']:
+                    new[key][i] = old[key][j]
+                for key, kernel, bw in old_results:
+                    if kernel in changed_kernels:
+                        stale += 1
+                        continue
+                    new[key][kernel][i] = bw
+                    variance = old.get(key+' variance', {}).get(kernel, [None]*(j+1))[j]
+                    if variance is not None:
+                        new.setdefault(key+' variance', {}).setdefault(
+                            kernel, [None]*len(new['cores']))[i] = variance
+    benchmarks['measurements'] = measurements
+    return stale
+
 
-    print('Progress: ', end='', file=sys.stderr)
-    sys.stderr.flush()
-    for mem_level in list(machine['benchmarks']['measurements'].keys()):
-        for threads_per_core in list(machine['benchmarks']['measurements'][mem_level].keys()):
+def measurement_tasks(machine):
+    """
+    Returns list of missing measurements (None in results) of *machine*, as tuples of (memory
+    level, threads per core, results key, kernel, index of core count)
+
+    Measurements in the memory of another socket ('remote results') come last.
+    """
+    tasks = []
+    for results_key in ['results', 'remote results']:
+        for mem_level, measurement in sorted(machine['benchmarks']['measurements'].items()):
+            for threads_per_core in sorted(measurement):
+                results = measurement[threads_per_core].get(results_key, {})
+                for kernel in sorted(results):
+                    tasks += [(mem_level, threads_per_core, results_key, kernel, i)
+                              for i, bw in enumerate(results[kernel]) if bw is None]
+    return tasks
+
+
+def measure_task(machine, task, socket=0, repetitions=1, dry_run=False):
+    """
+    Returns median and variance (in (MB/s)^2) of *repetitions* bandwidth measurements of *task*
+    (see measurement_tasks()) with cores of *socket*
+
+    Remote measurements use the memory of the next socket.
+    """
+    mem_level, threads_per_core, results_key, kernel, i = task
+    measurement = machine['benchmarks']['measurements'][mem_level][threads_per_core]
+    kwargs = {}
+    if results_key == 'remote results':
+        kernel_info = machine['benchmarks']['kernels'][kernel]
+        kwargs['streams'] = (kernel_info['read streams']['streams'] +
+                             kernel_info['write streams']['streams'] -
+                             kernel_info['read+write streams']['streams'])
+        kwargs['memory_domain'] = 'M{}'.format((socket+1) % machine['sockets'])
+
+    bws = sorted([measure_bw(kernel,
+                             int(float(measurement['total size'][i])/1000),
+                             threads_per_core,
+                             machine['threads per core'],
+                             measurement['cores'][i],
+                             sockets=1,
+                             socket=socket,
+                             dry_run=dry_run,
+                             **kwargs)
+                  for r in range(repetitions)], key=float)
+
+    values = [bw.with_prefix('M').value for bw in bws]
+    if repetitions % 2:
+        median = bws[repetitions//2]
+    else:
+        median = PrefixedUnit(
+            (values[repetitions//2-1] + values[repetitions//2])/2.0, 'M', 'B/s')
+    mean = sum(values)/repetitions
+    variance = sum([(v - mean)**2 for v in values])/(repetitions - 1) if repetitions > 1 else 0.0
+    return median, variance
+
+
+def run_tasks(machine, tasks, jobs=1, repetitions=1, dry_run=False, checkpoint=None):
+    """
+    Measures all *tasks* (see measurement_tasks()) and stores the results in *machine*
+
+    With *jobs* larger than one, sockets measure in parallel, each running one task at a time
+    (cores of the same socket would disturb each other). Remote measurements are always run one
+    after the other, since they use the memory of another socket.
+
+    With more than one of *repetitions*, the variance of each result is stored in
+    'results variance' (or 'remote results variance').
+
+    After every measurement, *checkpoint* (if given) is called with *machine*.
+    """
+    lock = threading.Lock()
+
+    def store(task, socket):
+        mem_level, threads_per_core, results_key, kernel, i = task
+        bw, variance = measure_task(machine, task, socket, repetitions, dry_run)
+        with lock:
             measurement = machine['benchmarks']['measurements'][mem_level][threads_per_core]
-            measurement['results'] = {}
-            for kernel in list(machine['benchmarks']['kernels'].keys()):
-                measurement['results'][kernel] = []
-                for i, total_size in enumerate(measurement['total size']):
-                    measurement['results'][kernel].append(measure_bw(
-                        kernel,
-                        int(float(total_size)/1000),
-                        threads_per_core,
-                        machine['threads per core'],
-                        measurement['cores'][i],
-                        sockets=1))
-
-                    print('.', end='', file=sys.stderr)
-                    sys.stderr.flush()
-
-    print(yaml.dump(machine))
+            measurement[results_key][kernel][i] = bw
+            if repetitions > 1:
+                variances = measurement.setdefault(results_key+' variance', {})
+                variances.setdefault(
+                    kernel, [None]*len(measurement['cores']))[i] = variance
+            if checkpoint is not None:
+                checkpoint(machine)
+            print('.', end='', file=sys.stderr)
+            sys.stderr.flush()
+
+    def worker(socket, pending, errors):
+        while not errors:
+            try:
+                task = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                store(task, socket)
+            except Exception:
+                errors.append(sys.exc_info())
+
+    for phase_tasks, phase_jobs in [
+            ([t for t in tasks if t[2] != 'remote results'], min(jobs, machine['sockets'])),
+            ([t for t in tasks if t[2] == 'remote results'], 1)]:
+        if phase_jobs <= 1:
+            for task in phase_tasks:
+                store(task, 0)
+            continue
+
+        pending = queue.Queue()
+        for task in phase_tasks:
+            pending.put(task)
+        errors = []
+        workers = [threading.Thread(target=worker, args=(socket, pending, errors))
+                   for socket in range(phase_jobs)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        if errors:
+            six.reraise(*errors[0])
+
+
+def load_machine_file(path):
+    """Returns machine description read from machine file at *path*."""
+    with open(path) as f:
+        return yaml.load(f)
+
+
+def write_machine_file(machine, path):
+    """Writes *machine* to machine file at *path*, replacing it only once it was written."""
+    with open(path+'.tmp', 'w') as f:
+        yaml.dump(machine, f)
+    os.rename(path+'.tmp', path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Collects hardware information and measures bandwidths of all memory '
+        'hierarchy levels with likwid-bench. If machinefile already exists, the CPU name is '
+        'compared and only detected information and missing or stale measurements are updated; '
+        'all other (typically manually inserted) information is left alone. Without machinefile, '
+        'the result is printed.')
+    subparsers = parser.add_subparsers(dest='command')
+    collect_parser = subparsers.add_parser(
+        'collect', help='Retrieve as much hardware information as possible, without benchmarks.')
+    measure_parser = subparsers.add_parser(
+        'measure', help='Same as collect, but also take missing or stale measurements.')
+    upgrade_parser = subparsers.add_parser(
+        'upgrade', help='Transform machinefile to the current machine file version.')
+
+    for p in [collect_parser, measure_parser]:
+        p.add_argument('machinefile', nargs='?',
+                       help='Machine file to update (written after every measurement).')
+        p.add_argument('--dry-run', action='store_true',
+                       help='Use the topology of the existing machinefile and a stand-in with '
+                            'synthetic bandwidths instead of likwid-topology and likwid-bench.')
+    measure_parser.add_argument('--jobs', '-j', metavar='JOBS', type=int, default=1,
+                                help='Number of sockets measuring in parallel. (default: 1)')
+    measure_parser.add_argument('--repetitions', '-r', metavar='N', type=int, default=1,
+                                help='Measure every bandwidth N times and record median and '
+                                     'variance. (default: 1)')
+    measure_parser.add_argument('--remeasure', metavar='LEVEL', action='append', default=[],
+                                help='Measure all results of memory level LEVEL again. May be '
+                                     'given multiple times.')
+    upgrade_parser.add_argument('machinefile', help='Machine file to upgrade. (WILL BE CHANGED)')
+
+    if argv is None:
+        argv = sys.argv[1:]
+    # Measuring is the default (as with earlier versions without commands)
+    argv = list(argv)
+    if not argv or argv[0] not in ['collect', 'measure', 'upgrade', '-h', '--help']:
+        argv = ['measure'] + argv
+    args = parser.parse_args(argv)
+
+    if args.command == 'upgrade':
+        if not os.path.exists(args.machinefile):
+            parser.error('{} does not exist'.format(args.machinefile))
+        machine = load_machine_file(args.machinefile)
+        for change in upgrade_machine(machine):
+            print(change, file=sys.stderr)
+        write_machine_file(machine, args.machinefile)
+        return
+
+    stale_levels = set(args.remeasure) if args.command == 'measure' else set()
+    if args.machinefile and os.path.exists(args.machinefile):
+        machine = load_machine_file(args.machinefile)
+        upgrade_machine(machine)
+        if not args.dry_run:
+            topology = get_machine_topology()
+            if topology['model name'] != machine['model name']:
+                parser.error('{} describes {}, not {}'.format(
+                    args.machinefile, machine['model name'], topology['model name']))
+            stale_levels |= merge_topology(machine, topology)
+    elif args.dry_run:
+        parser.error('--dry-run requires an existing machinefile')
+    else:
+        machine = get_machine_topology()
+
+    checkpoint = None
+    if args.machinefile:
+        def checkpoint(machine):
+            write_machine_file(machine, args.machinefile)
+
+    if args.command == 'measure':
+        stale = update_measurements(machine, stale_levels)
+        if stale:
+            print('{} stale results are measured again.'.format(stale), file=sys.stderr)
+        if checkpoint is not None:
+            checkpoint(machine)
+
+        print('Progress: ', end='', file=sys.stderr)
+        sys.stderr.flush()
+        run_tasks(machine, measurement_tasks(machine), args.jobs, args.repetitions,
+                  args.dry_run, checkpoint)
+        print(file=sys.stderr)
+    elif checkpoint is not None:
+        checkpoint(machine)
+
+    if not args.machinefile:
+        print(yaml.dump(machine))
 
 if __name__ == '__main__':
     main()
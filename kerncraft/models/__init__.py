@@ -10,9 +10,21 @@ The exported classes must have the following class level attributes:
   * analyze() that analyses ther kernel with regard to the machine definition and args passed
   * report() return a readable text output with analysis report
   * results (dict) must be available after analyze has been called
+
+Optionally, they may define:
+  * cacheable (bool) set to False if results must not be taken from the result cache
+  * tools (list) external commands results depend on ('compiler' for the compiler of the machine
+    file), whose --version output is part of the result cache key
+  * transition_values(results) classmethod that returns the (possibly nested list of) values of
+    results, which indicate a performance transition if they change between problem sizes (used
+    by adaptive refinement, all numbers in results are compared if not defined)
+  * raw_results (list) keys of results holding raw output of external tools, which are left out of
+    --json and --csv records
 '''
 from .ecm import ECM, ECMData, ECMCPU
 from .roofline import Roofline, RooflineIACA
 from .benchmark import Benchmark
+from .layer_condition import LC
+from .cache_simulation import CacheSim
 
-__all__ = ['ECM', 'ECMData', 'ECMCPU', 'Roofline', 'RooflineIACA', 'Benchmark']
+__all__ = ['ECM', 'ECMData', 'ECMCPU', 'Roofline', 'RooflineIACA', 'Benchmark', 'LC', 'CacheSim']
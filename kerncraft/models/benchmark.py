@@ -16,11 +16,18 @@ class Benchmark(object):
     """
 
     name = "benchmark"
+    # Measurements depend on the machine at hand and are never taken from the result cache
+    cacheable = False
 
     @classmethod
     def configure_arggroup(cls, parser):
         pass
 
+    @classmethod
+    def transition_values(cls, results):
+        '''Returns measured runtime per cacheline update.'''
+        return [results['Runtime (per cacheline update) [cy/CL]']]
+
     def __init__(self, kernel, machine, args=None, parser=None):
         """
         *kernel* is a Kernel object
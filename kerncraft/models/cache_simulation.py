@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import math
+import random
+import operator
+from itertools import islice
+from collections import OrderedDict
+from functools import reduce
+
+# numpy is imported where it is used, so loading the model (e.g., to build the command line
+# interface) stays cheap
+
+# Replacement policies supported in 'replacement policy' of memory hierarchy levels
+REPLACEMENT_POLICIES = ['LRU', 'FIFO', 'random']
+
+# Arrays are placed one after another in memory, each aligned to a page
+ARRAY_ALIGNMENT = 4096
+
+# Number of iterations for which addresses are generated at once
+CHUNK_SIZE = 4096
+
+
+class Cache(object):
+    '''
+    One level of a set-associative cache, which allocates on writes and writes back modified
+    cachelines to *next_level* (None for main memory) once they are evicted.
+
+    *ways* of None means fully associative. Hits, misses (cachelines loaded from *next_level*)
+    and evicts are counted. Evicts are counted as soon as a cacheline becomes modified, since it
+    will be written back to *next_level* eventually. Thus evicts do not depend on the cache being
+    filled up during simulation.
+    '''
+
+    def __init__(self, level, size, cacheline_size, ways=None, replacement_policy='LRU',
+                 next_level=None):
+        self.level = level
+        self.next_level = next_level
+        self.associativity = ways
+        lines = max(1, size // cacheline_size)
+        self.ways = min(ways or lines, lines)
+        self.replacement_policy = replacement_policy
+        self._lru = replacement_policy == 'LRU'
+        self._random = random.Random(0) if replacement_policy == 'random' else None
+        self.set_count = max(1, lines // self.ways)
+        # Every set maps cachelines to their modified flag, in order of insertion (or last use)
+        self._sets = [OrderedDict() for i in range(self.set_count)]
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evicts = 0
+
+    def access(self, line, write=False):
+        '''Loads (or stores to, if *write* is True) cacheline *line*.'''
+        cache_set = self._sets[line % self.set_count]
+        if line in cache_set:
+            self.hits += 1
+            modified = cache_set.pop(line) if self._lru else cache_set[line]
+            if write and not modified:
+                self.evicts += 1
+            cache_set[line] = modified or write
+            return
+
+        self.misses += 1
+        if self.next_level is not None:
+            self.next_level.access(line)
+        self._insert(cache_set, line, write)
+
+    def write_back(self, line):
+        '''Receives modified cacheline *line* written back by the previous level.'''
+        cache_set = self._sets[line % self.set_count]
+        if line in cache_set:
+            if not cache_set[line]:
+                self.evicts += 1
+            cache_set[line] = True
+        else:
+            # The whole cacheline is written, so it does not need to be loaded
+            self._insert(cache_set, line, True)
+
+    def _insert(self, cache_set, line, modified):
+        if len(cache_set) >= self.ways:
+            if self._random is not None:
+                victim = next(islice(cache_set, self._random.randrange(len(cache_set)), None))
+                victim_modified = cache_set.pop(victim)
+            else:
+                victim, victim_modified = cache_set.popitem(last=False)
+            if victim_modified and self.next_level is not None:
+                self.next_level.write_back(victim)
+        if modified:
+            self.evicts += 1
+        cache_set[line] = modified
+
+
+class CacheSim(object):
+    """
+    class representation of a cache simulation
+
+    Replays the address stream of the loop nest through a set-associative cache hierarchy, to
+    validate the layer conditions assumed by ECMData, Roofline and LC (which ignore associativity
+    and treat every index order as a separate array). Only a window of iterations in the middle of
+    the iteration space is simulated, after warming up the caches with the preceding iterations.
+
+    Associativity ('ways', default: fully associative) and replacement policy ('replacement
+    policy', LRU, FIFO or random, default: LRU) are taken from the memory hierarchy levels of the
+    machine file.
+    """
+
+    name = "Cache Simulation"
+
+    @classmethod
+    def configure_arggroup(cls, parser):
+        parser.add_argument(
+            '--sim-iterations', metavar='ITERATIONS', type=int, default=10000,
+            help='Number of inner-most loop iterations to simulate. (default: 10000)')
+        parser.add_argument(
+            '--sim-warmup', metavar='ITERATIONS', type=int,
+            help='Number of iterations to warm up caches with, before counting. (default: '
+                 'largest reuse distance, but at most the size of the largest cache)')
+
+    @classmethod
+    def transition_values(cls, results):
+        '''Returns misses and evicts of all cache levels.'''
+        return [[l['misses'], l['evicts']] for l in results['memory hierarchy']]
+
+    def __init__(self, kernel, machine, args=None, parser=None):
+        """
+        *kernel* is a Kernel object
+        *machine* describes the machine (cpu, cache and memory) characteristics
+        *args* (optional) are the parsed arguments from the comand line
+        """
+        self.kernel = kernel
+        self.machine = machine
+        self._args = args
+        self._parser = parser
+
+        if args:
+            # handle CLI info
+            pass
+
+    def _build_hierarchy(self):
+        '''Returns list of Cache objects for all cache levels (excluding main memory).'''
+        cores = self._args.cores if self._args else 1
+        cacheline_size = int(float(self.machine['cacheline size']))
+        caches = []
+        for cache_info in reversed(self.machine['memory hierarchy'][:-1]):
+            cache_size = int(float(cache_info['size per group']))
+            # reduce cache size in parallel execution
+            if cores > 1 and cache_info['cores per group'] is not None and \
+                    cache_info['cores per group'] > 1:
+                cache_size //= min(cores, cache_info['cores per group'])
+            replacement_policy = cache_info.get('replacement policy', 'LRU')
+            assert replacement_policy in REPLACEMENT_POLICIES, \
+                'unknown replacement policy {} in machine file, supported are: {}'.format(
+                    replacement_policy, ', '.join(REPLACEMENT_POLICIES))
+            caches.insert(0, Cache(
+                cache_info['level'], cache_size, cacheline_size, ways=cache_info.get('ways'),
+                replacement_policy=replacement_policy,
+                next_level=caches[0] if caches else None))
+        return caches
+
+    def _loops(self):
+        '''Returns list of (index name, first value, step, trip count) from outer to inner loop.'''
+        loops = []
+        for index_name, iter_min, iter_max, step in self.kernel._loop_stack:
+            first = int(self.kernel.subs_consts(iter_min))
+            last = int(self.kernel.subs_consts(iter_max))
+            loops.append((index_name, first, step, max(0, int(math.ceil((last-first)/step)))))
+        return loops
+
+    def _accesses(self):
+        '''
+        Returns list of (base address, [(index name or None, offset, stride), ...], write) of all
+        array accesses in one iteration, reads before writes. Strides are in bytes.
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        base_addresses = {}
+        address = 0
+        for var_name in sorted(self.kernel._variables):
+            var_type, var_dims = self.kernel._variables[var_name]
+            if var_dims is None:
+                continue
+            base_addresses[var_name] = address
+            size = element_size*reduce(
+                operator.mul, [int(self.kernel.subs_consts(d)) for d in var_dims], 1)
+            address += int(math.ceil(size/ARRAY_ALIGNMENT))*ARRAY_ALIGNMENT
+
+        accesses = []
+        for sources, write in [(self.kernel._sources, False), (self.kernel._destinations, True)]:
+            for var_name in sorted(sources):
+                # Skip scalar values (they are hopefully kept in registers)
+                if var_name not in base_addresses:
+                    continue
+                var_dims = [int(self.kernel.subs_consts(d))
+                            for d in self.kernel._variables[var_name][1]]
+                for access_dimensions in sources[var_name]:
+                    dimensions = []
+                    for dim, offset_info in enumerate(access_dimensions):
+                        stride = element_size*reduce(operator.mul, var_dims[dim+1:], 1)
+                        if offset_info[0] == 'rel':
+                            dimensions.append((offset_info[1], offset_info[2], stride))
+                        else:  # offset_info[0] == 'abs'
+                            dimensions.append((None, offset_info[1], stride))
+                    accesses.append((base_addresses[var_name], dimensions, write))
+        return accesses
+
+    def _warmup_iterations(self):
+        '''
+        Returns number of iterations needed to warm up caches: the largest reuse distance (in
+        iterations) of all streams, but at most the number of iterations to stream the size of the
+        largest cache. Also all but the last cache are filled, so modified cachelines are written
+        back to all levels.
+        '''
+        import numpy
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        cacheline_size = int(float(self.machine['cacheline size']))
+        reads, writes, iteration_offsets = self.kernel.access_offsets()
+        distance = 0
+        bytes_per_iteration = 0
+        for var_name in iteration_offsets:
+            for idx_order, iteration_offset in iteration_offsets[var_name].items():
+                offsets = reads.get(var_name, {}).get(idx_order, []) + \
+                    writes.get(var_name, {}).get(idx_order, [])
+                distance = max(distance, (max(offsets) - min(offsets))/iteration_offset)
+                bytes_per_iteration += min(iteration_offset*element_size, cacheline_size)
+        cache_sizes = [int(float(c['size per group']))
+                       for c in self.machine['memory hierarchy'][:-1]]
+        bytes_per_iteration = max(bytes_per_iteration, 1)
+        return int(numpy.ceil(max(
+            min(distance + cacheline_size/element_size, max(cache_sizes)/bytes_per_iteration),
+            max([0] + cache_sizes[:-1])/bytes_per_iteration)))
+
+    def _skippable(self, accesses, first_level):
+        '''
+        Returns boolean list of *accesses*, which may be left out of the simulation as long as they
+        access the same cacheline as in the previous and the next iteration.
+
+        Such accesses always hit in *first_level*, if it uses LRU replacement and the cacheline can
+        not become least recently used in between: all accesses within the span of iterations
+        in which an access stays on one cacheline must touch less cachelines per set than the
+        cache has ways. Runs are not continued across iterations of outer loops, so cachelines
+        touched by every access within a span are consecutive. The last access to each cacheline
+        is still simulated, so the state of all caches is the same as with simulating every
+        access.
+        '''
+        cacheline_size = int(float(self.machine['cacheline size']))
+        inner_index = self.kernel._loop_stack[-1][0]
+        strides = [sum([stride for index_name, offset, stride in dimensions
+                        if index_name == inner_index])
+                   for base, dimensions, write in accesses]
+        skippable = [0 < stride < cacheline_size for stride in strides]
+        if first_level.replacement_policy != 'LRU' or not any(skippable):
+            return [False]*len(accesses)
+
+        # Longest span of iterations on one cacheline and cachelines touched by all accesses in it
+        span = max([int(math.ceil(cacheline_size/stride))
+                    for stride, skip in zip(strides, skippable) if skip])
+        lines_per_set = sum([int(math.ceil(
+            (int(math.ceil(span*abs(stride)/cacheline_size)) + 1)/first_level.set_count))
+            for stride in strides])
+        if lines_per_set > first_level.ways:
+            return [False]*len(accesses)
+        return skippable
+
+    def _iter_lines(self, loops, accesses, first_iteration, iterations):
+        '''
+        Yields (inner-most loop positions, cachelines) for chunks of *iterations* iterations,
+        starting at iteration number *first_iteration* (counted over the whole loop nest).
+        Cachelines are NumPy arrays with one row per iteration and one column per access.
+        '''
+        import numpy
+        cacheline_size = int(float(self.machine['cacheline size']))
+        trip_counts = [l[3] for l in loops]
+        for chunk_start in range(first_iteration, first_iteration+iterations, CHUNK_SIZE):
+            numbers = numpy.arange(
+                chunk_start, min(chunk_start+CHUNK_SIZE, first_iteration+iterations))
+            positions = numpy.unravel_index(numbers, trip_counts)
+            index_values = {name: first + position*step for (name, first, step, trips), position
+                            in zip(loops, positions)}
+
+            addresses = numpy.empty((len(numbers), len(accesses)), dtype=numpy.int64)
+            for i, (base, dimensions, write) in enumerate(accesses):
+                address = numpy.full(len(numbers), base, dtype=numpy.int64)
+                for index_name, offset, stride in dimensions:
+                    if index_name is None:
+                        address += offset*stride
+                    else:
+                        address += (index_values[index_name] + offset)*stride
+                addresses[:, i] = address
+            yield positions[-1], addresses // cacheline_size
+
+    def _simulate(self, caches, loops, accesses, first_iteration, iterations):
+        '''Simulates *iterations* iterations starting at *first_iteration* on *caches*.'''
+        import numpy
+        skippable = numpy.array(self._skippable(accesses, caches[0]))
+        writes = numpy.array([write for base, dimensions, write in accesses])
+        inner_trip_count = loops[-1][3]
+        access = caches[0].access
+        for positions, lines in self._iter_lines(loops, accesses, first_iteration, iterations):
+            # Accesses within a run on the same cacheline are hits
+            skip = numpy.zeros(lines.shape, dtype=bool)
+            skip[1:-1] = (lines[1:-1] == lines[:-2]) & (lines[1:-1] == lines[2:])
+            skip &= skippable
+            skip &= ((positions > 0) & (positions < inner_trip_count-1))[:, None]
+            caches[0].hits += int(skip.sum())
+
+            keep = ~skip
+            for line, write in zip(lines[keep].tolist(),
+                                   numpy.broadcast_to(writes, lines.shape)[keep].tolist()):
+                access(line, write)
+
+    def calculate_cache_access(self):
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        elements_per_cacheline = int(float(self.machine['cacheline size'])) // element_size
+
+        caches = self._build_hierarchy()
+        loops = self._loops()
+        accesses = self._accesses()
+        total_iterations = reduce(operator.mul, [l[3] for l in loops], 1)
+
+        # Simulate window in the middle of the iteration space, preceded by warm-up iterations
+        warmup = self._args.sim_warmup if self._args and self._args.sim_warmup is not None \
+            else self._warmup_iterations()
+        iterations = min(self._args.sim_iterations if self._args else 10000, total_iterations)
+        first_iteration = max(0, (total_iterations - iterations)//2 - warmup)
+        warmup = min(warmup, (total_iterations - iterations)//2)
+
+        self._simulate(caches, loops, accesses, first_iteration, warmup)
+        for cache in caches:
+            cache.reset_stats()
+        self._simulate(caches, loops, accesses, first_iteration+warmup, iterations)
+
+        # Counts are normalized to one cacheline worth of work
+        work = iterations/elements_per_cacheline if iterations else 1
+        results = {'iterations': iterations, 'warmup iterations': warmup,
+                   'first iteration': first_iteration, 'memory hierarchy': []}
+        for cache in caches:
+            results['memory hierarchy'].append({
+                'level': cache.level,
+                'ways': cache.associativity,
+                'replacement policy': cache.replacement_policy,
+                'hits': cache.hits/work,
+                'misses': cache.misses/work,
+                'evicts': cache.evicts/work})
+        return results
+
+    def analyze(self):
+        self.results = self.calculate_cache_access()
+
+    def report(self, output_file=sys.stdout):
+        if self._args and self._args.verbose >= 1:
+            print('Simulated {} iterations from iteration {}, after {} warm-up iterations'.format(
+                self.results['iterations'],
+                self.results['first iteration'] + self.results['warmup iterations'],
+                self.results['warmup iterations']), file=output_file)
+        print('per cacheline of work:', file=output_file)
+        print('  level | ways | policy |     hits |   misses |   evicts', file=output_file)
+        print('--------+------+--------+----------+----------+---------', file=output_file)
+        for level in self.results['memory hierarchy']:
+            print('{:>7} | {:>4} | {:>6} | {:>8.2f} | {:>8.2f} | {:>8.2f}'.format(
+                level['level'], level['ways'] or 'full', level['replacement policy'],
+                level['hits'], level['misses'], level['evicts']), file=output_file)
@@ -6,48 +6,15 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 from __future__ import division
 
-import operator
 import copy
 import sys
-import subprocess
-import re
 import math
-from functools import reduce
-from itertools import chain
 
-import sympy
 import six
-try:
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    plot_support = True
-except ImportError:
-    plot_support = False
-
-from kerncraft.intervals import Intervals
-from kerncraft.prefixedunit import PrefixedUnit
-
-def blocking(indices, block_size, initial_boundary=0):
-    '''
-    splits list of integers into blocks of block_size. returns block indices.
-
-    first block element is located at initial_boundary (default 0).
 
-    >>> blocking([0, -1, -2, -3, -4, -5, -6, -7, -8, -9], 8)
-    [0,-1]
-    >>> blocking([0], 8)
-    [0]
-    '''
-    blocks = []
-
-    for idx in indices:
-        bl_idx = (idx-initial_boundary)//float(block_size)
-        if bl_idx not in blocks:
-            blocks.append(bl_idx)
-    blocks.sort()
-
-    return blocks
+from kerncraft import bandwidth
+from kerncraft import cacheaccess
+from kerncraft.prefixedunit import PrefixedUnit
 
 
 class ECMData(object):
@@ -58,12 +25,16 @@ class ECMData(object):
     """
 
     name = "Execution-Cache-Memory (data transfers only)"
-    _expand_to_cacheline_blocks_cache = {}
 
     @classmethod
     def configure_arggroup(cls, parser):
         pass
 
+    @classmethod
+    def transition_values(cls, results):
+        '''Returns cycles of all data transfers.'''
+        return [cycles for level, cycles in results['cycles']]
+
     def __init__(self, kernel, machine, args=None, parser=None):
         """
         *kernel* is a Kernel object
@@ -79,361 +50,95 @@ class ECMData(object):
             # handle CLI info
             pass
 
-    def _calculate_relative_offset(self, name, access_dimensions):
-        '''
-        returns the offset from the iteration center in number of elements and the order of indices
-        used in access.
+    def _memory_bandwidth(self, cache_level, level, threads_per_core=1, cores=None):
         '''
-        offset = 0
-        base_dims = self.kernel._variables[name][1]
-
-        for dim, offset_info in enumerate(access_dimensions):
-            offset_type, idx_name, dim_offset = offset_info
-            assert offset_type == 'rel', 'Only relative access to arrays is supported at the moment'
-
-            if offset_type == 'rel':
-                offset += self.kernel.subs_consts(
-                   dim_offset*reduce(operator.mul, base_dims[dim+1:], sympy.Integer(1)))
-            else:
-                # should not happen
-                pass
-
-        return offset
+        Returns name of the benchmark kernels blended and their bandwidth (corrected for write
+        allocation) for transfers between *cache_level* and the next level, with stream counts from
+        *level* (see kerncraft.cacheaccess.cache_access()).
 
-    def _calculate_iteration_offset(self, name, index_order, loop_index):
+        Bandwidth is interpolated for *threads_per_core* on *cores* cores (on as many sockets as
+        needed, see kerncraft.bandwidth), or the maximum of all core counts measured on one socket
+        (i.e., the saturated bandwidth) if *cores* is None.
         '''
-        returns the offset from one to the next iteration using *loop_index*.
-        *index_order* is the order used by the access dimensions e.g. 'ijk' corresponse to [i][j][k]
-        *loop_index* specifies the loop to be used for iterations (this is typically the inner
-        moste one)
+        # blend bw of kernels fitting best to stream counts at current cache level (write-allocate
+        # is allready resolved in simulation), with a stream per cacheline of work
+        bw_level = self.machine['memory hierarchy'][cache_level+1]['level']
+        streams = (level['total lines misses'], level['total lines evicts'],
+                   level['write allocate'])
+        blend = bandwidth.kernel_blend(self.machine, *streams)
+        bw = bandwidth.bandwidth(
+            self.machine, bw_level, cores, threads_per_core, *streams,
+            placement=self._args.numa_placement)
+        return '/'.join([kernel_name for kernel_name, weight in blend]), \
+            PrefixedUnit(bw, 'B/s').reduced()
+
+    def _transfer_cycles(self, cache_level, level):
         '''
-        offset = 0
-        base_dims = self.kernel._variables[name][1]
-
-        for dim, index_name in enumerate(index_order):
-            if loop_index == index_name:
-                offset += self.kernel.subs_consts(
-                    reduce(operator.mul, base_dims[dim+1:], sympy.Integer(1)))
-
-        return offset
-
-    def _get_index_order(self, access_dimensions):
-        '''Returns the order of indices used in *access_dimensions*.'''
-        return ''.join([d[1] for d in access_dimensions])
-
-    def _expand_to_cacheline_blocks(self, first, last):
-        '''
-        Returns first and last values wich align with cacheline blocks, by increasing range.
+        Returns cycles per cacheline of work for transfers between *cache_level* and the next
+        level, with the name of the benchmark kernel and bandwidth used (both None if cycles are
+        given by the machine file).
         '''
-        if (first,last) not in self._expand_to_cacheline_blocks_cache:
-            # handle multiple datatypes
-            element_size = self.kernel.datatypes_size[self.kernel.datatype]
-            elements_per_cacheline = int(float(self.machine['cacheline size'])) / element_size
-
-            self._expand_to_cacheline_blocks_cache[(first,last)] = [
-                first - first % elements_per_cacheline,
-                last - last % elements_per_cacheline + elements_per_cacheline - 1]
-
-        return self._expand_to_cacheline_blocks_cache[(first,last)]
+        cache_info = self.machine['memory hierarchy'][cache_level]
+        cache_cycles = cache_info['cycles per cacheline transfer']
+
+        if not cache_info['bandwidth']:
+            # only cache cycles count
+            return (level['total lines misses'] + level['total lines evicts'])*cache_cycles, \
+                None, None
+
+        # Memory transfer
+        # we use bandwidth to calculate cycles and then add panalty cycles (if given)
+        # choose smt, and then use max/saturation bw
+        measurement_kernel, bw = self._memory_bandwidth(cache_level, level)
+
+        # calculate cycles
+        cycles = self._bandwidth_cycles(level, bw)
+        # add penalty cycles for each read stream
+        if cache_cycles:
+            cycles += level['total lines misses']*cache_cycles
+        return cycles, measurement_kernel, bw
+
+    def _bandwidth_cycles(self, level, bw):
+        '''Returns cycles to transfer misses and evicts of *level* with bandwidth *bw*.'''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        elements_per_cacheline = cacheaccess.elements_per_cacheline(self.kernel, self.machine)
+        return float(level['total lines misses'] + level['total lines evicts']) * \
+            float(elements_per_cacheline) * float(element_size) * \
+            float(self.machine['clock']) / float(bw)
+
+    def _cache_access(self, cores):
+        '''Returns cache access simulation with *cores* cores (on as many sockets as needed).'''
+        # Shared caches are only shared by cores on the same socket
+        return cacheaccess.cache_access(
+            self.kernel, self.machine, cores=max(bandwidth.socket_cores(self.machine, cores)),
+            nontemporal_stores=cacheaccess.nontemporal_arrays(
+                self.kernel, self._args.nontemporal_stores))
 
     def calculate_cache_access(self):
         results = {}
 
-        read_offsets = {var_name: dict() for var_name in list(self.kernel._variables.keys())}
-        write_offsets = {var_name: dict() for var_name in list(self.kernel._variables.keys())}
-        
-        # handle multiple datatypes
-        element_size = self.kernel.datatypes_size[self.kernel.datatype]
-        elements_per_cacheline = self.machine['cacheline size'] // element_size
-        
-
-        loop_order = ''.join([l[0] for l in self.kernel._loop_stack])
-
-        for var_name in list(self.kernel._variables.keys()):
-            var_type, var_dims = self.kernel._variables[var_name]
-
-            # Skip the following access: (they are hopefully kept in registers)
-            #   - scalar values
-            if var_dims is None:
-                continue
-            #   - access does not change with inner-most loop index (they are hopefully kept in 
-            #     registers)
-            writes = [acs for acs in self.kernel._destinations.get(var_name, []) if loop_order[-1] in [a[1] for a in acs]]
-            reads = [acs for acs in self.kernel._sources.get(var_name, []) if loop_order[-1] in [a[1] for a in acs]]
-
-            # Compile access pattern
-            for r in reads:
-                offset = self._calculate_relative_offset(var_name, r)
-                idx_order = self._get_index_order(r)
-                read_offsets[var_name].setdefault(idx_order, [])
-                read_offsets[var_name][idx_order].append(offset)
-            for w in writes:
-                offset = self._calculate_relative_offset(var_name, w)
-                idx_order = self._get_index_order(w)
-                write_offsets[var_name].setdefault(idx_order, [])
-                write_offsets[var_name][idx_order].append(offset)
-
-            # Do unrolling so that one iteration equals one cacheline worth of workload:
-            # unrolling is done on inner-most loop only!
-            for i in range(1, int(elements_per_cacheline)):
-                for r in reads:
-                    idx_order = self._get_index_order(r)
-                    offset = self._calculate_relative_offset(var_name, r)
-                    offset += i * self._calculate_iteration_offset(
-                        var_name, idx_order, loop_order[-1])
-                    read_offsets[var_name][idx_order].append(offset)
-
-                    # Remove multiple access to same offsets
-                    read_offsets[var_name][idx_order] = \
-                        sorted(list(set(read_offsets[var_name][idx_order])), reverse=True)
-
-                for w in writes:
-                    idx_order = self._get_index_order(w)
-                    offset = self._calculate_relative_offset(var_name, w)
-                    offset += i * self._calculate_iteration_offset(
-                        var_name, idx_order, loop_order[-1])
-                    write_offsets[var_name][idx_order].append(offset)
-
-                    # Remove multiple access to same offsets
-                    write_offsets[var_name][idx_order] = \
-                        sorted(list(set(write_offsets[var_name][idx_order])), reverse=True)
-
-        # initialize misses and hits
-        misses = {}
-        hits = {}
-        evicts = {}
-        total_misses = {}
-        total_hits = {}
-        total_evicts = {}
-        total_lines_misses = {}
-        total_lines_hits = {}
-        total_lines_evicts = {}
-
         self.results = {'memory hierarchy': [], 'cycles': []}
 
-        # Check for layer condition towards all cache levels (except main memory/last level)
-        for cache_level, cache_info in list(enumerate(self.machine['memory hierarchy']))[:-1]:
-            cache_size = int(float(cache_info['size per group']))
-            # reduce cache size in parallel execution
-            if self._args.cores > 1 and cache_info['cores per group'] is not None and \
-                    cache_info['cores per group'] > 1:
-                if self._args.cores < cache_info['cores per group']:
-                    cache_size /= self._args.cores
-                else:
-                    cache_size /= cache_info['cores per group']
-            cache_cycles = cache_info['cycles per cacheline transfer']
-            bandwidth = cache_info['bandwidth']
-
-            trace_length = 0
-            updated_length = True
-            while updated_length:
-                updated_length = False
-
-                # Initialize cache, misses, hits and evicts for current level
-                cache = {}
-                misses[cache_level] = {}
-                hits[cache_level] = {}
-                evicts[cache_level] = {}
-
-                # We consider everythin a miss in the beginning, unless it is completly cached
-                # TODO here read and writes are treated the same, this implies write-allocate
-                #      to support nontemporal stores, this needs to be changed
-                for name in chain(read_offsets.keys(), write_offsets.keys()):
-                    cache[name] = {}
-                    misses[cache_level][name] = {}
-                    hits[cache_level][name] = {}
-
-                    for idx_order in chain(read_offsets[name].keys(), write_offsets[name].keys()):
-                        cache[name][idx_order] = Intervals()
-                        
-                        # Check for complete caching/in-cache
-                        # TODO change from pessimistic to more realistic approach (different 
-                        #      indexes are treasted as individual arrays)
-                        total_array_size = self.kernel.subs_consts(
-                            element_size*reduce(operator.mul, self.kernel._variables[name][1]))
-                        if total_array_size < trace_length:
-                            # all hits no misses
-                            misses[cache_level][name][idx_order] = []
-                            if cache_level-1 not in misses:
-                                hits[cache_level][name][idx_order] = sorted(
-                                    read_offsets.get(name, {}).get(idx_order, []) +
-                                    write_offsets.get(name, {}).get(idx_order, []),
-                                    reverse=True)
-                            else:
-                                hits[cache_level][name][idx_order] = list(
-                                    misses[cache_level-1][name][idx_order])
-                          
-                        # partial caching (default case) 
-                        else:
-                            if cache_level-1 not in misses:
-                                misses[cache_level][name][idx_order] = sorted(
-                                    read_offsets.get(name, {}).get(idx_order, []) +
-                                    write_offsets.get(name, {}).get(idx_order, []),
-                                    reverse=True)
-                            else:
-                                misses[cache_level][name][idx_order] = list(
-                                    misses[cache_level-1][name][idx_order])
-                            hits[cache_level][name][idx_order] = []
-
-                # Caches are still empty (thus only misses)
-                trace_count = 0
-                cache_used_size = 0
-
-                # Now we trace the cache access backwards (in time/iterations) and check for hits
-                for var_name in list(misses[cache_level].keys()):
-                    for idx_order in list(misses[cache_level][var_name].keys()):
-                        iter_offset = self._calculate_iteration_offset(
-                            var_name, idx_order, loop_order[-1])
-
-                        # Add cache trace
-                        for offset in list(misses[cache_level][var_name][idx_order]):
-                            # If already present in cache add to hits
-                            if offset in cache[var_name][idx_order]:
-                                misses[cache_level][var_name][idx_order].remove(offset)
-
-                                # We might have multiple hits on the same offset (e.g in DAXPY)
-                                if offset not in hits[cache_level][var_name][idx_order]:
-                                    hits[cache_level][var_name][idx_order].append(offset)
-
-                            # Add cache, we can do this since misses are sorted in reverse order of
-                            # access and we assume LRU cache replacement policy
-                            if iter_offset <= elements_per_cacheline:
-                                # iterations overlap, thus we can savely add the whole range
-                                cached_first, cached_last = self._expand_to_cacheline_blocks(
-                                    offset-iter_offset*trace_length, offset+1)
-                                cache[var_name][idx_order] &= Intervals(
-                                    [cached_first, cached_last+1], sane=True)
-                            else:
-                                # There is no overlap, we can append the ranges onto one another
-                                # TODO optimize this code section (and maybe merge with above)
-                                new_cache = [self._expand_to_cacheline_blocks(o, o) for o in range(
-                                    offset-iter_offset*trace_length, offset+1, iter_offset)]
-                                new_cache = Intervals(*new_cache, sane=True)
-                                cache[var_name][idx_order] &= new_cache
-
-                        trace_count += len(cache[var_name][idx_order].data)
-                        cache_used_size += len(cache[var_name][idx_order])*element_size
-                
-                # Calculate new possible trace_length according to free space in cache
-                # TODO take CL blocked access into account
-                # TODO make /2 customizable
-                #new_trace_length = trace_length + \
-                #    ((cache_size/2 - cache_used_size)/trace_count)/element_size
-                if trace_count > 0:  # to catch complete caching
-                    new_trace_length = trace_length + \
-                        ((cache_size - cache_used_size)/trace_count)/element_size
-
-                if new_trace_length > trace_length:
-                    trace_length = new_trace_length
-                    updated_length = True
-
-                # All writes to require the data to be evicted eventually
-                evicts[cache_level] = {
-                    var_name: dict() for var_name in self.kernel._variables.keys()}
-                for name in write_offsets.keys():
-                    for idx_order in write_offsets[name].keys():
-                        evicts[cache_level][name][idx_order] = write_offsets[name][idx_order]
-            
-            # Compiling stats
-            total_misses[cache_level] = sum([
-                sum([len(v) for v in l.values()])
-                for l in misses[cache_level].values()])
-            total_hits[cache_level] = sum([
-                sum([len(v) for v in l.values()])
-                for l in hits[cache_level].values()])
-            total_evicts[cache_level] = sum([
-                sum([len(v) for v in l.values()])
-                for l in evicts[cache_level].values()])
-            
-            total_lines_misses[cache_level] = sum([
-                sum([len(blocking(n, elements_per_cacheline)) for n in list(o.values())])
-                for o in misses[cache_level].values()])
-            total_lines_hits[cache_level] = sum([
-                sum([len(blocking(n, elements_per_cacheline)) for n in list(o.values())])
-                for o in hits[cache_level].values()])
-            total_lines_evicts[cache_level] = sum([
-                sum([len(blocking(n, elements_per_cacheline)) for n in list(o.values())])
-                for o in evicts[cache_level].values()])
-
-            if not bandwidth:
-                # only cache cycles count
-                cycles = (total_lines_misses[cache_level] + total_lines_evicts[cache_level]) * \
-                    cache_cycles
-            else:
-                # Memory transfer
-                # we use bandwidth to calculate cycles and then add panalty cycles (if given)
-                
-                # choose bw according to cache level and problem
-                # first, compile stream counts at current cache level
-                # write-allocate is allready resolved above
-                read_streams = 0
-                for var_name in list(misses[cache_level].keys()):
-                    for idx_order in misses[cache_level][var_name]:
-                        read_streams += len(misses[cache_level][var_name][idx_order])
-                write_streams = 0
-                for var_name in list(evicts[cache_level].keys()):
-                    for idx_order in evicts[cache_level][var_name]:
-                        write_streams += len(evicts[cache_level][var_name][idx_order])
-                # second, try to find best fitting kernel (closest to stream seen stream counts):
-                # write allocate has to be handled in kernel information (all writes are also reads)
-                # TODO support for non-write-allocate architectures
-                measurement_kernel = 'load'
-                measurement_kernel_info = self.machine['benchmarks']['kernels'][measurement_kernel]
-                for kernel_name, kernel_info in sorted(
-                        self.machine['benchmarks']['kernels'].items()):
-                    if (read_streams >= (kernel_info['read streams']['streams'] +
-                                         kernel_info['write streams']['streams'] -
-                                         kernel_info['read+write streams']['streams']) >
-                            measurement_kernel_info['read streams']['streams'] +
-                            measurement_kernel_info['write streams']['streams'] -
-                            measurement_kernel_info['read+write streams']['streams'] and
-                            write_streams >= kernel_info['write streams']['streams'] >
-                            measurement_kernel_info['write streams']['streams']):
-                        measurement_kernel = kernel_name
-                        measurement_kernel_info = kernel_info
-
-                # choose smt, and then use max/saturation bw
-                threads_per_core = 1
-                bw_level = self.machine['memory hierarchy'][cache_level+1]['level']
-                bw_measurements = \
-                    self.machine['benchmarks']['measurements'][bw_level][threads_per_core]
-                assert threads_per_core == bw_measurements['threads per core'], \
-                    'malformed measurement dictionary in machine file.'
-                bw = max(bw_measurements['results'][measurement_kernel])
-
-                # Correct bandwidth due to miss-measurement of write allocation
-                # TODO support non-temporal stores and non-write-allocate architectures
-                measurement_kernel_info = self.machine['benchmarks']['kernels'][measurement_kernel]
-                factor = (float(measurement_kernel_info['read streams']['bytes']) +
-                          2.0*float(measurement_kernel_info['write streams']['bytes']) -
-                          float(measurement_kernel_info['read+write streams']['bytes'])) / \
-                         (float(measurement_kernel_info['read streams']['bytes']) +
-                          float(measurement_kernel_info['write streams']['bytes']))
-                bw = bw * factor
-                
-                # calculate cycles
-                cycles = float(total_lines_misses[cache_level] + total_lines_evicts[cache_level]) *\
-                    float(elements_per_cacheline) * float(element_size) * \
-                    float(self.machine['clock']) / float(bw)
-                # add penalty cycles for each read stream
-                if cache_cycles:
-                    cycles += total_lines_misses[cache_level]*cache_cycles
+        levels = self._cache_access(self._args.cores)
+        for cache_level, level in enumerate(levels):
+            cache_info = self.machine['memory hierarchy'][cache_level]
+            cycles, measurement_kernel, bw = self._transfer_cycles(cache_level, level)
 
             self.results['memory hierarchy'].append({
                 'index': len(self.results['memory hierarchy']),
                 'level': '{}'.format(cache_info['level']),
-                'total misses': total_misses[cache_level],
-                'total hits': total_hits[cache_level],
-                'total evicts': total_evicts[cache_level],
-                'total lines misses': total_lines_misses[cache_level],
-                'total lines hits': total_lines_hits[cache_level],
-                'total lines evicts': total_lines_evicts[cache_level],
-                'trace length': trace_length,
-                'misses': misses[cache_level],
-                'hits': hits[cache_level],
-                'evicts': evicts[cache_level],
+                'total misses': level['total misses'],
+                'total hits': level['total hits'],
+                'total evicts': level['total evicts'],
+                'total lines misses': level['total lines misses'],
+                'total lines hits': level['total lines hits'],
+                'total lines evicts': level['total lines evicts'],
+                'trace length': level['trace length'],
+                'misses': cacheaccess.as_lists(level['misses']),
+                'hits': cacheaccess.as_lists(level['hits']),
+                'evicts': cacheaccess.as_lists(level['evicts']),
                 'cycles': cycles})
-            if bandwidth:
+            if cache_info['bandwidth']:
                 self.results['memory hierarchy'][-1].update({
                     'memory bandwidth kernel': measurement_kernel,
                     'memory bandwidth': bw})
@@ -448,6 +153,66 @@ class ECMData(object):
 
         return results
 
+    def scaling(self, T_OL=0.0, T_nOL=0.0):
+        '''
+        Returns multi-core scaling curve for in-core cycles *T_OL* and *T_nOL* (per cacheline).
+
+        For all core counts (on all sockets) and threads per core with bandwidth measurements,
+        data transfers are analyzed with shared caches divided among the cores. Every core needs
+        max(T_OL, T_nOL + data transfer cycles) per cacheline, until the bandwidth with as many
+        cores (interpolated, see kerncraft.bandwidth) limits transfers of a level with bandwidth
+        (usually main memory).
+
+        Returns list of dictionaries ordered by threads per core and cores, with 'cores',
+        'threads per core', 'cycles' (per cacheline of work on all cores), 'core cycles' and
+        'bandwidth cycles' (the same, if limited by cores or bandwidth), 'bottleneck' (None if
+        limited by cores, otherwise the transfer) and 'speedup' (compared to the first entry).
+        '''
+        bandwidth_levels = [cache_level for cache_level, cache_info
+                            in enumerate(self.machine['memory hierarchy'][:-1])
+                            if cache_info['bandwidth']]
+        if not bandwidth_levels:
+            return []
+        measurements = self.machine['benchmarks']['measurements'][
+            self.machine['memory hierarchy'][bandwidth_levels[0]+1]['level']]
+
+        curve = []
+        for threads_per_core in sorted(measurements):
+            for cores in range(
+                    1, self.machine['sockets']*self.machine['cores per socket']+1):
+                levels = self._cache_access(cores)
+                data_cycles = sum([self._transfer_cycles(cache_level, level)[0]
+                                   for cache_level, level in enumerate(levels)])
+                core_cycles = max(T_OL, T_nOL + data_cycles)/cores
+
+                # All cores together are limited by the measured bandwidth
+                bottleneck = None
+                bandwidth_cycles = 0.0
+                for cache_level in bandwidth_levels:
+                    measurement_kernel, bw = self._memory_bandwidth(
+                        cache_level, levels[cache_level], threads_per_core, cores)
+                    cycles = self._bandwidth_cycles(levels[cache_level], bw)
+                    if cycles > bandwidth_cycles:
+                        bandwidth_cycles = cycles
+                        if cycles > core_cycles:
+                            bottleneck = '{}-{}'.format(
+                                self.machine['memory hierarchy'][cache_level]['level'],
+                                self.machine['memory hierarchy'][cache_level+1]['level'])
+
+                curve.append({
+                    'cores': cores,
+                    'threads per core': threads_per_core,
+                    'cycles': max(core_cycles, bandwidth_cycles),
+                    'core cycles': core_cycles,
+                    'bandwidth cycles': bandwidth_cycles,
+                    'bottleneck': bottleneck})
+
+        for point in curve:
+            # Without any cycles, cores scale perfectly
+            point['speedup'] = curve[0]['cycles']/point['cycles'] if point['cycles'] \
+                else float(point['cores'])
+        return curve
+
     def analyze(self):
         self._results = self.calculate_cache_access()
 
@@ -501,11 +266,19 @@ class ECMCPU(object):
     """
 
     name = "Execution-Cache-Memory (CPU operations only)"
+    # Output of IACA is left out of --json and --csv records
+    raw_results = ['IACA output', 'IACA latency output']
+    tools = ['compiler', 'iaca.sh']
 
     @classmethod
     def configure_arggroup(cls, parser):
         pass
 
+    @classmethod
+    def transition_values(cls, results):
+        '''Returns overlapping and non-overlapping in-core cycles.'''
+        return [results['T_OL'], results['T_nOL']]
+
     def __init__(self, kernel, machine, args=None, parser=None):
         """
         *kernel* is a Kernel object
@@ -527,66 +300,23 @@ class ECMCPU(object):
                     parser.error('--asm-block can only be "auto", "manual" or an integer')
 
     def analyze(self):
-        # For the IACA/CPU analysis we need to compile and assemble
-        asm_name = self.kernel.compile(
-            self.machine['compiler'], compiler_args=self.machine['compiler flags'])
-        bin_name = self.kernel.assemble(
-            self.machine['compiler'], asm_name, iaca_markers=True, asm_block=self._args.asm_block,
+        # For the IACA/CPU analysis we need to compile and assemble (only done once per kernel
+        # and configuration, since generated code does not depend on the values of constants)
+        iaca_analysis = self.kernel.iaca_analysis(
+            micro_architecture=self.machine['micro-architecture'],
+            compiler=self.machine['compiler'],
+            compiler_args=self.machine['compiler flags'],
+            asm_block=self._args.asm_block,
             asm_increment=self._args.asm_increment)
-
-        try:
-            cmd = ['iaca.sh', '-64', '-arch', self.machine['micro-architecture'], bin_name]
-            iaca_output = subprocess.check_output(cmd).decode('utf-8')
-        except OSError as e:
-            print("IACA execution failed:", ' '.join(cmd), file=sys.stderr)
-            print(e, file=sys.stderr)
-            sys.exit(1)
-        except subprocess.CalledProcessError as e:
-            print("IACA throughput analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-
-        # Get total cycles per loop iteration
-        match = re.search(
-            r'^Block Throughput: ([0-9\.]+) Cycles', iaca_output, re.MULTILINE)
-        assert match, "Could not find Block Throughput in IACA output."
-        block_throughput = float(match.groups()[0])
-
-        # Find ports and cyles per port
-        ports = [l for l in iaca_output.split('\n') if l.startswith('|  Port  |')]
-        cycles = [l for l in iaca_output.split('\n') if l.startswith('| Cycles |')]
-        assert ports and cycles, "Could not find ports/cylces lines in IACA output."
-        ports = [p.strip() for p in ports[0].split('|')][2:]
-        cycles = [c.strip() for c in cycles[0].split('|')][2:]
-        port_cycles = []
-        for i in range(len(ports)):
-            if '-' in ports[i] and ' ' in cycles[i]:
-                subports = [p.strip() for p in ports[i].split('-')]
-                subcycles = [c for c in cycles[i].split(' ') if bool(c)]
-                port_cycles.append((subports[0], float(subcycles[0])))
-                port_cycles.append((subports[0]+subports[1], float(subcycles[1])))
-            elif ports[i] and cycles[i]:
-                port_cycles.append((ports[i], float(cycles[i])))
-        port_cycles = dict(port_cycles)
-
-        match = re.search(r'^Total Num Of Uops: ([0-9]+)', iaca_output, re.MULTILINE)
-        assert match, "Could not find Uops in IACA output."
-        uops = float(match.groups()[0])
-        
-        # Get latency prediction from IACA
-        try:
-            iaca_latency_output = subprocess.check_output(
-                ['iaca.sh', '-64', '-analysis', 'LATENCY', '-arch',
-                 self.machine['micro-architecture'], bin_name]).decode('utf-8')
-        except subprocess.CalledProcessError as e:
-            print("IACA latency analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-        match = re.search(
-            r'^Latency: ([0-9\.]+) Cycles', iaca_latency_output, re.MULTILINE)
-        assert match, "Could not find Latency in IACA latency analysis output."
-        block_latency = float(match.groups()[0])
+        block_throughput = iaca_analysis['throughput']
+        port_cycles = iaca_analysis['port cycles']
+        uops = iaca_analysis['uops']
+        block_latency = iaca_analysis['latency']
+        iaca_output = iaca_analysis['IACA output']
+        iaca_latency_output = iaca_analysis['IACA latency output']
         
         # Normalize to cycles per cacheline
-        elements_per_block = abs(self.kernel.asm_block['pointer_increment']
+        elements_per_block = abs(iaca_analysis['pointer increment']
                                  // self.kernel.datatypes_size[self.kernel.datatype])
         block_size = elements_per_block*self.kernel.datatypes_size[self.kernel.datatype]
         try:
@@ -677,6 +407,8 @@ class ECM(object):
     """
 
     name = "Execution-Cache-Memory"
+    raw_results = ECMCPU.raw_results
+    tools = ECMCPU.tools
 
     @classmethod
     def configure_arggroup(cls, parser):
@@ -685,6 +417,11 @@ class ECM(object):
             '--ecm-plot',
             help='Filename to save ECM plot to (supported extensions: pdf, png, svg and eps)')
 
+    @classmethod
+    def transition_values(cls, results):
+        '''Returns data transfer and in-core cycles.'''
+        return ECMData.transition_values(results) + ECMCPU.transition_values(results)
+
     def __init__(self, kernel, machine, args=None, parser=None):
         """
         *kernel* is a Kernel object
@@ -708,24 +445,26 @@ class ECM(object):
         self.results = copy.deepcopy(self._CPU.results)
         self.results.update(copy.deepcopy(self._data.results))
         
-        # Saturation/multi-core scaling analysis
-        # very simple approach. Assumptions are:
-        #  - bottleneck is always LLC-MEM
-        #  - all caches scale with number of cores (bw AND size(WRONG!))
-        if self.results['cycles'][-1][1] == 0.0:
+        # Saturation/multi-core scaling analysis, based on measured bandwidths
+        self.results['scaling'] = self._data.scaling(self.results['T_OL'], self.results['T_nOL'])
+        single_thread = [p for p in self.results['scaling'] if p['threads per core'] == 1]
+        saturated = [p['cores'] for p in single_thread if p['bottleneck'] is not None]
+        if saturated:
+            self.results['scaling cores'] = saturated[0]
+        elif not single_thread or single_thread[-1]['bandwidth cycles'] == 0.0:
             # Full caching in higher cache level
             self.results['scaling cores'] = float('inf')
         else:
+            # Not saturated with measured cores, extrapolate with the largest core count
             self.results['scaling cores'] = int(math.ceil(
-                    max(self.results['T_OL'],
-                    self.results['T_nOL']+sum([c[1] for c in self.results['cycles']])) / \
-                self.results['cycles'][-1][1]))
+                single_thread[-1]['core cycles']*single_thread[-1]['cores'] /
+                single_thread[-1]['bandwidth cycles']))
 
     def report(self, output_file=sys.stdout):
         report = ''
         if self._args and self._args.verbose > 1:
-            self._CPU.report()
-            self._data.report()
+            self._CPU.report(output_file=output_file)
+            self._data.report(output_file=output_file)
         
         total_cycles = max(
             self.results['T_OL'],
@@ -748,8 +487,29 @@ class ECM(object):
 
         print(report, file=output_file)
 
+        if self._args and self._args.verbose >= 1 and self.results['scaling']:
+            print('', file=output_file)
+            print('  cores | threads |    cy/CL | {:>15} | speedup | bottleneck'.format(
+                      self._args.unit or 'It/s'),
+                  file=output_file)
+            print('--------+---------+----------+-----------------+---------+-----------',
+                  file=output_file)
+            for point in self.results['scaling']:
+                print('{:>7} | {:>7} | {:>8.2f} | {!s:>15} | {:>7.2f} | {}'.format(
+                          point['cores'], point['threads per core'], point['cycles'],
+                          self._CPU.conv_cy(point['cycles'], self._args.unit, default='It/s')
+                          if point['cycles'] else 'inf',
+                          point['speedup'], point['bottleneck'] or 'cores'),
+                      file=output_file)
+
         if self._args and self._args.ecm_plot:
-            assert plot_support, "matplotlib couldn't be imported. Plotting is not supported."
+            # matplotlib is slow to import, so it is only loaded if a plot was requested
+            try:
+                import matplotlib
+                matplotlib.use('Agg')
+                import matplotlib.pyplot as plt
+            except ImportError:
+                raise AssertionError("matplotlib couldn't be imported. Plotting is not supported.")
 
             fig = plt.figure(frameon=False)
             fig.subplots_adjust(left=0.1, right=0.9, top=0.9, bottom=0.15)
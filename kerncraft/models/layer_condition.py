@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import math
+
+# numpy and sympy are imported where they are used, so loading the model (e.g., to build the
+# command line interface) stays cheap
+
+class LC(object):
+    """
+    class representation of the Layer Condition analysis
+
+    Instead of tracing the cache content iteratively for one set of constants (as done by
+    ECMData and Roofline), the layer conditions are derived in closed form from the reuse
+    distances between successive accesses of each stream. This allows to evaluate many problem
+    sizes at once and to solve for the critical problem sizes at which accesses start to hit.
+    """
+
+    name = "Layer Conditions"
+
+    @classmethod
+    def configure_arggroup(cls, parser):
+        pass
+
+    @classmethod
+    def transition_values(cls, results):
+        '''Returns hits, misses and evicts of all cache levels.'''
+        return [[c['hits'], c['misses'], c['evicts']] for c in results['cache']]
+
+    def __init__(self, kernel, machine, args=None, parser=None):
+        """
+        *kernel* is a Kernel object
+        *machine* describes the machine (cpu, cache and memory) characteristics
+        *args* (optional) are the parsed arguments from the comand line
+        """
+        self.kernel = kernel
+        self.machine = machine
+        self._args = args
+        self._parser = parser
+
+        if args:
+            # handle CLI info
+            pass
+
+    def _cache_sizes(self):
+        '''Returns list of (level, size in bytes) for all cache levels (excluding main memory).'''
+        cores = self._args.cores if self._args else 1
+        cache_sizes = []
+        for cache_info in self.machine['memory hierarchy'][:-1]:
+            cache_size = int(float(cache_info['size per group']))
+            # reduce cache size in parallel execution
+            if cores > 1 and cache_info['cores per group'] is not None and \
+                    cache_info['cores per group'] > 1:
+                cache_size //= min(cores, cache_info['cores per group'])
+            cache_sizes.append((cache_info['level'], cache_size))
+        return cache_sizes
+
+    def _iter_streams(self, constants=None):
+        '''
+        Yields (offsets, iteration_offset, symbolic_offsets, symbolic_iteration_offset, writes)
+        for every stream (array and index order) accessed in the inner-most loop.
+
+        *offsets* contain all reads and writes evaluated with *constants*, *symbolic_offsets* the
+        corresponding sympy expressions in the same order and *writes* is the number of writes.
+        '''
+        symbolic_reads, symbolic_writes, symbolic_iteration_offsets = \
+            self.kernel.symbolic_access_offsets()
+        reads, writes, iteration_offsets = self.kernel.access_offsets(constants)
+
+        for var_name in sorted(iteration_offsets):
+            for idx_order in sorted(iteration_offsets[var_name]):
+                stream_writes = writes.get(var_name, {}).get(idx_order, [])
+                yield (reads.get(var_name, {}).get(idx_order, []) + stream_writes,
+                       iteration_offsets[var_name][idx_order],
+                       symbolic_reads.get(var_name, {}).get(idx_order, []) +
+                       symbolic_writes.get(var_name, {}).get(idx_order, []),
+                       symbolic_iteration_offsets[var_name][idx_order],
+                       len(stream_writes))
+
+    def _bytes_per_iteration(self, iteration_offset):
+        '''Returns bytes brought into cache by one stream per inner-most loop iteration.'''
+        import numpy
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        return numpy.minimum(iteration_offset*element_size,
+                             int(float(self.machine['cacheline size'])))
+
+    def evaluate(self, constants=None):
+        '''
+        Returns list of dictionaries with number of hits, misses and evicts per cache level
+        evaluated with *constants* (defaults to constants set in kernel).
+
+        Values in *constants* may also be NumPy arrays, to evaluate a whole range of problem sizes
+        at once. Returned counts then are arrays of the broadcasted shape.
+        '''
+        import numpy
+        if constants is None:
+            constants = self.kernel._constants
+        shape = numpy.broadcast(*([0] + list(constants.values()))).shape
+
+        distances = []
+        distance_bytes = []
+        stream_bytes = numpy.zeros(shape)
+        accesses = 0
+        evicts = 0
+        for offsets, iteration_offset, _, _, writes in self._iter_streams(constants):
+            iteration_offset = numpy.broadcast_to(iteration_offset, shape)
+            offsets = numpy.sort(
+                numpy.array([numpy.broadcast_to(o, shape) for o in offsets]), axis=0)[::-1]
+            bytes_per_iteration = self._bytes_per_iteration(iteration_offset)
+            stream_bytes = stream_bytes + bytes_per_iteration
+            for distance in offsets[:-1] - offsets[1:]:
+                distances.append(distance/iteration_offset)
+                distance_bytes.append(bytes_per_iteration)
+            accesses += len(offsets)
+            # All writes require the data to be evicted eventually
+            evicts += writes
+
+        # Required cache size for each reuse distance to be fulfilled: all streams need to keep
+        # (at most) the same reuse distance worth of data
+        if distances:
+            distances = numpy.array(distances)
+            distance_bytes = numpy.array(distance_bytes)
+            requirements = (numpy.minimum(distances[:, None], distances[None, :]) *
+                            distance_bytes[:, None]).sum(axis=0) + distances*stream_bytes
+        else:
+            requirements = numpy.zeros((0,) + shape)
+
+        results = []
+        for level, cache_size in self._cache_sizes():
+            hits = (requirements <= cache_size).sum(axis=0)
+            results.append({
+                'level': level,
+                'hits': hits,
+                'misses': accesses - hits,
+                'evicts': evicts})
+        return results
+
+    def calculate_cache_access(self):
+        import sympy
+        results = {'cache': []}
+
+        # Reuse distances (in inner-most loop iterations) between successive accesses to a stream,
+        # as (value, expression, bytes per iteration) with value evaluated at current constants
+        distances = []
+        stream_bytes = 0
+        for offsets, iteration_offset, symbolic_offsets, symbolic_iteration_offset, _ in \
+                self._iter_streams():
+            offsets = sorted(zip(offsets, symbolic_offsets), key=lambda o: o[0], reverse=True)
+            bytes_per_iteration = int(self._bytes_per_iteration(iteration_offset))
+            stream_bytes += bytes_per_iteration
+            for (first, symbolic_first), (last, symbolic_last) in zip(offsets[:-1], offsets[1:]):
+                distances.append((
+                    (first - last)/iteration_offset,
+                    (symbolic_first - symbolic_last)/symbolic_iteration_offset,
+                    bytes_per_iteration))
+        distances.sort(key=lambda d: d[0])
+
+        # Layer condition of each reuse distance (the same for all cache levels), accesses with
+        # identical conditions are merged
+        conditions = []
+        for value, expression, bytes_per_iteration in distances:
+            requirement = expression*stream_bytes
+            for other_value, other_expression, other_bytes in distances:
+                if other_value <= value:
+                    requirement += other_expression*other_bytes
+                else:
+                    requirement += expression*other_bytes
+            requirement = sympy.simplify(requirement)
+            if conditions and conditions[-1][1] == requirement:
+                conditions[-1][2] += 1
+            else:
+                conditions.append([sympy.simplify(expression), requirement, 1])
+
+        for (level, cache_size), evaluated in zip(self._cache_sizes(), self.evaluate()):
+            level_conditions = []
+            for distance, requirement, accesses in conditions:
+                level_conditions.append({
+                    'distance': distance,
+                    'requirement': requirement,
+                    'accesses': accesses,
+                    'fulfilled': bool(self.kernel.subs_consts(requirement) <= cache_size),
+                    'critical sizes': self.critical_sizes(requirement, cache_size)})
+            results['cache'].append({
+                'level': level,
+                'size': cache_size,
+                'conditions': level_conditions,
+                'hits': int(evaluated['hits']),
+                'misses': int(evaluated['misses']),
+                'evicts': int(evaluated['evicts'])})
+
+        return results
+
+    def critical_sizes(self, requirement, cache_size):
+        '''
+        Returns {constant: value} with the largest value of each constant in *requirement*, for
+        which the condition *requirement* <= *cache_size* is still fulfilled (with all other
+        constants as set in kernel). Value is None if the condition can not be fulfilled by any
+        positive value.
+        '''
+        import sympy
+        critical = {}
+        for symbol in sorted(requirement.free_symbols, key=str):
+            expression = requirement.subs(
+                [(s, v) for s, v in self.kernel._constants.items() if s != symbol])
+            roots = [r for r in sympy.solve(sympy.Eq(expression, cache_size), symbol)
+                     if r.is_real and r > 0]
+            if roots:
+                critical[symbol] = int(math.floor(max(roots)))
+            else:
+                critical[symbol] = None
+        return critical
+
+    def analyze(self):
+        self.results = self.calculate_cache_access()
+
+    def report(self, output_file=sys.stdout):
+        for cache in self.results['cache']:
+            print('{} ({} B):'.format(cache['level'], cache['size']), file=output_file)
+            print('  hits: {}, misses: {}, evicts: {}'.format(
+                cache['hits'], cache['misses'], cache['evicts']), file=output_file)
+            for condition in cache['conditions']:
+                print('  {}x {} <= {} B: {}{}'.format(
+                    condition['accesses'], condition['requirement'], cache['size'],
+                    'fulfilled' if condition['fulfilled'] else 'violated',
+                    ''.join([', {} <= {}'.format(s, v)
+                             for s, v in sorted(condition['critical sizes'].items(),
+                                                key=lambda i: str(i[0]))
+                             if v is not None])),
+                    file=output_file)
@@ -5,21 +5,10 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 from __future__ import division
 
-from functools import reduce
-import operator
-import subprocess
-import re
-from copy import deepcopy
 import sys
-from itertools import chain
 
-import sympy
-import six
-from six.moves import filter
-from six.moves import map
-from six.moves import range
-
-from kerncraft.intervals import Intervals
+from kerncraft import bandwidth
+from kerncraft import cacheaccess
 from kerncraft.prefixedunit import PrefixedUnit
 
 
@@ -31,12 +20,16 @@ class Roofline(object):
     """
 
     name = "Roofline"
-    _expand_to_cacheline_blocks_cache = {}
 
     @classmethod
     def configure_arggroup(cls, parser):
         pass
 
+    @classmethod
+    def transition_values(cls, results):
+        '''Returns minimum performance and its bottleneck level.'''
+        return [results['min performance'], results['bottleneck level']]
+
     def __init__(self, kernel, machine, args=None, parser=None):
         """
         *kernel* is a Kernel object
@@ -52,298 +45,44 @@ class Roofline(object):
             # handle CLI info
             pass
 
-    def _calculate_relative_offset(self, name, access_dimensions):
-        '''
-        returns the offset from the iteration center in number of elements and the order of indices
-        used in access.
-        '''
-        offset = 0
-        base_dims = self.kernel._variables[name][1]
-
-        for dim, offset_info in enumerate(access_dimensions):
-            offset_type, idx_name, dim_offset = offset_info
-            assert offset_type == 'rel', 'Only relative access to arrays is supported at the moment'
-
-            if offset_type == 'rel':
-                offset += self.kernel.subs_consts(
-                    dim_offset*reduce(operator.mul, base_dims[dim+1:], sympy.Integer(1)))
-            else:
-                # should not happen
-                pass
-
-        return offset
-
-    def _calculate_iteration_offset(self, name, index_order, loop_index):
-        '''
-        returns the offset from one to the next iteration using *loop_index*.
-        *index_order* is the order used by the access dimensions e.g. 'ijk' corresponse to [i][j][k]
-        *loop_index* specifies the loop to be used for iterations (this is typically the inner
-        moste one)
-        '''
-        offset = 0
-        base_dims = self.kernel._variables[name][1]
-
-        for dim, index_name in enumerate(index_order):
-            if loop_index == index_name:
-                offset += self.kernel.subs_consts(
-                    reduce(operator.mul, base_dims[dim+1:], sympy.Integer(1)))
-
-        return offset
-
-    def _get_index_order(self, access_dimensions):
-        '''Returns the order of indices used in *access_dimensions*.'''
-        return ''.join([d[1] for d in access_dimensions])
-
-    def _expand_to_cacheline_blocks(self, first, last):
-        '''
-        Returns first and last values wich align with cacheline blocks, by increasing range.
-        '''
-        if (first,last) not in self._expand_to_cacheline_blocks_cache:
-            # handle multiple datatypes
-            element_size = self.kernel.datatypes_size[self.kernel.datatype]
-            elements_per_cacheline = int(float(self.machine['cacheline size'])) / element_size
-
-            self._expand_to_cacheline_blocks_cache[(first,last)] = [
-                first - first % elements_per_cacheline,
-                last - last % elements_per_cacheline + elements_per_cacheline - 1]
-
-        return self._expand_to_cacheline_blocks_cache[(first,last)]
-
     def calculate_cache_access(self, CPUL1=True):
         results = {'bottleneck level': 0, 'mem bottlenecks': []}
 
-        read_offsets = {var_name: dict() for var_name in list(self.kernel._variables.keys())}
-        write_offsets = {var_name: dict() for var_name in list(self.kernel._variables.keys())}
-
         # handle multiple datatypes
         element_size = self.kernel.datatypes_size[self.kernel.datatype]
-        elements_per_cacheline = int(float(self.machine['cacheline size'])) / element_size
 
-        loop_order = ''.join([l[0] for l in self.kernel._loop_stack])
-
-        for var_name in list(self.kernel._variables.keys()):
-            var_type, var_dims = self.kernel._variables[var_name]
-
-            # Skip the following access: (they are hopefully kept in registers)
-            #   - scalar values
-            if var_dims is None:
-                continue
-            #   - access does not change with inner-most loop index (they are hopefully kept in 
-            #     registers)
-            writes = [acs for acs in self.kernel._destinations.get(var_name, []) if loop_order[-1] in [a[1] for a in acs]]
-            reads = [acs for acs in self.kernel._sources.get(var_name, []) if loop_order[-1] in [a[1] for a in acs]]
-
-            # Compile access pattern
-            for r in reads:
-                offset = self._calculate_relative_offset(var_name, r)
-                idx_order = self._get_index_order(r)
-                read_offsets[var_name].setdefault(idx_order, [])
-                read_offsets[var_name][idx_order].append(offset)
-            for w in writes:
-                offset = self._calculate_relative_offset(var_name, w)
-                idx_order = self._get_index_order(w)
-                write_offsets[var_name].setdefault(idx_order, [])
-                write_offsets[var_name][idx_order].append(offset)
-
-            # With ECM we would do unrolling, but not with roofline
-
-        # initialize misses and hits
-        misses = {}
-        hits = {}
-        evicts = {}
-        total_misses = {}
-        total_hits = {}
-        total_evicts = {}
-        
-        memory_hierarchy = deepcopy(self.machine['memory hierarchy'])
+        memory_hierarchy = list(self.machine['memory hierarchy'])
         
         # L1-CPU level is special, because everything is a miss here
         if CPUL1:
-            memory_hierarchy.insert(0, {
-                'cores per group': 1,
-                'cycles per cacheline transfer': None,
-                'groups': 16,
-                'level': 'CPU',
-                'bandwidth': None,
-                'size per group': 0,
-                'threads per group': 2,
-            })
+            memory_hierarchy.insert(0, cacheaccess.CPU_LEVEL)
 
         # Check for layer condition towards all cache levels
-        for cache_level, cache_info in list(enumerate(memory_hierarchy))[:-1]:
-            cache_size = int(float(cache_info['size per group']))
-
-            trace_length = 0
-            updated_length = True
-            while updated_length:
-                updated_length = False
-
-                # Initialize cache, misses, hits and evicts for current level
-                cache = {}
-                misses[cache_level] = {}
-                hits[cache_level] = {}
-                evicts[cache_level] = {}
-
-                # We consider everythin a miss in the beginning, unless it is completly cached
-                # TODO here read and writes are treated the same, this implies write-allocate
-                #      to support nontemporal stores, this needs to be changed
-                for name in chain(read_offsets.keys(), write_offsets.keys()):
-                    cache[name] = {}
-                    misses[cache_level][name] = {}
-                    hits[cache_level][name] = {}
-
-                    for idx_order in chain(read_offsets[name].keys(), write_offsets[name].keys()):
-                        cache[name][idx_order] = Intervals()
-                        
-                        # Check for complete caching/in-cache
-                        # TODO change from pessimistic to more realistic approach (different 
-                        #      indexes are treasted as individual arrays)
-                        total_array_size = self.kernel.subs_consts(
-                            element_size*reduce(operator.mul, self.kernel._variables[name][1]))
-                        if total_array_size < trace_length:
-                            # all hits no misses
-                            misses[cache_level][name][idx_order] = []
-                            if cache_level-1 not in misses:
-                                hits[cache_level][name][idx_order] = sorted(
-                                    read_offsets.get(name, {}).get(idx_order, []) +
-                                    write_offsets.get(name, {}).get(idx_order, []),
-                                    reverse=True)
-                            else:
-                                hits[cache_level][name][idx_order] = list(
-                                    misses[cache_level-1][name][idx_order])
-                          
-                        # partial caching (default case) 
-                        else:
-                            if cache_level-1 not in misses:
-                                misses[cache_level][name][idx_order] = sorted(
-                                    read_offsets.get(name, {}).get(idx_order, []) +
-                                    write_offsets.get(name, {}).get(idx_order, []),
-                                    reverse=True)
-                            else:
-                                misses[cache_level][name][idx_order] = list(
-                                    misses[cache_level-1][name][idx_order])
-                            hits[cache_level][name][idx_order] = []
-
-                # Caches are still empty (thus only misses)
-                trace_count = 0
-                cache_used_size = 0
-
-                # Now we trace the cache access backwards (in time/iterations) and check for hits
-                for var_name in list(misses[cache_level].keys()):
-                    for idx_order in list(misses[cache_level][var_name].keys()):
-                        iter_offset = self._calculate_iteration_offset(
-                            var_name, idx_order, loop_order[-1])
-
-                        # Add cache trace
-                        for offset in list(misses[cache_level][var_name][idx_order]):
-                            # If already present in cache add to hits
-                            if offset in cache[var_name][idx_order]:
-                                misses[cache_level][var_name][idx_order].remove(offset)
-
-                                # We might have multiple hits on the same offset (e.g in DAXPY)
-                                if offset not in hits[cache_level][var_name][idx_order]:
-                                    hits[cache_level][var_name][idx_order].append(offset)
-
-                            # Add cache, we can do this since misses are sorted in reverse order of
-                            # access and we assume LRU cache replacement policy
-                            if iter_offset <= elements_per_cacheline:
-                                # iterations overlap, thus we can savely add the whole range
-                                cached_first, cached_last = self._expand_to_cacheline_blocks(
-                                    offset-iter_offset*trace_length, offset+1)
-                                cache[var_name][idx_order] &= Intervals(
-                                    [cached_first, cached_last+1], sane=True)
-                            else:
-                                # There is no overlap, we can append the ranges onto one another
-                                # TODO optimize this code section (and maybe merge with above)
-                                new_cache = [self._expand_to_cacheline_blocks(o, o) for o in range(
-                                    offset-iter_offset*trace_length, offset+1, iter_offset)]
-                                new_cache = Intervals(*new_cache, sane=True)
-                                cache[var_name][idx_order] &= new_cache
-
-                        trace_count += len(cache[var_name][idx_order].data)
-                        cache_used_size += len(cache[var_name][idx_order])*element_size
-                
-                # Calculate new possible trace_length according to free space in cache
-                # TODO take CL blocked access into account
-                # TODO make /2 customizable
-                #new_trace_length = trace_length + \
-                #    ((cache_size/2 - cache_used_size)/trace_count)/element_size
-                if trace_count > 0:  # to catch complete caching
-                    new_trace_length = trace_length + \
-                        ((cache_size - cache_used_size)/trace_count)/element_size
-
-                if new_trace_length > trace_length:
-                    trace_length = new_trace_length
-                    updated_length = True
-
-                # All writes to require the data to be evicted eventually
-                evicts[cache_level] = {
-                    var_name: dict() for var_name in list(self.kernel._variables.keys())}
-                for name in list(write_offsets.keys()):
-                    for idx_order in list(write_offsets[name].keys()):
-                        evicts[cache_level][name][idx_order] = list(write_offsets[name][idx_order])
-            
-            # Compiling stats
-            total_misses[cache_level] = sum([sum(
-                map(len, list(l.values()))) for l in list(misses[cache_level].values())])
-            total_hits[cache_level] = sum([sum(
-                map(len, list(l.values()))) for l in list(hits[cache_level].values())])
-            total_evicts[cache_level] = sum([sum(
-                map(len, list(l.values()))) for l in list(evicts[cache_level].values())])
-
+        # With ECM we would do unrolling and reduce shared caches by cores, but not with roofline
+        levels = cacheaccess.cache_access(
+            self.kernel, self.machine, cores=1, unroll=False, cpu_level=CPUL1,
+            nontemporal_stores=cacheaccess.nontemporal_arrays(
+                self.kernel, self._args.nontemporal_stores))
+        for cache_level, level in enumerate(levels):
             # Calculate performance (arithmetic intensity * bandwidth with
             # arithmetic intensity = flops / bytes transfered)
-            bytes_transfered = (total_misses[cache_level]+total_evicts[cache_level])*element_size
+            bytes_transfered = (level['total misses']+level['total evicts'])*element_size
             total_flops = sum(self.kernel._flops.values())
             arith_intens = float(total_flops)/float(bytes_transfered)
 
-            # choose bw according to cache level and problem
-            # first, compile stream counts at current cache level
-            # write-allocate is allready resolved above
-            read_streams = 0
-            for var_name in list(misses[cache_level].keys()):
-                for idx_order in misses[cache_level][var_name]:
-                    read_streams += len(misses[cache_level][var_name][idx_order])
-            write_streams = 0
-            for var_name in list(evicts[cache_level].keys()):
-                for idx_order in evicts[cache_level][var_name]:
-                    write_streams += len(evicts[cache_level][var_name][idx_order])
-            # second, try to find best fitting kernel (closest to stream seen stream counts):
-            # write allocate has to be handled in kernel information (all writes are also reads)
-            # TODO support for non-write-allocate architectures
-            measurement_kernel = 'load'
-            measurement_kernel_info = self.machine['benchmarks']['kernels'][measurement_kernel]
-            for kernel_name, kernel_info in sorted(self.machine['benchmarks']['kernels'].items()):
-                if (read_streams >= (kernel_info['read streams']['streams'] +
-                                     kernel_info['write streams']['streams'] -
-                                     kernel_info['read+write streams']['streams']) >
-                        measurement_kernel_info['read streams']['streams'] +
-                        measurement_kernel_info['write streams']['streams'] -
-                        measurement_kernel_info['read+write streams']['streams'] and
-                        write_streams >= kernel_info['write streams']['streams'] >
-                        measurement_kernel_info['write streams']['streams']):
-                    measurement_kernel = kernel_name
-                    measurement_kernel_info = kernel_info
+            # blend bw of kernels fitting best to stream counts at current cache level
+            # (write-allocate is allready resolved in simulation)
+            blend = bandwidth.kernel_blend(
+                self.machine, level['total misses'], level['total evicts'],
+                level['write allocate'])
 
             # TODO choose smt and cores:
             threads_per_core, cores = 1, self._args.cores
             bw_level = memory_hierarchy[cache_level+1]['level']
-            bw_measurements = \
-                self.machine['benchmarks']['measurements'][bw_level][threads_per_core]
-            assert threads_per_core == bw_measurements['threads per core'], \
-                'malformed measurement dictionary in machine file.'
-            run_index = bw_measurements['cores'].index(cores)
-            bw = bw_measurements['results'][measurement_kernel][run_index]
-
-            # Correct bandwidth due to miss-measurement of write allocation
-            # TODO support non-temporal stores and non-write-allocate architectures
-            measurement_kernel_info = self.machine['benchmarks']['kernels'][measurement_kernel]
-            factor = (float(measurement_kernel_info['read streams']['bytes']) +
-                      2.0*float(measurement_kernel_info['write streams']['bytes']) -
-                      float(measurement_kernel_info['read+write streams']['bytes'])) / \
-                     (float(measurement_kernel_info['read streams']['bytes']) +
-                      float(measurement_kernel_info['write streams']['bytes']))
-            bw = bw * factor
+            bw = PrefixedUnit(bandwidth.bandwidth(
+                self.machine, bw_level, cores, threads_per_core, level['total misses'],
+                level['total evicts'], level['write allocate'], self._args.numa_placement),
+                'B/s').reduced()
 
             performance = arith_intens * float(bw)
             results['mem bottlenecks'].append({
@@ -351,7 +90,7 @@ class Roofline(object):
                 'level': (memory_hierarchy[cache_level]['level'] + '-' +
                           memory_hierarchy[cache_level+1]['level']),
                 'arithmetic intensity': arith_intens,
-                'bw kernel': measurement_kernel,
+                'bw kernel': '/'.join([kernel_name for kernel_name, weight in blend]),
                 'bandwidth': bw})
             if performance <= results.get('min performance', performance):
                 results['bottleneck level'] = len(results['mem bottlenecks'])-1
@@ -425,6 +164,9 @@ class RooflineIACA(Roofline):
     """
 
     name = "Roofline (with IACA throughput)"
+    # Output of IACA is left out of --json and --csv records
+    raw_results = ['IACA output', 'IACA latency output']
+    tools = ['compiler', 'iaca.sh']
 
     @classmethod
     def configure_arggroup(cls, parser):
@@ -442,68 +184,23 @@ class RooflineIACA(Roofline):
     def analyze(self):
         self.results = self.calculate_cache_access(CPUL1=False)
         
-        # For the IACA/CPU analysis we need to compile and assemble
-        asm_name = self.kernel.compile(
-            self.machine['compiler'], compiler_args=self.machine['compiler flags'])
-        bin_name = self.kernel.assemble(
-           self.machine['compiler'], asm_name, iaca_markers=True, asm_block=self._args.asm_block,
-           asm_increment=self._args.asm_increment)
-
-        # Get total cycles per loop iteration
-        try:
-            cmd = ['iaca.sh', '-64', '-arch', self.machine['micro-architecture'], bin_name]
-            iaca_output = subprocess.check_output(cmd).decode('utf-8')
-        except OSError as e:
-            print("IACA execution failed:", ' '.join(cmd), file=sys.stderr)
-            print(e, file=sys.stderr)
-            sys.exit(1)
-        except subprocess.CalledProcessError as e:
-            print("IACA throughput analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-        
-        match = re.search(
-            r'^Block Throughput: ([0-9\.]+) Cycles', iaca_output, re.MULTILINE)
-        assert match, "Could not find Block Throughput in IACA output."
-        block_throughput = float(match.groups()[0])
-
-        # Find ports and cyles per port
-        ports = [l for l in iaca_output.split('\n') if l.startswith('|  Port  |')]
-        cycles = [l for l in iaca_output.split('\n') if l.startswith('| Cycles |')]
-        assert ports and cycles, "Could not find ports/cylces lines in IACA output."
-        ports = [p.strip() for p in ports[0].split('|')][2:]
-        cycles = [p.strip() for p in cycles[0].split('|')][2:]
-        port_cycles = []
-        for i in range(len(ports)):
-            if '-' in ports[i] and ' ' in cycles[i]:
-                subports = [p.strip() for p in ports[i].split('-')]
-                subcycles = [c for c in cycles[i].split(' ') if bool(c)]
-                port_cycles.append((subports[0], float(subcycles[0])))
-                port_cycles.append((subports[0]+subports[1], float(subcycles[1])))
-            elif ports[i] and cycles[i]:
-                port_cycles.append((ports[i], float(cycles[i])))
-        port_cycles = dict(port_cycles)
-
-        match = re.search(r'^Total Num Of Uops: ([0-9]+)', iaca_output, re.MULTILINE)
-        assert match, "Could not find Uops in IACA output."
-        uops = float(match.groups()[0])
-        
-        # Get latency prediction from IACA
-        try:
-            iaca_latency_output = subprocess.check_output(
-                ['iaca.sh', '-64', '-analysis', 'LATENCY', '-arch',
-                 self.machine['micro-architecture'], bin_name]).decode('utf-8')
-        except subprocess.CalledProcessError as e:
-            print("IACA latency analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-        
-        # Get predicted latency
-        match = re.search(
-            r'^Latency: ([0-9\.]+) Cycles', iaca_latency_output, re.MULTILINE)
-        assert match, "Could not find Latency in IACA latency analysis output."
-        block_latency = float(match.groups()[0])
+        # For the IACA/CPU analysis we need to compile and assemble (only done once per kernel
+        # and configuration, since generated code does not depend on the values of constants)
+        iaca_analysis = self.kernel.iaca_analysis(
+            micro_architecture=self.machine['micro-architecture'],
+            compiler=self.machine['compiler'],
+            compiler_args=self.machine['compiler flags'],
+            asm_block=self._args.asm_block,
+            asm_increment=self._args.asm_increment)
+        block_throughput = iaca_analysis['throughput']
+        port_cycles = iaca_analysis['port cycles']
+        uops = iaca_analysis['uops']
+        block_latency = iaca_analysis['latency']
+        iaca_output = iaca_analysis['IACA output']
+        iaca_latency_output = iaca_analysis['IACA latency output']
 
         # Normalize to cycles per cacheline
-        elements_per_block = abs(self.kernel.asm_block['pointer_increment']
+        elements_per_block = abs(iaca_analysis['pointer increment']
                                  / self.kernel.datatypes_size[self.kernel.datatype])
         block_size = elements_per_block*self.kernel.datatypes_size[self.kernel.datatype]
         try:
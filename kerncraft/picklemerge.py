@@ -1,55 +1,174 @@
 #!/usr/bin/env python
+'''
+Merges result stores (see resultstore module) and pickle files of older kerncraft versions.
 
+Results are streamed kernel by kernel, so memory use is bounded by the largest kernel entry (pickle
+files can only be read as a whole though). Results which differ from those already in the
+destination are reported as conflicts and only replace them with --overwrite.
+'''
 from __future__ import print_function
+from __future__ import unicode_literals
 from __future__ import absolute_import
 
 import argparse
+import os
 import os.path
 import pickle
-import collections
+import sys
+from collections import OrderedDict
+import multiprocessing
+
 import six
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from .resultstore import ResultStore, is_result_store
+
+
+def destination_path(destination, kernel, split=False):
+    '''Returns path of store for *kernel*, which is *destination* or a file in it if *split*.'''
+    if split:
+        return os.path.join(destination, kernel + '.db')
+    return destination
+
+
+def merge_rows(store, rows, overwrite=False):
+    '''
+    Adds *rows* (iterable of (kernel, define, model, results)) to *store*, unless the same results
+    are already stored. Returns (number of added rows, list of conflicts), with conflicts being
+    (kernel, define, model) which were stored with different results (and replaced if
+    *overwrite*).
+    '''
+    added = [0]
+    conflicts = []
+
+    def new_rows():
+        for kernel, define, model, results in rows:
+            stored_results = store.get(kernel, define, model)
+            if stored_results is not None:
+                if stored_results == results:
+                    continue
+                conflicts.append((kernel, define, model))
+                if not overwrite:
+                    continue
+            added[0] += 1
+            yield kernel, define, model, results
+
+    store.append_rows(new_rows())
+    return added[0], conflicts
+
 
+def merge_kernel(destination, source, kernel, split=False, overwrite=False):
+    '''
+    Merges results of *kernel* from *source* store into *destination* (see destination_path()).
+    Returns (kernel, number of added rows, list of conflicts).
+    '''
+    with ResultStore(source) as source_store, \
+            ResultStore(destination_path(destination, kernel, split)) as store:
+        added, conflicts = merge_rows(store, source_store.query(kernel=kernel), overwrite)
+    return (kernel, added, conflicts)
+
+
+def _merge_kernel_worker(task):
+    return merge_kernel(*task)
+
+
+def iter_pickle_rows(path):
+    '''Yields (kernel, define, model, results) of all results in pickle file at *path*.'''
+    with open(path, 'rb') as f:
+        data = pickle.load(f)
+    assert isinstance(data, Mapping), "only Mapping types can be handled."
+    for kernel in sorted(data):
+        for constants, models in data[kernel].items():
+            define = [(six.text_type(name), value) for name, value in constants]
+            for model, results in models.items():
+                yield kernel, define, model, results
 
-def update(d, u):
+
+def iter_merges(destination, source, split=False, overwrite=False, jobs=1):
     '''
-    Updated dictionary recursivly
-    Origin:
-    http://stackoverflow.com/a/3233356/2754040
+    Yields (kernel, number of added rows, list of conflicts) while merging *source* (result
+    store or pickle file) into *destination*. Kernels of a result store are merged by *jobs*
+    processes in parallel.
     '''
-    for k, v in six.iteritems(u):
-        if isinstance(v, collections.Mapping):
-            r = update(d.get(k, {}), v)
-            d[k] = r
-        else:
-            d[k] = u[k]
-    return d
+    if not is_result_store(source):
+        # Pickles can only be loaded as a whole, kernels are merged one after another
+        kernel_rows = OrderedDict()
+        for row in iter_pickle_rows(source):
+            kernel_rows.setdefault(row[0], []).append(row)
+        for kernel, rows in kernel_rows.items():
+            with ResultStore(destination_path(destination, kernel, split)) as store:
+                yield (kernel,) + merge_rows(store, rows, overwrite)
+        return
+
+    with ResultStore(source) as source_store:
+        kernels = source_store.kernels()
+    tasks = [(destination, source, kernel, split, overwrite) for kernel in kernels]
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield merge_kernel(*task)
+        return
+
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    try:
+        for merged in pool.imap(_merge_kernel_worker, tasks):
+            yield merged
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description='Recursively merges two or more pickle files. Only supports pickles consisting '
-        'of a single dictionary object.')
-    parser.add_argument('destination', type=argparse.FileType('r+'),
-                        help='File to write to and include in resulting pickle. (WILL BE CHANGED)')
-    parser.add_argument('source', type=argparse.FileType('r'), nargs='+',
-                        help='File to include in resulting pickle.')
+        description='Merges results of two or more result stores or pickle files into a result '
+        'store. Results which were already stored differently are reported as conflicts.')
+    parser.add_argument('destination',
+                        help='Result store to write to and include in result. (WILL BE CHANGED)')
+    parser.add_argument('source', nargs='+',
+                        help='Result store or pickle file to include in result.')
+    parser.add_argument('--split', action='store_true',
+                        help='Write one result store per kernel (named KERNEL.db) into '
+                             'destination directory.')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Replace conflicting results by those of later sources.')
+    parser.add_argument('--jobs', '-j', metavar='JOBS', type=int, default=1,
+                        help='Number of processes merging kernels in parallel. (default: 1)')
 
     args = parser.parse_args()
 
-    result = pickle.load(args.destination)
-    assert isinstance(result, collections.Mapping), "only Mapping types can be handled."
-    
-    for s in args.source:
-        data = pickle.load(s)
-        assert isinstance(data, collections.Mapping), "only Mapping types can be handled."
-        
-        
-        update(result, data)
-    
-    args.destination.seek(0)
-    args.destination.truncate()
-    pickle.dump(result, args.destination)
+    if args.split:
+        if not os.path.isdir(args.destination):
+            os.makedirs(args.destination)
+    elif not is_result_store(args.destination):
+        parser.error('destination {} is not a result store'.format(args.destination))
+    for source in args.source:
+        if not os.path.isfile(source):
+            parser.error('source {} does not exist'.format(source))
+        if not args.split and os.path.abspath(source) == os.path.abspath(args.destination):
+            parser.error('source {} is also the destination'.format(source))
+
+    total_conflicts = 0
+    for source in args.source:
+        for kernel, added, conflicts in iter_merges(
+                args.destination, source, args.split, args.overwrite, args.jobs):
+            print('{}: {}: {} results added, {} conflicts'.format(
+                source, kernel, added, len(conflicts)))
+            for kernel_name, define, model in conflicts:
+                print('  conflict: {} {} {} ({})'.format(
+                    kernel_name, ' '.join(['-D {} {}'.format(n, v) for n, v in define]), model,
+                    'overwritten' if args.overwrite else 'kept'), file=sys.stderr)
+            total_conflicts += len(conflicts)
+
+    if total_conflicts and not args.overwrite:
+        print('{} conflicting results were not merged (use --overwrite to replace them).'.format(
+            total_conflicts), file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
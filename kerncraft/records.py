@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+'''
+Machine-readable result records (used by --json and --csv).
+
+Results of models are normalized to plain JSON types: quantities with units (PrefixedUnit) are
+resolved to their base value, with the unit appended to their key (e.g., "bandwidth [B/s]"),
+numbers of sympy and NumPy to int or float and symbolic expressions (as well as infinite
+values) to strings. Raw output of external tools (see raw_results of models) is left out.
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import csv
+import json
+import math
+import numbers
+from collections import OrderedDict
+
+import six
+
+from .prefixedunit import PrefixedUnit
+
+# Formats of records
+FORMATS = ['json', 'csv']
+
+# Columns of CSV records
+CSV_COLUMNS = ['kernel', 'machine', 'define', 'model', 'result', 'value']
+
+
+def normalize(value, omit=()):
+    '''Returns *value* converted to JSON types, leaving out entries of dictionaries keyed *omit*.'''
+    if isinstance(value, dict):
+        normalized = OrderedDict()
+        for key in sorted(value, key=six.text_type):
+            if key in omit:
+                continue
+            item = value[key]
+            key = six.text_type(key)
+            if isinstance(item, PrefixedUnit):
+                if item.unit:
+                    key = '{} [{}]'.format(key, item.unit)
+                item = item.base_value()
+            normalized[key] = normalize(item, omit)
+        return normalized
+    elif isinstance(value, (list, tuple)):
+        return [normalize(v, omit) for v in value]
+    elif isinstance(value, PrefixedUnit):
+        return float(value.base_value())
+    elif value is None or isinstance(value, (bool, six.string_types)):
+        return value
+    elif isinstance(value, numbers.Integral):
+        return int(value)
+    elif isinstance(value, numbers.Real):
+        if math.isinf(value) or math.isnan(value):
+            # not representable in JSON
+            return six.text_type(float(value))
+        return float(value)
+    return six.text_type(value)
+
+
+def result_record(code_name, machine_path, define, model_name, results, omit=()):
+    '''Returns record (OrderedDict) of *results* of *model_name* for a kernel with *define*.'''
+    return OrderedDict([
+        ('kernel', code_name),
+        ('machine', machine_path),
+        ('define', OrderedDict([(six.text_type(k), v) for k, v in define])),
+        ('model', model_name),
+        ('results', normalize(results, omit))])
+
+
+def flatten(value, name=''):
+    '''Yields (name, value) of all values in normalized *value*, with names joined by dots.'''
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        yield name, value
+        return
+    for key, item in items:
+        for flat in flatten(item, '{}.{}'.format(name, key) if name else six.text_type(key)):
+            yield flat
+
+
+class RecordWriter(object):
+    '''Writes records to *output_file* in *output_format* (see FORMATS), as soon as they arrive.'''
+
+    def __init__(self, output_file, output_format='json'):
+        assert output_format in FORMATS, "Unknown format {}, must be one of {}.".format(
+            output_format, ', '.join(FORMATS))
+        self.output_file = output_file
+        self.output_format = output_format
+        self._csv_writer = None
+
+    def write(self, record):
+        if self.output_format == 'json':
+            print(json.dumps(record), file=self.output_file)
+        else:
+            # CSV is written in long format, one row per result value, since results of models
+            # and kernels have different fields
+            if self._csv_writer is None:
+                self._csv_writer = csv.writer(self.output_file, lineterminator='\n')
+                self._csv_writer.writerow(CSV_COLUMNS)
+            define = ' '.join(['{}={}'.format(k, v) for k, v in record['define'].items()])
+            for name, value in flatten(record['results']):
+                self._csv_writer.writerow(
+                    [record['kernel'], record['machine'], define, record['model'], name, value])
+        self.output_file.flush()
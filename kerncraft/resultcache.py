@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+'''
+Persistent on-disk cache of model analyses.
+
+Entries are content-addressed by a hash of everything an analysis depends on (cleaned kernel
+code, parsed machine description, defines, model name, options and kerncraft's own code) and
+evicted in least-recently-used order once the cache exceeds its size limit.
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import os.path
+import sys
+import hashlib
+import json
+import pickle
+import tempfile
+
+import yaml
+
+# Bump if layout of cache entries changes
+CACHE_FORMAT = 1
+
+# Default size limit of the cache in bytes
+DEFAULT_MAX_SIZE = 256*1024**2
+
+_code_fingerprint = None
+
+
+def default_cache_dir():
+    '''Returns default cache directory ($XDG_CACHE_HOME/kerncraft or ~/.cache/kerncraft).'''
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'kerncraft')
+
+
+def code_fingerprint():
+    '''
+    Returns hash of kerncraft's own code and headers, so that results of a changed kerncraft are
+    never taken from the cache.
+    '''
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        h = hashlib.sha256()
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for dirpath, dirnames, filenames in os.walk(package_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                # Skip generated parser tables
+                if not filename.endswith(('.py', '.c', '.h')) or \
+                        filename in ['lextab.py', 'yacctab.py']:
+                    continue
+                path = os.path.join(dirpath, filename)
+                h.update(os.path.relpath(path, package_dir).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+        _code_fingerprint = h.hexdigest()
+    return _code_fingerprint
+
+
+class ResultCache(object):
+    '''On-disk cache of arbitrary picklable values, bounded to *max_size* bytes.'''
+
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+        # Total size of all entries, determined on first store
+        self._size = None
+        # Set once the cache directory turned out not to be writable
+        self.disabled = False
+
+    def _disable(self, error):
+        '''Warns (once) about *error* and continues without storing analyses.'''
+        if not self.disabled:
+            print('Warning: result cache in {} is not used: {}'.format(self.path, error),
+                  file=sys.stderr)
+        self.disabled = True
+
+    def prepare(self):
+        '''
+        Creates cache directory if required. Returns False (after a warning) if it can not be
+        used, so that analyses continue without cache.
+        '''
+        try:
+            os.makedirs(self.path)
+        except (IOError, OSError) as e:
+            if not os.path.isdir(self.path):
+                self._disable(e)
+                return False
+        return True
+
+    def key(self, kernel_code, machine, define, model_name, options=None):
+        '''
+        Returns key for analysis of *kernel_code* on *machine* (MachineModel) with *define*
+        (list of (name, value)) and *model_name*. *options* is a dictionary of all further
+        arguments the analysis or its report depends on.
+        '''
+        description = json.dumps({
+            'format': CACHE_FORMAT,
+            'code fingerprint': code_fingerprint(),
+            'kernel code': kernel_code,
+            'machine': yaml.dump(machine._data, default_flow_style=False),
+            'define': sorted([[str(k), v] for k, v in define]),
+            'model': model_name,
+            'options': options or {}}, sort_keys=True)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key + '.pickle')
+
+    def get(self, key):
+        '''Returns value stored under *key* or None, if it is not cached.'''
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            # Mark as recently used
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            # Truncated or otherwise broken entry
+            self._remove(path)
+            return None
+        return value
+
+    def put(self, key, value):
+        '''
+        Stores *value* under *key* and evicts least recently used entries if required.
+
+        If the cache can not be written (e.g., read-only or missing home directory), a warning is
+        printed once and nothing is stored, the same way get() degrades to a miss.
+        '''
+        if self.disabled:
+            return
+        path = self._entry_path(key)
+        try:
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(path)):
+                    raise
+
+            # Write to temporary file and rename, so that concurrent readers (e.g. from --jobs)
+            # never see partial entries
+            fd, tempname = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=2)
+            os.rename(tempname, path)
+
+            if self._size is None:
+                self._size = sum([size for p, size, mtime in self._entries()])
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_size:
+                self.evict()
+        except (IOError, OSError) as e:
+            self._disable(e)
+
+    def evict(self, max_size=None):
+        '''Removes least recently used entries until cache is not larger than *max_size*.'''
+        if max_size is None:
+            max_size = self.max_size
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self._size = sum([size for path, size, mtime in entries])
+        for path, size, mtime in entries:
+            if self._size <= max_size:
+                break
+            self._remove(path)
+            self._size -= size
+
+    def _entries(self):
+        '''Returns list of (path, size, mtime) of all entries.'''
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for filename in filenames:
+                if not filename.endswith('.pickle'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Removed concurrently
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
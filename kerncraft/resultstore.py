@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+'''
+Append-only store of analysis results in an SQLite database (used by --store).
+
+Every analyzed define adds rows to the database, instead of rewriting all results, and
+concurrent kerncraft runs may append to the same store. Results are keyed by kernel, define and
+model; if a key was stored more than once, the latest results are returned.
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import pickle
+import sqlite3
+
+import six
+
+# First bytes of every SQLite database file
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+# Seconds to wait for concurrent writers to release their lock
+LOCK_TIMEOUT = 600
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    kernel TEXT NOT NULL,
+    define TEXT NOT NULL,
+    model TEXT NOT NULL,
+    results BLOB NOT NULL,
+    given_define TEXT);
+CREATE INDEX IF NOT EXISTS results_key ON results (kernel, model, define);
+CREATE TABLE IF NOT EXISTS constants (
+    result INTEGER NOT NULL REFERENCES results (id),
+    name TEXT NOT NULL,
+    value NOT NULL);
+CREATE INDEX IF NOT EXISTS constants_value ON constants (name, value);
+'''
+
+
+def is_result_store(path):
+    '''Returns True if *path* is a result store database or an empty or not yet existing file.'''
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(len(SQLITE_HEADER))
+    except IOError:
+        return True
+    return not header or header == SQLITE_HEADER
+
+
+# Version of the database layout (SQLite user_version), see ResultStore._upgrade()
+STORE_VERSION = 1
+
+
+def _define_text(define):
+    '''
+    Returns key of *define* (list of (name, value)) in database, independent of the order of
+    constants (i.e., sorted by name, as in ResultCache.key()). Defines are returned in the order
+    they were given (given_define).
+    '''
+    return json.dumps(sorted([[six.text_type(name), value] for name, value in define]))
+
+
+class ResultStore(object):
+    '''Results of analyses, stored in the SQLite database at *path*.'''
+
+    def __init__(self, path):
+        assert is_result_store(path), \
+            "{} is not a result store (pickle files are no longer supported).".format(path)
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        with self._connection:
+            self._connection.executescript(SCHEMA)
+        self._upgrade()
+
+    def _upgrade(self):
+        '''Upgrades stores written by earlier versions.'''
+        version, = self._connection.execute('PRAGMA user_version').fetchone()
+        if version >= STORE_VERSION:
+            return
+        with self._connection:
+            # Defines were stored (only) in order of the command line
+            columns = [column[1] for column in
+                       self._connection.execute('PRAGMA table_info(results)')]
+            if 'given_define' not in columns:
+                self._connection.execute('ALTER TABLE results ADD COLUMN given_define TEXT')
+            rows = self._connection.execute(
+                'SELECT id, define FROM results WHERE given_define IS NULL').fetchall()
+            self._connection.executemany(
+                'UPDATE results SET define = ?, given_define = ? WHERE id = ?',
+                [(_define_text(json.loads(define_text)), define_text, row_id)
+                 for row_id, define_text in rows])
+            self._connection.execute('PRAGMA user_version = {}'.format(STORE_VERSION))
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, kernel, define, analyses):
+        '''
+        Adds *analyses* (list of (model name, results)) of *kernel* (name) with *define* (list of
+        (name, value)) in a single transaction.
+        '''
+        self.append_rows([(kernel, define, model, results) for model, results in analyses])
+
+    def append_rows(self, rows):
+        '''Adds *rows* (iterable of (kernel, define, model, results)) in a single transaction.'''
+        with self._connection:
+            for kernel, define, model, results in rows:
+                cursor = self._connection.execute(
+                    'INSERT INTO results (kernel, define, model, results, given_define) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (kernel, _define_text(define), model,
+                     sqlite3.Binary(pickle.dumps(results, protocol=2)),
+                     json.dumps([[six.text_type(name), value] for name, value in define])))
+                self._connection.executemany(
+                    'INSERT INTO constants (result, name, value) VALUES (?, ?, ?)',
+                    [(cursor.lastrowid, six.text_type(name), value) for name, value in define])
+
+    def query(self, kernel=None, model=None, constants=None):
+        '''
+        Yields (kernel, define, model, results) of latest results, optionally only of *kernel*,
+        *model* and with *constants* (dictionary of name to value or to (minimum, maximum)).
+        Results are ordered by kernel, model and time of storage.
+        '''
+        conditions = []
+        parameters = []
+        if kernel is not None:
+            conditions.append('kernel = ?')
+            parameters.append(kernel)
+        if model is not None:
+            conditions.append('model = ?')
+            parameters.append(model)
+        for name, value in sorted((constants or {}).items()):
+            if isinstance(value, (tuple, list)):
+                conditions.append(
+                    'id IN (SELECT result FROM constants WHERE name = ? AND value BETWEEN ? AND ?)')
+                parameters += [six.text_type(name), value[0], value[1]]
+            else:
+                conditions.append(
+                    'id IN (SELECT result FROM constants WHERE name = ? AND value = ?)')
+                parameters += [six.text_type(name), value]
+
+        # All rows of a key match the same conditions, so the latest matching row is the latest
+        latest = 'SELECT MAX(id) FROM results'
+        if conditions:
+            latest += ' WHERE ' + ' AND '.join(conditions)
+        latest += ' GROUP BY kernel, model, define'
+        cursor = self._connection.execute(
+            'SELECT kernel, COALESCE(given_define, define), model, results FROM results '
+            'WHERE id IN ({}) '
+            'ORDER BY kernel, model, id'.format(latest), parameters)
+        for kernel_name, define_text, model_name, results in cursor:
+            yield (kernel_name, [tuple(d) for d in json.loads(define_text)], model_name,
+                   pickle.loads(bytes(results)))
+
+    def get(self, kernel, define, model):
+        '''Returns latest results of *model* for *kernel* with *define* or None, if not stored.'''
+        row = self._connection.execute(
+            'SELECT results FROM results WHERE kernel = ? AND model = ? AND define = ? '
+            'ORDER BY id DESC LIMIT 1', (kernel, model, _define_text(define))).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(bytes(row[0]))
+
+    def stored_models(self, kernel, define):
+        '''Returns set of names of all models with results of *kernel* with *define*.'''
+        cursor = self._connection.execute(
+            'SELECT DISTINCT model FROM results WHERE kernel = ? AND define = ?',
+            (kernel, _define_text(define)))
+        return set([model for model, in cursor])
+
+    def kernels(self):
+        '''Returns sorted list of names of all kernels with results.'''
+        return [kernel for kernel, in self._connection.execute(
+            'SELECT DISTINCT kernel FROM results ORDER BY kernel')]
+
+    def load(self, kernel=None):
+        '''
+        Returns all results (or only those of *kernel*) as nested dictionaries of kernel, define
+        and model, with defines being tuples of (sympy symbol, value) like Kernel.constants.
+        '''
+        import sympy
+
+        results = {}
+        for kernel_name, define, model, model_results in self.query(kernel=kernel):
+            constants = tuple([(sympy.Symbol(name), value) for name, value in define])
+            results.setdefault(kernel_name, {}).setdefault(constants, {})[model] = model_results
+        return results
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+'''
+Automatic selection of defines (problem sizes), used if none were given on the command line.
+
+Sizes are placed per level of the memory hierarchy, so sample points concentrate in the ranges
+between cache sizes, where performance changes, instead of spreading over all sizes evenly.
+
+Sweeps may also be refined adaptively: intervals between neighbouring defines with changing
+results are bisected, until the transitions are found with the requested resolution.
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import numpy
+import six
+import sympy
+
+from kerncraft.prefixedunit import PrefixedUnit
+
+# Modes of automatic define selection:
+#  - inner: inner-most dimension is swept, others are chosen to make the data set MAX_SIZE large
+#  - total: all constants are swept together (with equal values), the data set grows with them
+MODES = ['inner', 'total']
+
+# Smallest problem size, in number of elements along the swept dimension
+MIN_ELEMENTS = 100
+
+
+def kernel_constants(kernel):
+    '''Returns sorted list of all constants (sympy symbols) in array sizes and loop bounds.'''
+    symbols = set()
+    for var_type, var_dims in kernel._variables.values():
+        if var_dims is not None:
+            for dim in var_dims:
+                symbols |= sympy.sympify(dim).free_symbols
+    for index, start, end, step in kernel._loop_stack:
+        symbols |= sympy.sympify(start).free_symbols | sympy.sympify(end).free_symbols
+    symbols -= set([sympy.Symbol(l[0]) for l in kernel._loop_stack])
+    return sorted(symbols, key=str)
+
+
+def level_ranges(machine, min_size, max_size, levels=None):
+    '''
+    Returns list of (level, lower bound, upper bound) in bytes for all levels of the memory
+    hierarchy of *machine*, or only those named in *levels*. Main memory is bound by *max_size*.
+    '''
+    known_levels = [l['level'] for l in machine['memory hierarchy']]
+    assert levels is None or all([l in known_levels for l in levels]), \
+        "Unknown level in {}, machine file only has {}.".format(
+            ', '.join(levels), ', '.join(known_levels))
+
+    ranges = []
+    lower = min_size
+    for cache_info in machine['memory hierarchy']:
+        if cache_info['size per group'] is None:
+            upper = max_size
+        else:
+            upper = min(int(float(cache_info['size per group'])), max_size)
+        if upper > lower and (levels is None or cache_info['level'] in levels):
+            ranges.append((cache_info['level'], lower, upper))
+        lower = max(lower, upper)
+    return ranges
+
+
+def smallest_integers(function, targets, minimum=1):
+    '''
+    Returns NumPy array of the smallest integers x >= *minimum* with function(x) >= target, for
+    every element in *targets*.
+
+    *function* needs to be monotonically increasing and to take and return NumPy arrays (of the
+    shape of *targets*). All targets are searched at once, by doubling and then bisection.
+    '''
+    targets = numpy.asarray(targets, dtype=float)
+
+    def evaluate(x):
+        return numpy.broadcast_to(function(x), targets.shape)
+
+    upper = numpy.full(targets.shape, max(minimum, 1), dtype=numpy.int64)
+    while True:
+        below = evaluate(upper) < targets
+        if not below.any():
+            break
+        assert upper.max() < 2**60, "Target sizes can not be reached."
+        upper[below] *= 2
+
+    # function(lower) < target <= function(upper)
+    lower = numpy.full(targets.shape, minimum - 1, dtype=numpy.int64)
+    while True:
+        active = upper - lower > 1
+        if not active.any():
+            break
+        middle = (lower + upper)//2
+        reached = evaluate(middle) >= targets
+        upper = numpy.where(active & reached, middle, upper)
+        lower = numpy.where(active & ~reached, middle, lower)
+    return upper
+
+
+def auto_define_product(kernel, machine, points=20, levels=None, mode='inner', max_size=1024**3):
+    '''
+    Returns list of defines (list of (constant, value)) to analyze *kernel* on *machine* with.
+
+    *points* sizes are placed (evenly on a log scale) within the range of each level of the
+    memory hierarchy, or only of those named in *levels*. See MODES for *mode*. *max_size* is the
+    data set size in bytes in inner mode and the largest size in total mode.
+    '''
+    assert mode in MODES, "Unknown mode {}, must be one of {}.".format(mode, ', '.join(MODES))
+    constants = kernel_constants(kernel)
+    assert constants, "Automatic selection of defines requires constants in the kernel."
+
+    inner_constants = [c for c in constants
+                       if c in sympy.sympify(kernel._loop_stack[-1][2]).free_symbols]
+    if not inner_constants:
+        # Inner-most loop has a fixed length, thus all constants are swept together
+        mode = 'total'
+    if mode == 'total':
+        inner_constants = constants
+    outer_constants = [c for c in constants if c not in inner_constants]
+
+    def sizes(inner, outer):
+        '''Returns array sizes with *inner* and *outer* values for inner and outer constants.'''
+        values = dict([(c, inner) for c in inner_constants] + [(c, outer) for c in outer_constants])
+        return numpy.broadcast_arrays(*list(kernel.array_sizes(values).values()))
+
+    element_size = kernel.datatypes_size[kernel.datatype]
+    if mode == 'inner':
+        # Swept size is the largest array with all outer dimensions of length one. The inner
+        # dimension is limited to half of the data set, to leave room for the outer dimensions.
+        swept_size = lambda inner: numpy.max(sizes(inner, 1), axis=0)
+        size_limit = max_size//2
+    else:
+        swept_size = lambda inner: numpy.sum(sizes(inner, inner), axis=0)
+        size_limit = max_size
+
+    targets = []
+    for level, lower, upper in level_ranges(
+            machine, MIN_ELEMENTS*element_size, size_limit, levels):
+        targets += list(numpy.geomspace(lower, upper, points+1)[1:])
+    if not targets:
+        return []
+    inner_values = smallest_integers(swept_size, targets)
+
+    if outer_constants:
+        # we choose all other constants, such that the largest array has at least max_size bytes
+        # with at least 3 iterations
+        outer_values = smallest_integers(
+            lambda outer: numpy.max(sizes(inner_values, outer), axis=0),
+            numpy.full(inner_values.shape, max_size), minimum=3)
+    else:
+        outer_values = inner_values
+
+    define_product = []
+    for inner, outer in zip(inner_values, outer_values):
+        define = ([(c, int(inner)) for c in inner_constants] +
+                  [(c, int(outer)) for c in outer_constants])
+        if define not in define_product:
+            define_product.append(define)
+    return define_product
+
+
+def result_values(results):
+    '''Returns list of all numbers found in (arbitrarily nested) *results*, in a stable order.'''
+    if isinstance(results, dict):
+        return [v for k in sorted(results, key=six.text_type) for v in result_values(results[k])]
+    elif isinstance(results, (list, tuple)):
+        return [v for r in results for v in result_values(r)]
+    elif isinstance(results, PrefixedUnit):
+        return [float(results.base_value())]
+    elif isinstance(results, six.string_types):
+        return []
+    try:
+        return [float(results)]
+    except (TypeError, ValueError):
+        # e.g., symbolic expressions
+        return []
+
+
+def results_changed(results, other_results, threshold):
+    '''
+    Returns True if any number in *results* differs from *other_results* by more than *threshold*
+    (relative to the larger absolute value) or if their structure differs.
+    '''
+    values = result_values(results)
+    other_values = result_values(other_results)
+    if len(values) != len(other_values):
+        return True
+    return any([abs(a - b) > threshold*max(abs(a), abs(b))
+                for a, b in zip(values, other_values)])
+
+
+def refine_defines(analyzed, threshold=0.05, resolution=1):
+    '''
+    Returns list of defines to bisect intervals with changing results in a sweep.
+
+    *analyzed* is a list of (define, results) tuples of one kernel, with results being compared
+    by results_changed(). Neighbours are defines which only differ in the value of a single
+    constant. Between neighbours whose results changed and whose values are more than
+    *resolution* apart, the middle is returned.
+    '''
+    defines = dict([(tuple((sympy.Symbol(six.text_type(c)), v) for c, v in define), (define, r))
+                    for define, r in analyzed])
+
+    # Group defines along each constant, by the values of all other constants
+    lines = {}
+    for key, (define, results) in defines.items():
+        for i in range(len(key)):
+            lines.setdefault((i, key[:i] + key[i+1:]), []).append((key[i][1], define, results))
+
+    refined = []
+    for (i, others), line in sorted(lines.items(), key=lambda l: six.text_type(l[0])):
+        line.sort(key=lambda l: l[0])
+        for (value, define, results), (next_value, next_define, next_results) in zip(
+                line, line[1:]):
+            if next_value - value <= resolution or \
+                    not results_changed(results, next_results, threshold):
+                continue
+            middle = list(define)
+            middle[i] = (define[i][0], (value + next_value)//2)
+            if middle not in refined:
+                refined.append(middle)
+    return refined
@@ -1,10 +1,23 @@
 from __future__ import absolute_import
 from setuptools import setup, find_packages  # Always prefer setuptools over distutils
+from setuptools.command.build_py import build_py as _build_py
 from codecs import open  # To use a consistent encoding
 from os import path
+import subprocess
+import sys
 
 here = path.abspath(path.dirname(__file__))
 
+
+class build_py(_build_py):
+    '''Generates pycparser's lexer and parser tables, so they are not built at runtime.'''
+    def run(self):
+        _build_py.run(self)
+        if not self.dry_run:
+            subprocess.check_call([sys.executable, '_build_tables.py'],
+                                  cwd=path.join(self.build_lib, 'kerncraft', 'pycparser'))
+
+
 # Get the long description from the relevant file
 with open(path.join(here, 'README.rst'), encoding='utf-8') as f:
     long_description = f.read()
@@ -71,6 +84,7 @@ setup(
         'PyYAML',
         'six',
         'sympy',
+        'numpy',
     ],
 
     # List additional groups of dependencies here (e.g. development dependencies).
@@ -85,7 +99,8 @@ setup(
     # installed, specify them here.  If using Python 2.6 or less, then these
     # have to be included in MANIFEST.in as well.
     package_data={
-        'kerncraft': ['headers/dummy.c', 'headers/kerncraft.h', 'README.rst', 'LICENSE'],
+        'kerncraft': ['headers/dummy.c', 'headers/kerncraft.h', 'pycparser/_c_ast.cfg',
+                      'README.rst', 'LICENSE'],
         'examples': [
             'machine-files/*.yaml',
             'kernels/*.c',
@@ -94,6 +109,8 @@ setup(
     },
     include_package_data=True,
 
+    cmdclass={'build_py': build_py},
+
     # Although 'package_data' is the preferred approach, in some case you may
     # need to place data files outside of your packages.
     # see http://docs.python.org/3.4/distutils/setupscript.html#installing-additional-files
@@ -10,6 +10,12 @@ suite = unittest.TestLoader().loadTestsFromNames(
     [
         'test_kerncraft',
         'test_intervals',
+        'test_kernel',
+        'test_picklemerge',
+        'test_records',
+        'test_resultcache',
+        'test_resultstore',
+        'test_sweep',
     ]
 )
 
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+'''
+Intervals benchmark: timings of typical operations on Intervals, as used in cache trace simulation.
+
+Usage: python tests/benchmark_intervals.py [REPETITIONS]
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from kerncraft.intervals import Intervals
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    ranges = [[o*8, o*8+4] for o in range(0, 10000, 3)]
+    full = Intervals(*ranges)
+
+    def add_overlapping():
+        i = Intervals()
+        for l, u in ranges:
+            i.add(l-100, u)
+
+    def add_disjoint():
+        i = Intervals()
+        for l, u in ranges:
+            i.add(l, u)
+
+    def update():
+        Intervals().update(ranges)
+
+    def combine():
+        i = Intervals()
+        for l, u in ranges:
+            i &= Intervals([l, u])
+
+    def contains():
+        for o in range(0, 80000, 7):
+            o in full
+
+    for name, function in [('add (overlapping)', add_overlapping),
+                           ('add (disjoint)', add_disjoint),
+                           ('update', update),
+                           ('&= (single ranges)', combine),
+                           ('contains', contains)]:
+        times = timeit.repeat(function, repeat=repetitions, number=1)
+        print('{:<20} min {:8.3f} ms'.format(name, min(times)*1000))
+
+
+if __name__ == '__main__':
+    main()
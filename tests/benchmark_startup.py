@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+'''
+Startup benchmark: wall time of importing kerncraft, of ``kerncraft --help`` and of a single
+kernel analysis.
+
+Usage: python tests/benchmark_startup.py [REPETITIONS]
+
+For a per module breakdown use: python -X importtime -m kerncraft.kerncraft --help
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+test_files = os.path.join(root_dir, 'tests', 'test_files')
+
+# (name, arguments to python interpreter)
+benchmarks = [
+    ('import kerncraft', ['-c', 'import kerncraft.kerncraft']),
+    ('kerncraft --help', ['-m', 'kerncraft.kerncraft', '--help']),
+    ('ECMData 2d-5pt.c', ['-m', 'kerncraft.kerncraft', '-p', 'ECMData',
+                          '-m', os.path.join(test_files, 'phinally_gcc.yaml'),
+                          os.path.join(test_files, '2d-5pt.c'), '-D', 'N', '1000', '-D', 'M', '1000',
+                          '--no-cache']),
+]
+
+
+def measure(args, repetitions, cwd, env):
+    '''Returns list of wall times in seconds of *repetitions* runs of python with *args*.'''
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repetitions):
+            start = time.time()
+            subprocess.check_call([sys.executable] + args,
+                                  cwd=cwd, env=env, stdout=devnull)
+            times.append(time.time() - start)
+    return times
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root_dir] + [
+        p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    # Run in empty directory, so no files left behind by previous runs are picked up
+    cwd = tempfile.mkdtemp()
+    try:
+        for name, args in benchmarks:
+            times = sorted(measure(args, repetitions, cwd, env))
+            print('{:<20} min {:6.3f} s   median {:6.3f} s'.format(
+                name, times[0], times[len(times)//2]))
+    finally:
+        shutil.rmtree(cwd)
+
+
+if __name__ == '__main__':
+    main()
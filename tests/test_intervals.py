@@ -2,8 +2,10 @@
 Unit tests for intervals module
 '''
 from __future__ import print_function
+from __future__ import division
 
 import sys
+import random
 import unittest
 
 sys.path.insert(0, '..')
@@ -18,7 +20,11 @@ class TestIntervals(unittest.TestCase):
         self.assertEqual(Intervals([-5, 5], [0, 10]).data, [[-5, 10]])
         self.assertEqual(Intervals([0, 9], [10, 11]).data, [[0, 9], [10, 11]])
         self.assertEqual(Intervals([0, 10], [10, 11]).data, [[0, 11]])
-        
+        # bounds stay integers, also beyond the exact range of doubles
+        for bound in Intervals([0, 10], [5, 20]).data[0]:
+            self.assertIsInstance(bound, int)
+        self.assertEqual(Intervals([2**53, 2**53+1]).data, [[2**53, 2**53+1]])
+
     def test_union(self):
         self.assertEqual(Intervals([0, 5]) & Intervals([1, 9]), Intervals([0, 9]))
         self.assertEqual(Intervals([0, 5]) & Intervals([5, 9]), Intervals([0, 9]))
@@ -33,3 +39,47 @@ class TestIntervals(unittest.TestCase):
         self.assertTrue(5 in Intervals([0,2], [4,10]))
         self.assertFalse(10 in Intervals([0, 10]))
         self.assertFalse(3 in Intervals([0,2], [4,10]))
+        self.assertFalse(-1 in Intervals([0,2], [4,10]))
+        self.assertFalse(3 in Intervals())
+
+    def test_add(self):
+        i = Intervals([0, 2], [4, 6], [10, 12])
+        i.add(2, 4)
+        self.assertEqual(i.data, [[0, 6], [10, 12]])
+        i.add(7, 8)
+        self.assertEqual(i.data, [[0, 6], [7, 8], [10, 12]])
+        i.add(-1, 20)
+        self.assertEqual(i.data, [[-1, 20]])
+        i.add(30, 30)
+        self.assertEqual(i.data, [[-1, 20]])
+
+    def test_update(self):
+        i = Intervals([0, 2])
+        i.update([[5, 7], [1, 3], [8, 8], [7, 9]])
+        self.assertEqual(i.data, [[0, 3], [5, 9]])
+        i.update([20, 10], [21, 11])
+        self.assertEqual(i.data, [[0, 3], [5, 9], [10, 11], [20, 21]])
+        self.assertIsInstance(i.data[0][0], int)
+
+    def test_random(self):
+        rng = random.Random(42)
+        ranges = [[l, l+rng.randint(1, 8)] for l in [rng.randint(-500, 500) for r in range(300)]]
+        covered = set(o for l, u in ranges for o in range(l, u))
+
+        added = Intervals()
+        for l, u in ranges:
+            added.add(l, u)
+        updated = Intervals()
+        updated.update(ranges)
+        combined = Intervals()
+        for l, u in ranges:
+            combined &= Intervals([l, u])
+
+        for i in [added, updated, combined, Intervals(*ranges)]:
+            self.assertEqual(i, added)
+            self.assertEqual(len(i), len(covered))
+            self.assertEqual([o for o in range(-510, 510) if o in i], sorted(covered))
+
+
+if __name__ == '__main__':
+    unittest.main()
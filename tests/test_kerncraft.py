@@ -12,24 +12,48 @@ import unittest
 import tempfile
 import shutil
 import pickle
+import json
+import subprocess
+from copy import deepcopy
 from pprint import pprint
 from io import StringIO
 
+import numpy
 import six
 import sympy
 
 sys.path.insert(0, '..')
 from kerncraft import kerncraft as kc
+from kerncraft.kernel import Kernel
+from kerncraft.machinemodel import MachineModel
+from kerncraft.models import LC, ECMData, Roofline
+from kerncraft.models.cache_simulation import Cache
+from kerncraft.cacheaccess import blocking, cache_access, expand_to_cacheline_blocks, Memo, \
+    nontemporal_arrays
+from kerncraft.pycparser import clean_code
+from kerncraft.resultstore import ResultStore
+from kerncraft.resultcache import ResultCache
+from kerncraft.bandwidth import bandwidth, kernel_bandwidth, kernel_blend, socket_cores, \
+    write_allocate_factor
+from kerncraft.prefixedunit import PrefixedUnit
+from kerncraft import likwid_bench_auto
 
 
 class TestKerncraft(unittest.TestCase):
     def setUp(self):
         # Create a temporary directory
         self.temp_dir = tempfile.mkdtemp()
+        # Keep the result cache of analyses within it
+        self._xdg_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.temp_dir
     
     def tearDown(self):
         # Remove the directory after the test
         shutil.rmtree(self.temp_dir)
+        if self._xdg_cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self._xdg_cache_home
     
     def _find_file(self, name):
         testdir = os.path.dirname(__file__)
@@ -38,7 +62,7 @@ class TestKerncraft(unittest.TestCase):
         return name
     
     def test_2d5pt_ECMData(self):
-        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECMData.pickle')
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECMData.db')
         output_stream = StringIO()
         
         parser = kc.create_parser()
@@ -53,7 +77,7 @@ class TestKerncraft(unittest.TestCase):
         kc.check_arguments(args, parser)
         kc.run(parser, args, output_file=output_stream)
         
-        results = pickle.load(open(store_file, 'rb'))
+        results = ResultStore(store_file).load()
         
         # Check if results contains correct kernel
         self.assertEqual(list(results), ['2d-5pt.c'])
@@ -75,7 +99,7 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(ecmd['L3-MEM'], 3.891891891891892, places=0)
 
     def test_2d5pt_Roofline(self):
-        store_file = os.path.join(self.temp_dir, 'test_2d5pt_Roofline.pickle')
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_Roofline.db')
         output_stream = StringIO()
         
         parser = kc.create_parser()
@@ -89,7 +113,7 @@ class TestKerncraft(unittest.TestCase):
         kc.check_arguments(args, parser)
         kc.run(parser, args, output_file=output_stream)
         
-        results = pickle.load(open(store_file, 'rb'))
+        results = ResultStore(store_file).load()
         
         # Check if results contains correct kernel
         self.assertEqual(list(results), ['2d-5pt.c'])
@@ -109,8 +133,407 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(roofline['min performance'], 2900000000.0, places=0)
         self.assertEqual(roofline['bottleneck level'], 3)
 
+    def test_2d5pt_Roofline_jobs(self):
+        serial_store_file = os.path.join(self.temp_dir, 'test_2d5pt_Roofline_serial.db')
+        parallel_store_file = os.path.join(self.temp_dir, 'test_2d5pt_Roofline_parallel.db')
+        serial_output = StringIO()
+        parallel_output = StringIO()
+
+        for store_file, output_stream, jobs in [(serial_store_file, serial_output, '1'),
+                                                (parallel_store_file, parallel_output, '2')]:
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                      '-p', 'Roofline',
+                                      '-p', 'ECMData',
+                                      self._find_file('2d-5pt.c'),
+                                      '-D', 'N', '1024-4096:3log2',
+                                      '-D', 'M', '50',
+                                      '-vvv',
+                                      '--jobs', jobs,
+                                      '--store', store_file])
+            kc.check_arguments(args, parser)
+            kc.run(parser, args, output_file=output_stream)
+
+        # Reports are printed in sweep order, independent of the number of jobs
+        self.assertEqual(serial_output.getvalue(), parallel_output.getvalue())
+
+        serial_results = ResultStore(serial_store_file).load()
+        parallel_results = ResultStore(parallel_store_file).load()
+        self.assertEqual(list(serial_results['2d-5pt.c']), list(parallel_results['2d-5pt.c']))
+        for constants, result in serial_results['2d-5pt.c'].items():
+            self.assertEqual(result['Roofline']['min performance'],
+                             parallel_results['2d-5pt.c'][constants]['Roofline']['min performance'])
+            self.assertEqual(result['ECMData']['cycles'],
+                             parallel_results['2d-5pt.c'][constants]['ECMData']['cycles'])
+
+    def test_2d5pt_Roofline_cache(self):
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+
+        def run(*extra_args):
+            store_file = os.path.join(self.temp_dir, 'test_2d5pt_Roofline_cache.db')
+            if os.path.exists(store_file):
+                os.remove(store_file)
+            output_stream = StringIO()
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                      '-p', 'Roofline',
+                                      self._find_file('2d-5pt.c'),
+                                      '-D', 'N', '1024-4096:3log2',
+                                      '-D', 'M', '50',
+                                      '-vvv',
+                                      '--store', store_file] + list(extra_args))
+            kc.check_arguments(args, parser)
+            kc.run(parser, args, output_file=output_stream)
+            return output_stream.getvalue(), ResultStore(store_file).load()['2d-5pt.c']
+
+        output, results = run('--cache-dir', cache_dir)
+        entries = [os.path.join(d, f) for d, _, files in os.walk(cache_dir) for f in files]
+        self.assertEqual(len(entries), 3)
+
+        # Second run is answered from cache with identical output
+        cached_output, cached_results = run('--cache-dir', cache_dir)
+        self.assertEqual(output, cached_output)
+        self.assertEqual(results, cached_results)
+
+        # Tampered entries prove that results are taken from cache, unless disabled
+        for entry in entries:
+            with open(entry, 'rb') as f:
+                entry_results, report = pickle.load(f)
+            entry_results['min performance'] = -1.0
+            with open(entry, 'wb') as f:
+                pickle.dump((entry_results, report), f)
+        output, results = run('--cache-dir', cache_dir)
+        self.assertEqual(set([r['Roofline']['min performance'] for r in results.values()]),
+                         set([-1.0]))
+        output, results = run('--cache-dir', cache_dir, '--no-cache')
+        self.assertNotIn(-1.0, [r['Roofline']['min performance'] for r in results.values()])
+
+        # Without a usable cache directory, analyses continue without cache (after a warning)
+        not_a_dir = os.path.join(self.temp_dir, 'not_a_dir')
+        open(not_a_dir, 'w').close()
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            output, results = run('--cache-dir', not_a_dir)
+            warnings = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(len(results), 3)
+        self.assertEqual(warnings.count('Warning: result cache'), 1)
+        cache = ResultCache(os.path.join(not_a_dir, 'cache'))
+        cache.put(cache.key('', MachineModel(self._find_file('phinally_gcc.yaml')), [], 'LC'), 1)
+        self.assertTrue(cache.disabled)
+
+    def test_cache_key_tool_versions(self):
+        kernel = Kernel(clean_code(open(self._find_file('2d-5pt.c')).read()))
+        machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        args = kc.create_parser().parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                              '-p', 'ECMCPU', self._find_file('2d-5pt.c')])
+        cache = ResultCache(os.path.join(self.temp_dir, 'cache'))
+        self.assertTrue(kc._tool_version('kerncraft-missing-tool').startswith('not available'))
+
+        versions = dict(kc._tool_versions)
+        try:
+            keys = []
+            for version in ['1.0', '2.0']:
+                kc._tool_versions[machine['compiler']] = 'gcc ' + version
+                kc._tool_versions['iaca.sh'] = 'IACA 2.1'
+                keys.append([kc._cache_key(cache, kernel, machine, [('N', 100)], model, args)
+                             for model in ['ECMCPU', 'RooflineIACA', 'Roofline']])
+        finally:
+            kc._tool_versions.clear()
+            kc._tool_versions.update(versions)
+        # Only models using compiler and IACA depend on their versions
+        self.assertNotEqual(keys[0][:2], keys[1][:2])
+        self.assertEqual(keys[0][2], keys[1][2])
+
+    def test_2d5pt_LC(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_LC.db')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'LC',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '1000',
+                                  '-D', 'N', '10000',
+                                  '-D', 'M', '50',
+                                  '-vvv',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = ResultStore(store_file).load()
+
+        # Three rows of a and one row of b fit into L1 up to N=1000
+        lc = results['2d-5pt.c'][((sympy.var('N'), 1000), (sympy.var('M'), 50))]['LC']
+        self.assertEqual([c['level'] for c in lc['cache']], ['L1', 'L2', 'L3'])
+        self.assertEqual([c['hits'] for c in lc['cache']], [3, 3, 3])
+        self.assertEqual([c['misses'] for c in lc['cache']], [2, 2, 2])
+        self.assertEqual([c['evicts'] for c in lc['cache']], [1, 1, 1])
+        condition = lc['cache'][0]['conditions'][-1]
+        self.assertEqual(condition['requirement'], 32*sympy.var('N') - 16)
+        self.assertEqual(condition['accesses'], 2)
+        self.assertTrue(condition['fulfilled'])
+        self.assertEqual(condition['critical sizes'], {sympy.var('N'): 1000})
+
+        lc = results['2d-5pt.c'][((sympy.var('N'), 10000), (sympy.var('M'), 50))]['LC']
+        self.assertEqual([c['hits'] for c in lc['cache']], [1, 1, 3])
+
+        # Evaluation of a whole range of N at once matches evaluation of single points
+        kernel = Kernel(clean_code(open(self._find_file('2d-5pt.c')).read()))
+        model = LC(kernel, MachineModel(self._find_file('phinally_gcc.yaml')), args)
+        N = numpy.array([100, 1000, 1001, 8000, 8001, 10**6])
+        evaluated = model.evaluate({sympy.var('N'): N, sympy.var('M'): 50})
+        self.assertEqual(list(evaluated[0]['hits']), [3, 3, 1, 1, 1, 1])
+        self.assertEqual(list(evaluated[1]['hits']), [3, 3, 3, 3, 1, 1])
+        for i, n in enumerate(N):
+            kernel.clear_state()
+            kernel.set_constant('N', int(n))
+            kernel.set_constant('M', 50)
+            for level, level_evaluated in zip(model.calculate_cache_access()['cache'], evaluated):
+                self.assertEqual(level['hits'], level_evaluated['hits'][i])
+                self.assertEqual(level['misses'], level_evaluated['misses'][i])
+
+    def test_2d5pt_CacheSim(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_CacheSim.db')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'CacheSim',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '1000',
+                                  '-D', 'N', '10000',
+                                  '-D', 'M', '50',
+                                  '--sim-iterations', '8000',
+                                  '-vvv',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = ResultStore(store_file).load()
+
+        # Simulation agrees with the layer conditions
+        sim = results['2d-5pt.c'][((sympy.var('N'), 1000), (sympy.var('M'), 50))]['CacheSim']
+        self.assertEqual(sim['iterations'], 8000)
+        self.assertEqual([l['level'] for l in sim['memory hierarchy']], ['L1', 'L2', 'L3'])
+        for level, misses in zip(sim['memory hierarchy'], [2, 2, 2]):
+            self.assertAlmostEqual(level['misses'], misses, places=1)
+        self.assertAlmostEqual(sim['memory hierarchy'][0]['evicts'], 1, places=1)
+
+        sim = results['2d-5pt.c'][((sympy.var('N'), 10000), (sympy.var('M'), 50))]['CacheSim']
+        for level, misses in zip(sim['memory hierarchy'], [4, 4, 2]):
+            self.assertAlmostEqual(level['misses'], misses, places=1)
+
+    def test_cache(self):
+        # Two sets with two ways each, cachelines 0, 2 and 4 map to the same set
+        l2 = Cache('L2', 1024, 64)
+        l1 = Cache('L1', 256, 64, ways=2, next_level=l2)
+        self.assertEqual(l1.set_count, 2)
+        l1.access(0, write=True)
+        l1.access(2)
+        l1.access(1)
+        l1.access(0)
+        l1.access(4)  # evicts least recently used cacheline 2
+        l1.access(2)  # evicts modified cacheline 0, which is written back
+        self.assertEqual((l1.hits, l1.misses, l1.evicts), (1, 5, 1))
+        self.assertEqual((l2.hits, l2.misses, l2.evicts), (1, 4, 1))
+
+        # With FIFO replacement, cacheline 0 is evicted first, even though it was used last
+        l1 = Cache('L1', 256, 64, ways=2, replacement_policy='FIFO')
+        for line in [0, 2, 0, 4, 0]:
+            l1.access(line)
+        self.assertEqual((l1.hits, l1.misses), (1, 4))
+
+    def test_memo(self):
+        calls = []
+        memo = Memo(lambda *args: calls.append(args) or sum(args), max_size=2)
+        self.assertEqual(memo(1, 2), 3)
+        self.assertEqual(memo(1, 2), 3)
+        self.assertEqual(memo(2, 1), 3)
+        memo(1, 2)
+        memo(3, 3)  # evicts least recently used (2, 1)
+        memo(2, 1)
+        self.assertEqual(calls, [(1, 2), (2, 1), (3, 3), (2, 1)])
+        self.assertEqual(memo.stats(), {'hits': 2, 'misses': 4, 'size': 2, 'max size': 2})
+        memo.clear()
+        self.assertEqual(len(memo), 0)
+
+        # Cacheline length is part of the key
+        self.assertEqual(expand_to_cacheline_blocks(8, 9, 9), (8, 15))
+        self.assertEqual(expand_to_cacheline_blocks(16, 9, 9), (0, 15))
+
+    def test_2d5pt_cache_access_shared(self):
+        kernel = Kernel(clean_code(open(self._find_file('2d-5pt.c')).read()))
+        machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        kernel.set_constant('N', 1000)
+        kernel.set_constant('M', 50)
+
+        # Models analyzing the same define share one simulation
+        levels = cache_access(kernel, machine)
+        self.assertIs(cache_access(kernel, machine), levels)
+        self.assertIsNot(cache_access(kernel, machine, unroll=False), levels)
+        self.assertEqual([l['level'] for l in levels], ['L1', 'L2', 'L3'])
+        self.assertEqual([l['level'] for l in cache_access(kernel, machine, cpu_level=True)],
+                         ['CPU', 'L1', 'L2', 'L3'])
+
+        kernel.clear_state()
+        kernel.set_constant('N', 10000)
+        kernel.set_constant('M', 50)
+        self.assertIsNot(cache_access(kernel, machine), levels)
+
+    def test_2d5pt_ECMData_scaling(self):
+        kernel = Kernel(clean_code(open(self._find_file('2d-5pt.c')).read()))
+        machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        kernel.set_constant('N', 10000)
+        kernel.set_constant('M', 10000)
+        args = kc.create_parser().parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                              '-p', 'ECMData', self._find_file('2d-5pt.c')])
+        model = ECMData(kernel, machine, args)
+        model.analyze()
+
+        curve = model.scaling(T_OL=8.0, T_nOL=4.0)
+        # Measured with up to 8 cores per socket on two sockets
+        self.assertEqual([(p['threads per core'], p['cores']) for p in curve],
+                         [(t, c) for t in [1, 2] for c in range(1, 17)])
+        # A single core is limited by the ECM prediction, more cores by memory bandwidth
+        self.assertAlmostEqual(curve[0]['cycles'],
+                               4.0 + sum([c for l, c in model.results['cycles']]))
+        self.assertEqual(curve[0]['speedup'], 1.0)
+        self.assertAlmostEqual(curve[1]['speedup'], 2.0)
+        self.assertEqual([p['bottleneck'] for p in curve[:4]], [None, None, 'L3-MEM', 'L3-MEM'])
+        self.assertTrue(all([p['speedup'] < 3 for p in curve if p['cores'] <= 8]))
+        self.assertAlmostEqual(curve[15]['speedup']/curve[7]['speedup'], 2)
+
+        # Bandwidth measured with as many cores limits all cores together
+        bw = machine['benchmarks']['measurements']['MEM'][1]['results']['copy'][2]*1.5
+        self.assertAlmostEqual(curve[2]['bandwidth cycles'],
+                               3*64*float(machine['clock'])/float(bw))
+
+    def test_measured_bandwidth(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        self.assertEqual(socket_cores(machine, 14), [14])
+        self.assertEqual(socket_cores(machine, 15), [8, 7])
+        self.assertEqual(socket_cores(machine, 28), [14, 14])
+        self.assertRaises(AssertionError, socket_cores, machine, 29)
+
+        # Bandwidths of sockets add up with first-touch placement
+        measurements = machine['benchmarks']['measurements']['MEM'][1]
+        local = [float(bw)*1.5 for bw in measurements['results']['copy']]
+        self.assertAlmostEqual(kernel_bandwidth(machine, 'MEM', 'copy', 3), local[2])
+        self.assertAlmostEqual(kernel_bandwidth(machine, 'MEM', 'copy'), max(local))
+        self.assertAlmostEqual(kernel_bandwidth(machine, 'MEM', 'copy', 28), 2*local[13],
+                               places=-6)
+        self.assertAlmostEqual(kernel_bandwidth(machine, 'MEM', 'copy', 15),
+                               local[7] + local[6], places=-6)
+
+        # Interleaved placement accesses half of the data in the memory of the other socket
+        self.assertRaises(AssertionError, kernel_bandwidth, machine, 'MEM', 'copy', 14, 1,
+                          'interleaved')
+        measurements['remote results'] = {'copy': [PrefixedUnit(float(bw)/2, 'B/s')
+                                                   for bw in measurements['results']['copy']]}
+        self.assertAlmostEqual(
+            kernel_bandwidth(machine, 'MEM', 'copy', 14, placement='interleaved'),
+            local[13]/1.5, places=-6)
+        self.assertAlmostEqual(
+            kernel_bandwidth(machine, 'MEM', 'copy', 28, placement='interleaved'),
+            2*local[13]/1.5, places=-6)
+        self.assertAlmostEqual(
+            kernel_bandwidth(machine, 'L3', 'copy', 4, placement='interleaved'),
+            float(machine['benchmarks']['measurements']['L3'][1]['results']['copy'][3])*1.5)
+
+        # Roofline uses bandwidths of both sockets
+        performance = {}
+        for cores in ['14', '28']:
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', self._find_file('hasep1.yaml'), '-p', 'Roofline',
+                                      self._find_file('2d-5pt.c'), '-c', cores])
+            kernel = Kernel(clean_code(open(self._find_file('2d-5pt.c')).read()))
+            kernel.set_constant('N', 10000)
+            kernel.set_constant('M', 10000)
+            model = Roofline(kernel, machine, args)
+            model.analyze()
+            performance[cores] = model.results['min performance']
+        self.assertAlmostEqual(performance['28']/performance['14'], 2, places=1)
+
+    def test_bandwidth(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        results = machine['benchmarks']['measurements']['MEM'][1]['results']
+        copy = [float(bw)*1.5 for bw in results['copy']]
+
+        # Kernels are chosen by the share of written streams and blended in between
+        self.assertEqual(kernel_blend(machine, 1, 0), [('load', 1.0)])
+        self.assertEqual(kernel_blend(machine, 16, 8), [('copy', 1.0)])
+        self.assertEqual(kernel_blend(machine, 1, 1), [('update', 1.0)])
+        self.assertEqual(kernel_blend(machine, 5, 0)[0][0], 'load')
+        blend = kernel_blend(machine, 5, 1)
+        self.assertEqual([name for name, weight in blend], ['load', 'triad'])
+        self.assertAlmostEqual(blend[1][1], 1/6/0.2)
+        self.assertAlmostEqual(
+            bandwidth(machine, 'MEM', 4, read_streams=3, write_streams=1),
+            1/(0.625/kernel_bandwidth(machine, 'MEM', 'triad', 4) + 0.375/copy[3]))
+
+        # Core counts are interpolated between measurements and evaluated all at once
+        measurements = machine['benchmarks']['measurements']['MEM'][1]
+        measurements['cores'] = [1, 2, 4, 14]
+        for name in measurements['results']:
+            measurements['results'][name] = [measurements['results'][name][c-1]
+                                              for c in measurements['cores']]
+        self.assertAlmostEqual(bandwidth(machine, 'MEM', 3, read_streams=2, write_streams=1),
+                               (copy[1] + copy[3])/2)
+        bws = bandwidth(machine, 'MEM', numpy.arange(1, 29), read_streams=2, write_streams=1)
+        self.assertEqual(bws.shape, (28,))
+        for cores, bw in zip(range(1, 29), bws):
+            self.assertAlmostEqual(
+                bw, bandwidth(machine, 'MEM', cores, read_streams=2, write_streams=1))
+        self.assertAlmostEqual(bws[-1], 2*copy[13], places=-6)
+        self.assertAlmostEqual(bws[8], copy[3] + (copy[13] - copy[3])*5/10, places=-6)
+        # 17 cores run as 9 and 8 on two sockets
+        self.assertAlmostEqual(bws[16], 2*copy[3] + (copy[13] - copy[3])*9/10, places=-6)
+
+    def test_copy_write_allocate(self):
+        kernel = Kernel(clean_code(open(self._find_file('copy.c')).read()))
+        machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        kernel.set_constant('N', 1000000)
+
+        self.assertEqual(nontemporal_arrays(kernel, None), ())
+        self.assertEqual(nontemporal_arrays(kernel, True), ('a',))
+        self.assertEqual(nontemporal_arrays(kernel, ['a', 'b', 'c']), ('a',))
+
+        levels = cache_access(kernel, machine)
+        self.assertEqual([l['total lines misses'] for l in levels], [2, 2, 2])
+        self.assertEqual([l['write allocate'] for l in levels], [True, True, True])
+        levels = cache_access(kernel, machine, nontemporal_stores=('a',))
+        self.assertEqual([l['total lines misses'] for l in levels], [1, 1, 1])
+        self.assertEqual([l['total lines evicts'] for l in levels], [0, 0, 1])
+        self.assertEqual([l['write allocate'] for l in levels], [True, True, False])
+        levels = cache_access(kernel, machine, unroll=False, cpu_level=True,
+                              nontemporal_stores=('a',))
+        self.assertEqual([l['total evicts'] for l in levels], [1, 0, 0, 1])
+
+        # Without write allocation in L1, writes are passed on without being loaded
+        kernel.clear_state()
+        kernel.set_constant('N', 1000000)
+        machine['memory hierarchy'][0]['write allocate'] = False
+        levels = cache_access(kernel, machine)
+        self.assertEqual([l['total lines misses'] for l in levels], [1, 1, 1])
+        self.assertEqual([l['total lines evicts'] for l in levels], [1, 1, 1])
+        self.assertEqual([l['write allocate'] for l in levels], [False, True, True])
+
+        # Benchmark kernels with non-temporal stores are preferred without write allocation
+        self.assertEqual(kernel_blend(machine, 2, 1), [('copy', 1.0)])
+        self.assertEqual(kernel_blend(machine, 1, 1, write_allocate=False), [('copy', 1.0)])
+        self.assertAlmostEqual(write_allocate_factor(machine, 'copy'), 1.5)
+        machine['benchmarks']['kernels']['copy_mem'] = dict(
+            machine['benchmarks']['kernels']['copy'], **{'write allocate': False})
+        self.assertEqual(kernel_blend(machine, 2, 1), [('copy', 1.0)])
+        self.assertEqual(kernel_blend(machine, 1, 1, write_allocate=False),
+                         [('copy_mem', 1.0)])
+        self.assertEqual(write_allocate_factor(machine, 'copy_mem'), 1.0)
+
     def test_sclar_product_ECMData(self):
-        store_file = os.path.join(self.temp_dir, 'test_scalar_product_ECMData.pickle')
+        store_file = os.path.join(self.temp_dir, 'test_scalar_product_ECMData.db')
         output_stream = StringIO()
         
         parser = kc.create_parser()
@@ -123,7 +546,7 @@ class TestKerncraft(unittest.TestCase):
         kc.check_arguments(args, parser)
         kc.run(parser, args, output_file=output_stream)
         
-        results = pickle.load(open(store_file, 'rb'))
+        results = ResultStore(store_file).load()
         
         # Output of first result:
         ecmd = results['scalar_product.c'][((sympy.var('N'), 10000),)]['ECMData']
@@ -133,7 +556,7 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(ecmd['L3-MEM'], 0.0, places=0)
 
     def test_copy_ECMData(self):
-        store_file = os.path.join(self.temp_dir, 'test_copy_ECMData.pickle')
+        store_file = os.path.join(self.temp_dir, 'test_copy_ECMData.db')
         output_stream = StringIO()
         
         parser = kc.create_parser()
@@ -147,7 +570,7 @@ class TestKerncraft(unittest.TestCase):
         kc.check_arguments(args, parser)
         kc.run(parser, args, output_file=output_stream)
         
-        results = pickle.load(open(store_file, 'rb'))
+        results = ResultStore(store_file).load()
         
         # Output of first result:
         ecmd = results['copy.c'][((sympy.var('N'), 1000000),)]['ECMData']
@@ -155,9 +578,232 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(ecmd['L1-L2'], 6, places=1)
         self.assertAlmostEqual(ecmd['L2-L3'], 8.31, places=1)
         self.assertAlmostEqual(ecmd['L3-MEM'], 16.6, places=0)
-    
+
+    def test_copy_ECMData_nontemporal(self):
+        store_file = os.path.join(self.temp_dir, 'test_copy_ECMData_nontemporal.db')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('hasep1.yaml'),
+                                  '-p', 'ECMData',
+                                  self._find_file('copy.c'),
+                                  '-D', 'N', '1000000',
+                                  '--nontemporal-stores',
+                                  '-vvv',
+                                  '--unit=cy/CL',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = ResultStore(store_file).load()
+        ecmd = results['copy.c'][((sympy.var('N'), 1000000),)]['ECMData']
+
+        # Only the read stream is transfered between caches, written cachelines are neither
+        # loaded nor evicted before they reach main memory
+        self.assertAlmostEqual(ecmd['L1-L2'], 2, places=1)
+        self.assertAlmostEqual(ecmd['L2-L3'], 2.77, places=1)
+        self.assertAlmostEqual(ecmd['L3-MEM'], 9.8, places=0)
+        self.assertEqual([l['total lines misses'] for l in ecmd['memory hierarchy']], [1, 1, 1])
+        self.assertEqual([l['total lines evicts'] for l in ecmd['memory hierarchy']], [0, 0, 1])
+
+    def test_batch_ECMData(self):
+        store_file = os.path.join(self.temp_dir, 'test_batch_ECMData.db')
+        testcases_file = os.path.join(self.temp_dir, '2d-5pt.testcases')
+        with open(testcases_file, 'w') as f:
+            f.write("[{'constants': [('N', 1000), ('M', 50)],  # comments are allowed\n"
+                    "  'results-to-compare': {'L1-L2': 10}},\n"
+                    " {'constants': [('N', 2000), ('M', 50)]}]\n")
+        manifest_file = os.path.join(self.temp_dir, 'kernels.manifest')
+        with open(manifest_file, 'w') as f:
+            f.write('# kernel testcases\n')
+            f.write('{} 2d-5pt.testcases\n'.format(self._find_file('2d-5pt.c')))
+            f.write('{}\n'.format(self._find_file('copy.c')))
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('hasep1.yaml'),
+                                  '-p', 'ECMData',
+                                  '--manifest', manifest_file,
+                                  os.path.join(os.path.dirname(self._find_file('copy.c')),
+                                               'scalar*.c'),
+                                  '-D', 'N', '1000000',
+                                  '--jobs', '2',
+                                  '--no-cache',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        self.assertEqual([os.path.basename(k) for k, t in args.kernels],
+                         ['scalar_product.c', '2d-5pt.c', 'copy.c'])
+        kc.run(parser, args, output_file=StringIO())
+
+        results = ResultStore(store_file).load()
+        six.assertCountEqual(self, results, ['2d-5pt.c', 'copy.c', 'scalar_product.c'])
+        # Defines overwrite constants from testcases file
+        six.assertCountEqual(self, results['2d-5pt.c'], [
+            ((sympy.var('N'), 1000000), (sympy.var('M'), 50))])
+        ecmd = results['copy.c'][((sympy.var('N'), 1000000),)]['ECMData']
+        self.assertAlmostEqual(ecmd['L3-MEM'], 16.6, places=0)
+
+        # Without defines, constants are taken from testcases file
+        args = parser.parse_args(['-m', self._find_file('hasep1.yaml'),
+                                  '-p', 'ECMData',
+                                  '--manifest', manifest_file,
+                                  '--no-cache',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        args.kernels = args.kernels[:1]
+        kc.run(parser, args, output_file=StringIO())
+        results = ResultStore(store_file).load()
+        six.assertCountEqual(self, results['2d-5pt.c'], [
+            ((sympy.var('N'), 1000000), (sympy.var('M'), 50)),
+            ((sympy.var('N'), 1000), (sympy.var('M'), 50)),
+            ((sympy.var('N'), 2000), (sympy.var('M'), 50))])
+
+    def test_2d5pt_testcases(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_testcases.db')
+        testcases_file = os.path.join(self.temp_dir, '2d-5pt.testcases')
+        with open(testcases_file, 'w') as f:
+            f.write("[{'constants': [('N', 1000), ('M', 50)]},\n"
+                    " {'constants': [('N', 2000), ('M', 50)]},\n"
+                    " {'constants': [('N', 1000), ('M', 50)]}]\n")
+
+        def run(*extra_args):
+            output_stream = StringIO()
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                      '-p', 'ECMData',
+                                      self._find_file('2d-5pt.c'),
+                                      '--testcases', testcases_file,
+                                      '--no-cache',
+                                      '--store', store_file] + list(extra_args))
+            kc.check_arguments(args, parser)
+            kc.run(parser, args, output_file=output_stream)
+            return output_stream.getvalue(), ResultStore(store_file).load()['2d-5pt.c']
+
+        # Duplicate testcases are only analyzed once
+        output, results = run()
+        self.assertEqual(output.count('-D N 1000 -D M 50'), 1)
+        self.assertEqual(output.count('-D N 2000 -D M 50'), 1)
+        six.assertCountEqual(self, results, [((sympy.var('N'), 1000), (sympy.var('M'), 50)),
+                                             ((sympy.var('N'), 2000), (sympy.var('M'), 50))])
+
+        # Only defines without results in store are analyzed
+        output, results = run('--skip-stored', '-D', 'N', '1000-3000:3')
+        self.assertNotIn('-D N 1000 -D M 50', output)
+        self.assertNotIn('-D N 2000 -D M 50', output)
+        self.assertEqual(output.count('-D N 3000 -D M 50'), 1)
+        self.assertEqual(len(results), 3)
+
+        # Code in testcases files is not executed
+        with open(testcases_file, 'w') as f:
+            f.write("[{'constants': [('N', __import__('os').getpid())]}]")
+        with self.assertRaises(ValueError):
+            run()
+
+    def test_2d5pt_auto_define(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_auto_define.db')
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'Roofline',
+                                  self._find_file('2d-5pt.c'),
+                                  '--sweep-points', '2',
+                                  '--sweep-levels', 'L1,MEM',
+                                  '--no-cache',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=StringIO())
+
+        results = ResultStore(store_file).load()
+        self.assertEqual(len(results['2d-5pt.c']), 4)
+        for constants, result in results['2d-5pt.c'].items():
+            self.assertEqual([str(c) for c, v in constants], ['N', 'M'])
+            self.assertIn('Roofline', result)
+
+    def test_2d5pt_refine(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_refine.db')
+
+        def run(*extra_args):
+            output_stream = StringIO()
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                      '-p', 'ECMData',
+                                      self._find_file('2d-5pt.c'),
+                                      '-D', 'N', '100-100000:4log10',
+                                      '-D', 'M', '50',
+                                      '--no-cache',
+                                      '--store', store_file] + list(extra_args))
+            kc.check_arguments(args, parser)
+            kc.run(parser, args, output_file=output_stream)
+            return output_stream.getvalue()
+
+        # Sweep points are stored first and then refined without analyzing them again
+        run()
+        output = run('--refine', '--skip-stored')
+        self.assertNotIn('-D N 100 -D M 50\n', output)
+        self.assertNotIn('-D N 100000 -D M 50\n', output)
+
+        results = ResultStore(store_file).load()['2d-5pt.c']
+        cycles = sorted([(dict(constants)[sympy.Symbol('N')], result['ECMData']['cycles'])
+                         for constants, result in results.items()])
+        # Only transitions are refined, each one down to neighbouring values of N
+        self.assertLess(len(cycles), 100)
+        transitions = [(n, next_n) for (n, c), (next_n, next_c) in zip(cycles, cycles[1:])
+                       if c != next_c]
+        self.assertGreater(len(transitions), 0)
+        for n, next_n in transitions:
+            self.assertEqual(next_n - n, 1)
+
+        # Refinement of a complete store analyzes nothing
+        self.assertNotIn('-D N', run('--refine', '--skip-stored'))
+
+    def test_2d5pt_json(self):
+        output_stream = StringIO()
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'ECMData',
+                                  '-p', 'Roofline',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '1000-2000:2',
+                                  '-D', 'M', '50',
+                                  '--no-cache',
+                                  '--json'])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        # One record per line, instead of reports
+        records = [json.loads(l) for l in output_stream.getvalue().splitlines()]
+        self.assertEqual([(r['define']['N'], r['model']) for r in records], [
+            (1000, 'ECMData'), (1000, 'Roofline'), (2000, 'ECMData'), (2000, 'Roofline')])
+        # CPU-L1 transfers (5 reads, 1 write) blend load and triad kernel bandwidths
+        self.assertEqual(records[1]['results']['mem bottlenecks'][0]['bw kernel'], 'load/triad')
+        self.assertAlmostEqual(records[1]['results']['mem bottlenecks'][0]['bandwidth [B/s]'],
+                               92.08e9, places=-7)
+
+    def test_argument_parser_batch(self):
+        parser = kc.create_parser()
+        test_dir = os.path.join(self.temp_dir, 'kernels')
+        os.mkdir(test_dir)
+        for name in ['copy.c', '2d-5pt.c', 'hasep1.yaml']:
+            shutil.copy(self._find_file(name), test_dir)
+
+        args = parser.parse_args(['-m', self._find_file('hasep1.yaml'), '-p', 'ECMData', test_dir])
+        kc.check_arguments(args, parser)
+        self.assertEqual(args.kernels, [(os.path.join(test_dir, k), None) for k in [
+            '2d-5pt.c', 'copy.c']])
+
+        for files in [[], [os.path.join(test_dir, 'missing.c')], [os.path.join(test_dir, 'x*.c')],
+                      [os.path.join(test_dir, 'copy.c'), '--skip-stored']]:
+            args = parser.parse_args(['-m', self._find_file('hasep1.yaml'), '-p', 'ECMData'] +
+                                     files)
+            with self.assertRaises(SystemExit):
+                kc.check_arguments(args, parser)
+
+        # Kernels are stored by file name, so names must be unique
+        args = parser.parse_args(['-m', self._find_file('hasep1.yaml'), '-p', 'ECMData',
+                                  self._find_file('copy.c'), os.path.join(test_dir, 'copy.c')])
+        with self.assertRaises(SystemExit):
+            kc.check_arguments(args, parser)
+
     def test_2d5pt_ECMCPU(self):
-        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECMCPU.pickle')
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECMCPU.db')
         output_stream = StringIO()
         
         parser = kc.create_parser()
@@ -172,7 +818,7 @@ class TestKerncraft(unittest.TestCase):
         kc.check_arguments(args, parser)
         kc.run(parser, args, output_file=output_stream)
         
-        results = pickle.load(open(store_file, 'rb'))
+        results = ResultStore(store_file).load()
         
         # Check if results contains correct kernel
         self.assertEqual(list(results), ['2d-5pt.c'])
@@ -191,8 +837,44 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(ecmd['T_OL'], 24.8, places=1)
         self.assertAlmostEqual(ecmd['T_nOL'], 20, places=1)
 
+    def test_2d5pt_ECMCPU_sweep(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECMCPU_sweep.db')
+        iaca_log = os.path.join(self.temp_dir, 'iaca.log')
+        output_stream = StringIO()
+
+        environ = dict(os.environ)
+        os.environ['PATH'] = self._find_file('dummy_iaca')+':'+os.environ['PATH']
+        os.environ['DUMMY_IACA_LOG'] = iaca_log
+        try:
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                      '-p', 'ECMCPU',
+                                      self._find_file('2d-5pt.c'),
+                                      '-D', 'N', '1000-4000:4',
+                                      '-D', 'M', '1000',
+                                      '-vvv',
+                                      '--no-cache',
+                                      '--store', store_file])
+            kc.check_arguments(args, parser)
+            kc.run(parser, args, output_file=output_stream)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+        results = ResultStore(store_file).load()
+        self.assertEqual(len(results['2d-5pt.c']), 4)
+
+        # Compilation and IACA (throughput and latency) only ran once for the whole sweep
+        with open(iaca_log) as f:
+            self.assertEqual(len(f.readlines()), 2)
+        ecmcpu = [r['ECMCPU'] for r in results['2d-5pt.c'].values()]
+        for r in ecmcpu[1:]:
+            self.assertEqual(r['T_OL'], ecmcpu[0]['T_OL'])
+            self.assertEqual(r['T_nOL'], ecmcpu[0]['T_nOL'])
+            self.assertEqual(r['port cycles'], ecmcpu[0]['port cycles'])
+
     def test_2d5pt_ECM(self):
-        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECM.pickle')
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECM.db')
         output_stream = StringIO()
         
         parser = kc.create_parser()
@@ -207,7 +889,7 @@ class TestKerncraft(unittest.TestCase):
         kc.check_arguments(args, parser)
         kc.run(parser, args, output_file=output_stream)
         
-        results = pickle.load(open(store_file, 'rb'))
+        results = ResultStore(store_file).load()
         
         # Check if results contains correct kernel
         self.assertEqual(list(results), ['2d-5pt.c'])
@@ -230,7 +912,7 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(ecmd['L3-MEM'], 12.580, places=0)
 
     def test_2d5pt_RooflineIACA(self):
-        store_file = os.path.join(self.temp_dir, 'test_2d5pt_RooflineIACA.pickle')
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_RooflineIACA.db')
         output_stream = StringIO()
         
         parser = kc.create_parser()
@@ -245,7 +927,7 @@ class TestKerncraft(unittest.TestCase):
         kc.check_arguments(args, parser)
         kc.run(parser, args, output_file=output_stream)
         
-        results = pickle.load(open(store_file, 'rb'))
+        results = ResultStore(store_file).load()
         
         # Check if results contains correct kernel
         self.assertEqual(list(results), ['2d-5pt.c'])
@@ -265,7 +947,7 @@ class TestKerncraft(unittest.TestCase):
         self.assertEqual(roofline['bottleneck level'], 2)
 
     def test_2d5pt_Benchmark(self):
-        store_file = os.path.join(self.temp_dir, 'test_2d5pt_Benchmark.pickle')
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_Benchmark.db')
         output_stream = StringIO()
 
         os.environ['PATH'] = self._find_file('dummy_likwid')+':'+os.environ['PATH']
@@ -283,7 +965,7 @@ class TestKerncraft(unittest.TestCase):
         kc.check_arguments(args, parser)
         kc.run(parser, args, output_file=output_stream)
 
-        results = pickle.load(open(store_file, 'rb'))
+        results = ResultStore(store_file).load()
 
         # Check if results contains correct kernel
         self.assertEqual(list(results), ['2d-5pt.c'])
@@ -312,6 +994,116 @@ class TestKerncraft(unittest.TestCase):
         for k, v in correct_results.items():
             self.assertAlmostEqual(roofline[k], v, places=1)
     
+    def test_likwid_bench_auto_dry_run(self):
+        machine_file = os.path.join(self.temp_dir, 'machine.yaml')
+        machine = likwid_bench_auto.load_machine_file(self._find_file('phinally_gcc.yaml'))
+        del machine['benchmarks']
+        machine['cores per socket'] = 2
+        machine['threads per core'] = 1
+        likwid_bench_auto.write_machine_file(machine, machine_file)
+
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            likwid_bench_auto.main([machine_file, '--dry-run', '--jobs', '2',
+                                    '--repetitions', '3'])
+            machine = likwid_bench_auto.load_machine_file(machine_file)
+            self.assertEqual(likwid_bench_auto.measurement_tasks(machine), [])
+            measurement = machine['benchmarks']['measurements']['MEM'][1]
+            self.assertEqual(measurement['cores'], [1, 2])
+            self.assertEqual(sorted(measurement['results']),
+                             sorted(likwid_bench_auto.BENCHMARK_KERNELS))
+            self.assertGreater(float(measurement['results']['copy'][1]),
+                               float(measurement['results']['copy'][0]))
+            self.assertEqual(len(measurement['remote results']['copy']), 2)
+            self.assertAlmostEqual(measurement['results variance']['copy'][0], 0.0)
+
+            # Only missing measurements are taken when resuming
+            measurement['results']['copy'][0] = None
+            measurement['remote results']['load'][1] = PrefixedUnit(1, 'MB/s')
+            likwid_bench_auto.write_machine_file(machine, machine_file)
+            self.assertEqual(likwid_bench_auto.measurement_tasks(machine),
+                             [('MEM', 1, 'results', 'copy', 0)])
+            likwid_bench_auto.main([machine_file, '--dry-run'])
+        finally:
+            sys.stderr = stderr
+        machine = MachineModel(machine_file)
+        measurement = machine['benchmarks']['measurements']['MEM'][1]
+        self.assertIsNotNone(measurement['results']['copy'][0])
+        self.assertEqual(float(measurement['remote results']['load'][1]), 1e6)
+        self.assertGreater(bandwidth(machine, 'MEM', 3, read_streams=2, write_streams=1),
+                           bandwidth(machine, 'MEM', 1, read_streams=2, write_streams=1))
+
+    def test_likwid_bench_auto_update(self):
+        machine_file = os.path.join(self.temp_dir, 'machine.yaml')
+        machine = likwid_bench_auto.load_machine_file(self._find_file('hasep1.yaml'))
+        original = likwid_bench_auto.load_machine_file(self._find_file('hasep1.yaml'))
+        measurements = machine['benchmarks']['measurements']
+        machine['cores per socket'] = 2
+        machine['benchmarks']['kernels']['triad']['FLOPs per iteration'] = 3
+        measurements['MEM'][1]['results']['load'][1] = None
+
+        # Detected information replaces that of the machine file, other information is kept
+        topology = deepcopy(machine)
+        del topology['benchmarks']
+        topology['clock'] = 'INFORMATION_REQUIRED'
+        topology['memory hierarchy'][2]['size per group'] = PrefixedUnit(30, 'MB')
+        topology['memory hierarchy'][2]['cycles per cacheline transfer'] = 'INFORMATION_REQUIRED'
+        self.assertEqual(likwid_bench_auto.merge_topology(deepcopy(machine), topology), {'L3'})
+        merged = deepcopy(machine)
+        likwid_bench_auto.merge_topology(merged, topology)
+        self.assertEqual(merged['clock'], machine['clock'])
+        self.assertEqual(float(merged['memory hierarchy'][2]['size per group']), 30e6)
+        self.assertEqual(merged['memory hierarchy'][2]['cycles per cacheline transfer'],
+                         machine['memory hierarchy'][2]['cycles per cacheline transfer'])
+
+        # Only missing and stale results are measured
+        likwid_bench_auto.write_machine_file(machine, machine_file)
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            likwid_bench_auto.main(['measure', machine_file, '--dry-run', '--remeasure', 'L1'])
+        finally:
+            sys.stderr = stderr
+        machine = likwid_bench_auto.load_machine_file(machine_file)
+        self.assertEqual(likwid_bench_auto.measurement_tasks(machine), [])
+        self.assertEqual(machine['compiler flags'], original['compiler flags'])
+        self.assertEqual(machine['overlapping ports'], original['overlapping ports'])
+        measurement = machine['benchmarks']['measurements']['MEM'][1]
+        original_measurement = original['benchmarks']['measurements']['MEM'][1]
+        self.assertEqual(measurement['cores'], [1, 2])
+        self.assertEqual(measurement['total size'], original_measurement['total size'][:2])
+        self.assertEqual(measurement['results']['load'][0],
+                         original_measurement['results']['load'][0])
+        self.assertNotEqual(measurement['results']['load'][1],
+                            original_measurement['results']['load'][1])
+        self.assertNotEqual(measurement['results']['triad'],
+                            original_measurement['results']['triad'][:2])
+        self.assertEqual(len(measurement['results']['copy_mem']), 2)
+        self.assertEqual(len(measurement['remote results']['copy']), 2)
+        self.assertNotEqual(
+            machine['benchmarks']['measurements']['L1'][1]['results']['copy'][0],
+            original['benchmarks']['measurements']['L1'][1]['results']['copy'][0])
+        self.assertEqual(machine['benchmarks']['measurements']['L2'][1]['results']['copy'][0],
+                         original['benchmarks']['measurements']['L2'][1]['results']['copy'][0])
+
+        # Upgrading only changes the format of older machine files
+        machine['overlapping ports'] = 'INFORAMTION_REQUIRED'
+        del machine['benchmarks']['kernels']['copy_mem']['write allocate']
+        del machine['benchmarks']['measurements']['L2'][2]['threads']
+        likwid_bench_auto.write_machine_file(machine, machine_file)
+        sys.stderr = StringIO()
+        try:
+            likwid_bench_auto.main(['upgrade', machine_file])
+        finally:
+            sys.stderr = stderr
+        upgraded = likwid_bench_auto.load_machine_file(machine_file)
+        self.assertEqual(upgraded['overlapping ports'], 'INFORMATION_REQUIRED')
+        self.assertFalse(upgraded['benchmarks']['kernels']['copy_mem']['write allocate'])
+        self.assertEqual(upgraded['benchmarks']['measurements']['L2'][2]['threads'], [2, 4])
+        self.assertEqual(upgraded['benchmarks']['measurements']['MEM'][1]['results'],
+                         measurement['results'])
+
     def test_argument_parser_asm_block(self):
         # valid --asm-block
         parser = kc.create_parser()
@@ -440,6 +1232,17 @@ class TestKerncraft(unittest.TestCase):
         self.assertEqual(args.define[0][0], 'M')
         self.assertEqual(list(args.define[0][1]), [10, 100, 1000])
 
+    def test_lazy_imports(self):
+        # A fresh interpreter is needed, since this one has already imported everything
+        code = ('import sys\n'
+                'from kerncraft import kerncraft as kc\n'
+                'kc.create_parser()\n'
+                'print(" ".join(m for m in ["sympy", "numpy", "matplotlib", "kerncraft.kernel"] '
+                'if m in sys.modules))\n')
+        root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=root_dir)
+        self.assertEqual(output.decode().strip(), '')
+
     def test_space_linear(self):
         self.assertEqual(list(kc.space(1, 10, 10)), [1,2,3,4,5,6,7,8,9,10])
         self.assertEqual(list(kc.space(1, 10, 3)), [1, 6, 10])
@@ -459,6 +1262,12 @@ class TestKerncraft(unittest.TestCase):
         self.assertEqual(list(kc.space(1, 16, 3, log=True, base=2)), [1, 4, 16])
         self.assertEqual(list(kc.space(1, 4, 2, endpoint=False, log=True, base=2)), [1,2])
         self.assertEqual(list(kc.space(4, 8, 2, log=True, base=2)), [4, 8])
+
+    def test_blocking(self):
+        self.assertEqual(blocking([0, -1, -2, -3, -4, -5, -6, -7, -8, -9], 8), [-2, -1, 0])
+        self.assertEqual(blocking(numpy.array([17, 3, 16, 2, 3]), 8), [0, 2])
+        self.assertEqual(blocking([8, 9, 15], 8, initial_boundary=1), [0, 1])
+        self.assertEqual(blocking([], 8), [])
     
 
 if __name__ == '__main__':
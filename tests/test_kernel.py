@@ -0,0 +1,74 @@
+'''
+Unit tests for kernel module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import unittest
+
+import numpy
+import sympy
+
+sys.path.insert(0, '..')
+from kerncraft.kernel import Kernel, get_parser
+from kerncraft.pycparser import clean_code
+
+
+class TestKernel(unittest.TestCase):
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def setUp(self):
+        with open(self._find_file('2d-5pt.c')) as f:
+            self.kernel = Kernel(clean_code(f.read()))
+
+    def test_access_offsets(self):
+        self.kernel.set_constant('N', 100)
+        self.kernel.set_constant('M', 50)
+        reads, writes, iteration_offsets = self.kernel.access_offsets()
+
+        self.assertEqual(sorted(reads['a']['ji']), [-100, -1, 1, 100])
+        self.assertEqual(writes['b']['ji'], [0])
+        self.assertEqual(iteration_offsets['a']['ji'], 1)
+
+        # Evaluated offsets match symbolic offsets with substituted constants
+        symbolic_reads = self.kernel.symbolic_access_offsets()[0]
+        self.assertEqual(sorted(reads['a']['ji']),
+                         sorted([self.kernel.subs_consts(o) for o in symbolic_reads['a']['ji']]))
+
+    def test_access_offsets_array(self):
+        N = numpy.array([10, 100, 1000])
+        reads, writes, iteration_offsets = self.kernel.access_offsets(
+            {sympy.Symbol('N'): N, sympy.Symbol('M'): numpy.array([5, 5, 5])})
+        self.assertIn(list(-N), [list(numpy.broadcast_to(o, N.shape)) for o in reads['a']['ji']])
+
+    def test_array_sizes(self):
+        self.kernel.set_constant('N', 100)
+        self.kernel.set_constant('M', 50)
+        self.assertEqual(self.kernel.array_sizes(), {'a': 8*100*50, 'b': 8*100*50})
+
+        # Changing constants re-evaluates the compiled expressions
+        self.kernel.clear_state()
+        self.kernel.set_constant('N', 10)
+        self.kernel.set_constant('M', 5)
+        self.assertEqual(self.kernel.array_sizes(), {'a': 8*10*5, 'b': 8*10*5})
+
+    def test_shared_parser(self):
+        self.assertIs(get_parser(), get_parser())
+
+        # Parser state does not leak from one kernel to the next
+        with open(self._find_file('copy.c')) as f:
+            kernel = Kernel(clean_code(f.read()))
+        self.assertEqual(sorted(kernel._variables), ['a', 'b'])
+        self.assertEqual(sorted(Kernel(self.kernel.kernel_code)._variables), ['a', 'b', 's'])
+
+
+if __name__ == '__main__':
+    unittest.main()
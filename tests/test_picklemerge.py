@@ -0,0 +1,92 @@
+'''
+Unit tests for picklemerge module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import sympy
+
+sys.path.insert(0, '..')
+from kerncraft.picklemerge import iter_merges
+from kerncraft.resultstore import ResultStore
+
+
+class TestPickleMerge(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.destination = os.path.join(self.temp_dir, 'destination.db')
+        self.source = os.path.join(self.temp_dir, 'source.db')
+        with ResultStore(self.destination) as store:
+            store.append('copy.c', [('N', 100)], [('ECMData', 1.0)])
+            store.append('2d-5pt.c', [('N', 100), ('M', 50)], [('ECMData', 2.0)])
+        with ResultStore(self.source) as store:
+            for kernel in ['copy.c', '2d-5pt.c', 'triad.c']:
+                store.append(kernel, [('N', 200)], [('ECMData', 3.0), ('Roofline', 4.0)])
+            # same as destination
+            store.append('copy.c', [('N', 100)], [('ECMData', 1.0)])
+            # conflicting with destination
+            store.append('2d-5pt.c', [('N', 100), ('M', 50)], [('ECMData', 5.0)])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_merge(self):
+        for jobs in [1, 2]:
+            shutil.copy(self.destination, self.destination + '.orig')
+            merged = list(iter_merges(self.destination, self.source, jobs=jobs))
+            self.assertEqual(merged, [
+                ('2d-5pt.c', 2, [('2d-5pt.c', [('N', 100), ('M', 50)], 'ECMData')]),
+                ('copy.c', 2, []),
+                ('triad.c', 2, [])])
+
+            with ResultStore(self.destination) as store:
+                self.assertEqual(store.kernels(), ['2d-5pt.c', 'copy.c', 'triad.c'])
+                # Conflicting results are kept
+                self.assertEqual(store.get('2d-5pt.c', [('N', 100), ('M', 50)], 'ECMData'), 2.0)
+                self.assertEqual(store.get('triad.c', [('N', 200)], 'Roofline'), 4.0)
+            shutil.move(self.destination + '.orig', self.destination)
+
+        list(iter_merges(self.destination, self.source, overwrite=True))
+        with ResultStore(self.destination) as store:
+            self.assertEqual(store.get('2d-5pt.c', [('N', 100), ('M', 50)], 'ECMData'), 5.0)
+
+        # Merging again changes nothing
+        self.assertEqual([m[1] for m in iter_merges(self.destination, self.source)], [0, 0, 0])
+
+    def test_split(self):
+        destination = os.path.join(self.temp_dir, 'split')
+        os.mkdir(destination)
+        list(iter_merges(destination, self.destination, split=True))
+        list(iter_merges(destination, self.source, split=True, jobs=2))
+        self.assertEqual(sorted(os.listdir(destination)),
+                         ['2d-5pt.c.db', 'copy.c.db', 'triad.c.db'])
+        with ResultStore(os.path.join(destination, 'copy.c.db')) as store:
+            self.assertEqual(store.kernels(), ['copy.c'])
+            self.assertEqual(len(list(store.query())), 3)
+
+    def test_pickle_source(self):
+        N, M = sympy.symbols('N M')
+        source = os.path.join(self.temp_dir, 'source.pickle')
+        with open(source, 'wb') as f:
+            pickle.dump({'copy.c': {((N, 300),): {'ECMData': 6.0}},
+                         '2d-5pt.c': {((N, 100), (M, 50)): {'ECMData': 7.0}}}, f)
+
+        merged = list(iter_merges(self.destination, source))
+        self.assertEqual(merged, [
+            ('2d-5pt.c', 0, [('2d-5pt.c', [('N', 100), ('M', 50)], 'ECMData')]),
+            ('copy.c', 1, [])])
+        with ResultStore(self.destination) as store:
+            self.assertEqual(store.get('copy.c', [('N', 300)], 'ECMData'), 6.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
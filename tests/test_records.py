@@ -0,0 +1,65 @@
+'''
+Unit tests for records module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import json
+import unittest
+from io import StringIO
+
+import numpy
+import sympy
+
+sys.path.insert(0, '..')
+from kerncraft.records import normalize, flatten, result_record, RecordWriter
+from kerncraft.prefixedunit import PrefixedUnit
+
+
+class TestRecords(unittest.TestCase):
+    def test_normalize(self):
+        N = sympy.Symbol('N')
+        self.assertEqual(normalize({
+            'bandwidth': PrefixedUnit(10, 'G', 'B/s'),
+            'cycles': [('L1', numpy.float64(2.5)), ('L2', sympy.Integer(3))],
+            'critical sizes': {N: 1000},
+            'requirement': 32*N - 16,
+            'scaling cores': float('inf'),
+            'IACA output': 'raw',
+            'fulfilled': True}, omit=['IACA output']), {
+            'bandwidth [B/s]': 10e9,
+            'cycles': [['L1', 2.5], ['L2', 3]],
+            'critical sizes': {'N': 1000},
+            'requirement': '32*N - 16',
+            'scaling cores': 'inf',
+            'fulfilled': True})
+
+    def test_writer(self):
+        record = result_record('2d-5pt.c', 'machine.yaml', [('N', 100), ('M', 50)], 'ECMData',
+                               {'cycles': [('L1-L2', 10)], 'T_OL': 2.0})
+        self.assertEqual(list(flatten(record['results'])),
+                         [('T_OL', 2.0), ('cycles.0.0', 'L1-L2'), ('cycles.0.1', 10)])
+
+        output = StringIO()
+        writer = RecordWriter(output, 'json')
+        writer.write(record)
+        writer.write(record)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])['define'], {'N': 100, 'M': 50})
+
+        output = StringIO()
+        writer = RecordWriter(output, 'csv')
+        writer.write(record)
+        self.assertEqual(output.getvalue().splitlines(), [
+            'kernel,machine,define,model,result,value',
+            '2d-5pt.c,machine.yaml,N=100 M=50,ECMData,T_OL,2.0',
+            '2d-5pt.c,machine.yaml,N=100 M=50,ECMData,cycles.0.0,L1-L2',
+            '2d-5pt.c,machine.yaml,N=100 M=50,ECMData,cycles.0.1,10'])
+
+
+if __name__ == '__main__':
+    unittest.main()
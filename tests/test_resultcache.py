@@ -0,0 +1,84 @@
+'''
+Unit tests for resultcache module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, '..')
+from kerncraft.resultcache import ResultCache
+from kerncraft.machinemodel import MachineModel
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def test_key(self):
+        cache = ResultCache(self.temp_dir)
+        machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        other_machine = MachineModel(self._find_file('hasep1.yaml'))
+        key = cache.key('a[i] = b[i];', machine, [('N', 100)], 'ECMData', {'cores': '1'})
+
+        self.assertEqual(
+            key, cache.key('a[i] = b[i];', machine, [('N', 100)], 'ECMData', {'cores': '1'}))
+        for other_key in [
+                cache.key('a[i] = 2*b[i];', machine, [('N', 100)], 'ECMData', {'cores': '1'}),
+                cache.key('a[i] = b[i];', other_machine, [('N', 100)], 'ECMData', {'cores': '1'}),
+                cache.key('a[i] = b[i];', machine, [('N', 101)], 'ECMData', {'cores': '1'}),
+                cache.key('a[i] = b[i];', machine, [('N', 100)], 'Roofline', {'cores': '1'}),
+                cache.key('a[i] = b[i];', machine, [('N', 100)], 'ECMData', {'cores': '2'})]:
+            self.assertNotEqual(key, other_key)
+
+    def test_get_put(self):
+        cache = ResultCache(self.temp_dir)
+        self.assertIsNone(cache.get('00ff'))
+        cache.put('00ff', ({'cycles': [1, 2]}, 'report'))
+        self.assertEqual(cache.get('00ff'), ({'cycles': [1, 2]}, 'report'))
+
+        # Broken entries are treated as missing
+        with open(os.path.join(self.temp_dir, '00', '00ff.pickle'), 'wb') as f:
+            f.write(b'broken')
+        self.assertIsNone(cache.get('00ff'))
+
+    def test_lru_eviction(self):
+        value = 'x'*1000
+        cache = ResultCache(self.temp_dir)
+        cache.put('aa00', value)
+        entry_size = os.path.getsize(os.path.join(self.temp_dir, 'aa', 'aa00.pickle'))
+        cache = ResultCache(self.temp_dir, max_size=3*entry_size)
+
+        # Make modification times distinguishable
+        for i, key in enumerate(['aa01', 'aa02']):
+            cache.put(key, value)
+            os.utime(os.path.join(self.temp_dir, 'aa', key + '.pickle'), (i+1, i+1))
+        os.utime(os.path.join(self.temp_dir, 'aa', 'aa00.pickle'), (0, 0))
+
+        # Access marks entry as recently used
+        self.assertEqual(cache.get('aa00'), value)
+        cache.put('aa03', value)
+
+        self.assertIsNone(cache.get('aa01'))
+        for key in ['aa00', 'aa02', 'aa03']:
+            self.assertEqual(cache.get(key), value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+'''
+Unit tests for resultstore module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import pickle
+import sqlite3
+import shutil
+import tempfile
+import unittest
+
+import sympy
+
+sys.path.insert(0, '..')
+from kerncraft.resultstore import ResultStore, is_result_store
+from kerncraft.prefixedunit import PrefixedUnit
+
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'results.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_append_load(self):
+        with ResultStore(self.path) as store:
+            store.append('copy.c', [('N', 100)], [('ECMData', {'cycles': [('L1', 2.0)]}),
+                                                  ('Roofline', {'min performance': 1.5})])
+            store.append('copy.c', [('N', 200)], [('ECMData', {'cycles': [('L1', 3.0)]})])
+            store.append('2d-5pt.c', [('N', 100), ('M', 50)], [
+                ('Roofline', {'bandwidth': PrefixedUnit(10, 'G', 'B/s')})])
+            # Latest results of a key replace earlier ones
+            store.append('copy.c', [('N', 100)], [('ECMData', {'cycles': [('L1', 4.0)]})])
+
+        # Concurrent writers use their own connection, results are visible to all
+        store = ResultStore(self.path)
+        other_store = ResultStore(self.path)
+        other_store.append('copy.c', [('N', 300)], [('ECMData', {'cycles': [('L1', 5.0)]})])
+        other_store.close()
+
+        N, M = sympy.symbols('N M')
+        self.assertEqual(store.kernels(), ['2d-5pt.c', 'copy.c'])
+        self.assertEqual(store.load(), {
+            '2d-5pt.c': {((N, 100), (M, 50)): {
+                'Roofline': {'bandwidth': PrefixedUnit(10, 'G', 'B/s')}}},
+            'copy.c': {((N, 100),): {'ECMData': {'cycles': [('L1', 4.0)]},
+                                     'Roofline': {'min performance': 1.5}},
+                       ((N, 200),): {'ECMData': {'cycles': [('L1', 3.0)]}},
+                       ((N, 300),): {'ECMData': {'cycles': [('L1', 5.0)]}}}})
+        self.assertEqual(store.stored_models('copy.c', [('N', 100)]), set(['ECMData', 'Roofline']))
+        self.assertEqual(store.stored_models('copy.c', [('N', 101)]), set())
+        store.close()
+
+    def test_define_order(self):
+        with ResultStore(self.path) as store:
+            store.append('2d-5pt.c', [('N', 100), ('M', 50)], [('Roofline', {'bw': 1.0})])
+            store.append('2d-5pt.c', [('M', 50), ('N', 100)], [('ECMData', {'cycles': 2.0})])
+            self.assertEqual(store.stored_models('2d-5pt.c', [('M', 50), ('N', 100)]),
+                             set(['ECMData', 'Roofline']))
+            self.assertEqual(store.get('2d-5pt.c', [('M', 50), ('N', 100)], 'Roofline'),
+                             {'bw': 1.0})
+            # Defines are returned as given
+            self.assertEqual([define for kernel, define, model, results in store.query()],
+                             [[('M', 50), ('N', 100)], [('N', 100), ('M', 50)]])
+
+        # Stores of earlier versions kept defines only in order of the command line
+        old_path = os.path.join(self.temp_dir, 'old.db')
+        connection = sqlite3.connect(old_path)
+        connection.executescript(
+            'CREATE TABLE results (id INTEGER PRIMARY KEY, kernel TEXT NOT NULL, '
+            'define TEXT NOT NULL, model TEXT NOT NULL, results BLOB NOT NULL);'
+            'CREATE TABLE constants (result INTEGER NOT NULL REFERENCES results (id), '
+            'name TEXT NOT NULL, value NOT NULL);')
+        connection.execute('INSERT INTO results (kernel, define, model, results) '
+                           'VALUES (?, ?, ?, ?)', ('2d-5pt.c', '[["N", 100], ["M", 50]]', 'LC',
+                                                   sqlite3.Binary(pickle.dumps({}, protocol=2))))
+        connection.commit()
+        connection.close()
+        with ResultStore(old_path) as store:
+            self.assertEqual(store.stored_models('2d-5pt.c', [('M', 50), ('N', 100)]),
+                             set(['LC']))
+            self.assertEqual([define for kernel, define, model, results in store.query()],
+                             [[('N', 100), ('M', 50)]])
+
+    def test_query(self):
+        store = ResultStore(self.path)
+        for n in range(100, 1100, 100):
+            store.append('copy.c', [('N', n)], [('ECMData', n), ('Roofline', -n)])
+        store.append('copy.c', [('N', 500)], [('ECMData', 0)])
+
+        self.assertEqual(
+            [(d, r) for k, d, m, r in store.query(model='ECMData', constants={'N': (300, 600)})],
+            [([('N', 300)], 300), ([('N', 400)], 400), ([('N', 600)], 600), ([('N', 500)], 0)])
+        self.assertEqual(list(store.query(kernel='copy.c', constants={'N': 200})), [
+            ('copy.c', [('N', 200)], 'ECMData', 200), ('copy.c', [('N', 200)], 'Roofline', -200)])
+        self.assertEqual(list(store.query(kernel='other.c')), [])
+        store.close()
+
+    def test_is_result_store(self):
+        self.assertTrue(is_result_store(self.path))
+        ResultStore(self.path).close()
+        self.assertTrue(is_result_store(self.path))
+
+        pickle_path = os.path.join(self.temp_dir, 'results.pickle')
+        with open(pickle_path, 'wb') as f:
+            pickle.dump({}, f)
+        self.assertFalse(is_result_store(pickle_path))
+        with self.assertRaises(AssertionError):
+            ResultStore(pickle_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
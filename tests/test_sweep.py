@@ -0,0 +1,94 @@
+'''
+Unit tests for sweep module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import unittest
+
+import numpy
+import sympy
+
+sys.path.insert(0, '..')
+from kerncraft.sweep import auto_define_product, level_ranges, smallest_integers, \
+    refine_defines, results_changed
+from kerncraft.kernel import Kernel
+from kerncraft.machinemodel import MachineModel
+from kerncraft.pycparser import clean_code
+
+
+class TestSweep(unittest.TestCase):
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def setUp(self):
+        self.machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        with open(self._find_file('2d-5pt.c')) as f:
+            self.kernel = Kernel(clean_code(f.read()))
+
+    def test_smallest_integers(self):
+        self.assertEqual(list(smallest_integers(lambda x: x**2, [1, 2, 99, 100, 101, 10**12])),
+                         [1, 2, 10, 10, 11, 10**6])
+        self.assertEqual(list(smallest_integers(lambda x: 8*x, [8, 800], minimum=3)), [3, 100])
+
+    def test_level_ranges(self):
+        # Machine files use decimal prefixes
+        self.assertEqual(level_ranges(self.machine, 800, 2**30), [
+            ('L1', 800, 32000), ('L2', 32000, 256000), ('L3', 256000, 20000000),
+            ('MEM', 20000000, 2**30)])
+        self.assertEqual(level_ranges(self.machine, 800, 2**30, ['L2', 'MEM']), [
+            ('L2', 32000, 256000), ('MEM', 20000000, 2**30)])
+        with self.assertRaises(AssertionError):
+            level_ranges(self.machine, 800, 2**30, ['L4'])
+
+    def test_inner(self):
+        N, M = sympy.symbols('N M')
+        defines = auto_define_product(self.kernel, self.machine, points=5)
+        self.assertEqual(len(defines), 4*5)
+        self.assertEqual([c for c, v in defines[0]], [N, M])
+
+        for (n_constant, n), (m_constant, m) in defines:
+            # Inner-most dimension grows, the others keep the data set at 1GB (at least 3 rows)
+            self.assertGreaterEqual(8*n*m, 1024**3)
+            self.assertTrue(m == 3 or 8*n*(m-1) < 1024**3)
+        rows = [8*d[0][1] for d in defines]
+        self.assertEqual(rows, sorted(rows))
+        # Five rows per level, the last one exactly fills the level
+        self.assertEqual(sum([32000 >= r for r in rows]), 5)
+        self.assertEqual(sum([32000 < r <= 256000 for r in rows]), 5)
+        self.assertIn(32000, rows)
+
+    def test_total(self):
+        N, M = sympy.symbols('N M')
+        defines = auto_define_product(
+            self.kernel, self.machine, points=3, levels=['L2', 'L3'], mode='total')
+        self.assertEqual(len(defines), 2*3)
+        for define in defines:
+            self.assertEqual(define[0][1], define[1][1])
+            self.assertGreater(2*8*define[0][1]**2, 32000)
+            self.assertLess(2*8*(define[0][1]-1)**2, 20000000)
+
+
+    def test_results_changed(self):
+        self.assertFalse(results_changed(
+            {'a': [1.0, 'x'], 'b': 2}, {'a': [1.01, 'y'], 'b': 2}, 0.05))
+        self.assertTrue(results_changed({'a': [1.0], 'b': 2}, {'a': [1.1], 'b': 2}, 0.05))
+        self.assertTrue(results_changed([1, 2], [1, 2, 3], 0.05))
+
+    def test_refine_defines(self):
+        # Results change between 10 and 20 along N, with fixed M
+        analyzed = [([('N', n), ('M', 5)], [n > 12]) for n in [10, 20, 30]]
+        self.assertEqual(refine_defines(analyzed), [[('N', 15), ('M', 5)]])
+        analyzed += [([('N', n), ('M', 5)], [n > 12]) for n in [12, 13, 15]]
+        self.assertEqual(refine_defines(analyzed), [])
+        self.assertEqual(refine_defines(analyzed[:3], resolution=10), [])
+
+if __name__ == '__main__':
+    unittest.main()